@@ -0,0 +1,433 @@
+'''
+    MacroBench - benchmark MacroScanner on synthetic cookbooks
+
+    Copyright (C) 2020 LociOiling
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    Details:
+
+    Generate a synthetic all.macro or single.macro cookbook,
+    then time each phase of MacroScanner on it:
+
+        parse   - JSON Spirit to dictionaries (SpiritMembers, JSONize)
+        codegen - dictionaries to Lua, in memory (ListCmds, ListLua)
+        output  - Lua to files in a scratch directory
+        scan    - the whole MacroScanner run, start to finish
+
+    Each phase reports seconds, recipes/sec, commands/sec, and
+    peak memory. Timing is the best of --repeat runs. Peak memory
+    comes from a separate run under tracemalloc, which slows
+    things down too much to time at the same time. For the scan
+    phase, only the main process is traced, not --jobs workers.
+
+    The mix of recipes is controlled by the options: how many,
+    the share of GUI recipes, which GUI commands and ingredient
+    shapes appear, how many commands per GUI recipe, and how long
+    the Lua scripts are. The same seed gives the same cookbook.
+
+    Options MacroBench doesn't know are passed to MacroScanner
+    for the scan phase, for example --jobs 4 or --detail.
+
+    version 1.2
+'''
+
+import argparse
+import sys
+import os
+import io
+import json
+import random
+import time
+import tracemalloc
+import tempfile
+import shutil
+import contextlib
+
+import MacroScanner
+
+#
+#   generator - build the recipes for a synthetic cookbook
+#
+#   the command names and their ingredients come from the
+#   rxcmds table in MacroScanner, so new commands get
+#   covered without changing the generator
+#
+ResiduesShapes = ( "all", "by_stride", "ref", "undefined" )
+BandsShapes = ( "all", "connected", "reference", "undefined" )
+
+#
+#   simple ingredients, and the values they take when defined
+#
+IngredientValues = {
+    "num_of_iterations":    [ "1", "2", "5", "0" ],
+    "structure":            [ "0", "1", "2" ],
+    "aa":                   [ "g", "a", "w" ],
+    "strength":             [ "0.5", "1", "2" ],
+    "importance":           [ "0.1", "0.5", "1" ],
+    "slot":                 [ "1", "2", "3" ],
+    "comment":              [ "hello, world #1", "first line\nsecond line \"quoted\"" ],
+    }
+
+def GuiArgs ( cmd ):
+#
+#   the quicksave and quickload commands take a slot,
+#   which isn't listed in rxcmds
+#
+    args = MacroScanner.CmdWriter.rxcmds [ cmd ] [ 1 ]
+    if len ( args ) == 0 and "Quick" in cmd:
+        args = [ "slot" ]
+    return args
+
+def SpiritText ( obj ):
+#
+#   JSON Spirit text of a dictionary, the way Foldit writes it:
+#   one pair per line, no commas, and nested objects as strings
+#
+    lines = [ "{\n" ]
+    for key in sorted ( obj ):
+        val = obj [ key ]
+        if isinstance ( val, dict ):
+            val = SpiritText ( val )
+        else:
+            val = val.replace ( ",", "\\," ).replace ( "#", "\\#" )
+        lines.append ( "{} : {}\n".format ( json.dumps ( key ), json.dumps ( val, ensure_ascii = False ) ) )
+    lines.append ( "}\n" )
+    return "".join ( lines )
+
+class RecipeMaker:
+    def __init__ ( self, options ):
+        self.rand = random.Random ( options.seed )
+        self.gui = options.gui
+        self.size = options.size
+        self.scriptlines = options.script_lines
+        self.commands = options.commands
+        self.resshapes = options.residues
+        self.bndshapes = options.bands
+
+    def value ( self, name ):
+        rand = self.rand
+        if rand.random () < 0.1:
+            return { "is_defined": "0", "name": name, "value": "0" }
+        return { "is_defined": "1", "name": name, "value": rand.choice ( IngredientValues [ name ] ) }
+
+    def index ( self, name ):
+        if self.rand.random () < 0.1:
+            return { "is_defined": "0", "name": name, "value": "0" }
+        return { "is_defined": "1", "name": name, "value": str ( self.rand.randint ( 1, 9 ) ) }
+
+    def residues ( self, refstart = True ):
+        rand = self.rand
+        shape = rand.choice ( self.resshapes )
+        if shape == "by_stride":
+            if refstart and rand.random () < 0.3:
+                start = { "name": "residues_ref", "ref-id": str ( rand.randint ( 1, 3 ) ) }
+            else:
+                start = { "name": "single_residue_by_index", "index": self.index ( "index" ) }
+            return { "name": "residues_by_stride", "start": start, "step": self.index ( "step" ) }
+        if shape == "ref":
+            return { "name": "residues_ref", "ref-id": str ( rand.randint ( 1, 3 ) ) }
+        return { "name": "residues_" + shape }
+
+    def bandset ( self ):
+        shape = self.rand.choice ( self.bndshapes )
+        bands = { "name": "bands_" + shape }
+        if shape == "reference":
+            bands [ "ref-id" ] = str ( self.rand.randint ( 1, 3 ) )
+        return bands
+
+    def action ( self ):
+        cmd = self.rand.choice ( self.commands )
+        act = { "name": cmd }
+        for arg in GuiArgs ( cmd ):
+            if arg == "residues" or arg == "residues1":
+                act [ arg ] = self.residues ()
+            elif arg == "residues2":
+            #
+            #   "by reference" then "by stride" starting from a
+            #   user pick is a combination MacroScanner can't handle
+            #
+                act [ arg ] = self.residues ( act [ "residues1" ] [ "name" ] != "residues_ref" )
+            elif arg == "bands":
+                act [ arg ] = self.bandset ()
+            else:
+                act [ arg ] = self.value ( arg )
+        return act
+
+    def recipe ( self, num, gui = None, size = None ):
+        rand = self.rand
+        if gui is None:
+            gui = rand.random () < self.gui
+        rxx = {
+            "name":         "Bench {}{}".format ( num, rand.choice ( [ "", " v2", "/x", " #3" ] ) ),
+            "desc":         rand.choice ( [ "plain", "with a comma, and a # sign", "uni é" ] ),
+            "folder_name":  "bench",
+            "hidden":       "0",
+            "mid":          str ( 100000 + num ),
+            "mrid":         str ( 200000 + num ),
+            "parent":       "0",
+            "parent_mrid":  "0",
+            "player_id":    str ( rand.randint ( 1, 50 ) ),
+            "share_scope":  "1",
+            "uses":         str ( rand.randint ( 0, 99 ) ),
+            }
+        if gui:
+            if size is None:
+                size = rand.randint ( 0, self.size )
+            rxx [ "type" ] = "gui"
+            rxx [ "size" ] = str ( size )
+            for cmdnum in range ( size ):
+                rxx [ "action-{}".format ( cmdnum ) ] = self.action ()
+        else:
+            rxx [ "type" ] = "script"
+            rxx [ "script_version" ] = rand.choice ( [ "1", "2" ] )
+            rxx [ "ver" ] = "0.1"
+            lines = [ "-- bench script {}, synthetic".format ( num ) ]
+            for line in range ( rand.randint ( 0, self.scriptlines ) ):
+                lines.append ( "x{} = x{} + {} -- # pad, pad".format ( line, line, line ) )
+            rxx [ "script" ] = "\n".join ( lines ) + "\n"
+        return rxx
+
+def GenCookbook ( maker, recipes ):
+#
+#   all.macro: one recipe per line, keyed by a
+#   16-digit number, the whole recipe as a string
+#
+    lines = [ "version: 1\n", "{\n" ]
+    for num in range ( recipes ):
+        recipe = SpiritText ( maker.recipe ( num ) )
+        lines.append ( "{} : {}\n".format ( json.dumps ( "{:016d}".format ( num + 1 ) ), json.dumps ( recipe, ensure_ascii = False ) ) )
+    lines.append ( "}\n" )
+    lines.append ( "verify: 0\n" )
+    return "".join ( lines )
+
+def GenSingle ( maker, size ):
+#
+#   single.macro: one GUI recipe, one attribute or
+#   action per line, sorted by name
+#
+    rxx = maker.recipe ( 0, True, size )
+    lines = [ "{\n" ]
+    for key in sorted ( rxx ):
+        val = rxx [ key ]
+        if isinstance ( val, dict ):
+            val = SpiritText ( val )
+        else:
+            val = val.replace ( ",", "\\," ).replace ( "#", "\\#" )
+        lines.append ( "{} : {}\n".format ( json.dumps ( key ), json.dumps ( val, ensure_ascii = False ) ) )
+    lines.append ( "}\n" )
+    return "".join ( lines )
+
+#
+#   phases - each one takes the result of the one before
+#
+def PhaseParse ( cookbook ):
+#
+#   parse the recipe lines, returns the list of recipes
+#
+    recipes = []
+    single = {}
+    with open ( cookbook, "rb" ) as fp:
+        for bline in fp:
+            if bline [ :7 ] == b"version" or bline [ :6 ] == b"verify" or bline [ :1 ] in ( b"{", b"}" ):
+                continue
+            whole = not single and not MacroScanner.RawActionKey.match ( bline )
+            rx = MacroScanner.SpiritMembers ( str ( bline, "utf-8" ), whole )
+            if "action-0" in rx or single:
+                single.update ( rx )
+                continue
+            for kk in rx:
+                recipes.append ( MacroScanner.JSONize ( rx [ kk ] ) )
+    if single:
+        recipes.append ( single )
+    for rxx in recipes:
+        MacroScanner.checkAttrs ( rxx )
+        if rxx [ "type" ] == "gui":
+            for cmdnum in range ( int ( rxx [ "size" ] ) ):
+                key = "action-{}".format ( cmdnum )
+                rxx [ key ] = MacroScanner.JSONize ( rxx [ key ] )
+    return recipes
+
+def PhaseCodegen ( recipes, outdir, detail ):
+#
+#   generate the Lua in memory, returns the list of ( path, text )
+#
+    held = MacroScanner.LuaArchive ()
+    for rxx in recipes:
+        if rxx [ "type" ] == "gui":
+            MacroScanner.ListCmds ( rxx, detail, outdir, False, held )
+        else:
+            MacroScanner.ListLua ( rxx, outdir, False, held )
+    return held.entries
+
+def PhaseOutput ( entries ):
+    for path, text in entries:
+        with MacroScanner.LuaFile.create ( path ) as fout:
+            fout.write ( text )
+    return len ( entries )
+
+def PhaseScan ( cookbook, outdir, scanargs ):
+#
+#   the whole program, as run from the command line
+#
+    argv = sys.argv
+    sys.argv = [ "MacroScanner.py", cookbook, os.devnull, "--outdir", outdir, "--LuaV1", "--LuaV2" ] + scanargs
+    try:
+        with contextlib.redirect_stdout ( io.StringIO () ):
+            MacroScanner.main ()
+    finally:
+        sys.argv = argv
+
+def Measure ( func, repeat, memory ):
+#
+#   returns best time, peak memory in bytes (or None), and the
+#   result of the last call
+#
+#   the ingredient memo and trivial commands are emptied 
+#   before each run, so no run is warmed up by the one before
+#
+    best = None
+    for run in range ( repeat ):
+        MacroScanner.ResetMemos ()
+        start = time.perf_counter ()
+        result = func ()
+        elapsed = time.perf_counter () - start
+        if best is None or elapsed < best:
+            best = elapsed
+    peak = None
+    if memory:
+        MacroScanner.ResetMemos ()
+        tracemalloc.start ()
+        try:
+            func ()
+            peak = tracemalloc.get_traced_memory () [ 1 ]
+        finally:
+            tracemalloc.stop ()
+    return best, peak, result
+
+def main ():
+    prog = 'python MacroBench.py'
+    description = ('Generate a synthetic Foldit cookbook and time '
+                   'each phase of MacroScanner on it.')
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument('--recipes', type=int, default=2000,
+                        help='number of recipes in the cookbook (default 2000)')
+    parser.add_argument('--gui', type=float, default=0.7,
+                        help='share of GUI recipes, 0 to 1 (default 0.7)')
+    parser.add_argument('--size', type=int, default=15,
+                        help='most commands in a GUI recipe, or the number of '
+                             'commands with --single (default 15)')
+    parser.add_argument('--script-lines', type=int, default=50,
+                        help='most lines in a Lua recipe (default 50)')
+    parser.add_argument('--commands',
+                        help='comma-separated GUI commands to use (default all)')
+    parser.add_argument('--residues', default=",".join ( ResiduesShapes ),
+                        help='comma-separated residues shapes to use (default all)')
+    parser.add_argument('--bands', default=",".join ( BandsShapes ),
+                        help='comma-separated bands shapes to use (default all)')
+    parser.add_argument('--single', action='store_true', default=False,
+                        help='generate a single.macro file instead of all.macro')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed (default 1)')
+    parser.add_argument('--generate', metavar='FILE',
+                        help='just write the cookbook to FILE, no timing')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each phase, the best time counts (default 3)')
+    parser.add_argument('--no-memory', action='store_true', default=False,
+                        help='skip the tracemalloc run for peak memory')
+    parser.add_argument('--detail', action='store_true', default=False,
+                        help='include details of each GUI command in Lua output')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE as JSON')
+
+    options, scanargs = parser.parse_known_args()
+
+    if options.commands:
+        options.commands = options.commands.split ( "," )
+    else:
+        options.commands = list ( MacroScanner.CmdWriter.rxcmds )
+    for cmd in options.commands:
+        if cmd not in MacroScanner.CmdWriter.rxcmds:
+            parser.error ( "unknown GUI command: {}".format ( cmd ) )
+    options.residues = options.residues.split ( "," )
+    for shape in options.residues:
+        if shape not in ResiduesShapes:
+            parser.error ( "unknown residues shape: {}".format ( shape ) )
+    options.bands = options.bands.split ( "," )
+    for shape in options.bands:
+        if shape not in BandsShapes:
+            parser.error ( "unknown bands shape: {}".format ( shape ) )
+    if options.detail:
+        scanargs.append ( "--detail" )
+
+    maker = RecipeMaker ( options )
+    if options.single:
+        text = GenSingle ( maker, options.size )
+    else:
+        text = GenCookbook ( maker, options.recipes )
+
+    if options.generate:
+        with open ( options.generate, "w", encoding = "utf-8" ) as fout:
+            fout.write ( text )
+        return
+
+    workdir = tempfile.mkdtemp ( prefix = "MacroBench" )
+    try:
+        cookbook = os.path.join ( workdir, "single.macro" if options.single else "all.macro" )
+        with open ( cookbook, "w", encoding = "utf-8" ) as fout:
+            fout.write ( text )
+        outdir = os.path.join ( workdir, "lua" )
+        os.makedirs ( outdir )
+        memory = not options.no_memory
+
+        results = []
+        parse = Measure ( lambda: PhaseParse ( cookbook ), options.repeat, memory )
+        recipes = parse [ 2 ]
+        codegen = Measure ( lambda: PhaseCodegen ( recipes, outdir, options.detail ), options.repeat, memory )
+        entries = codegen [ 2 ]
+        output = Measure ( lambda: PhaseOutput ( entries ), options.repeat, memory )
+        scandir = os.path.join ( workdir, "scan" )
+        scan = Measure ( lambda: PhaseScan ( cookbook, scandir, scanargs ), options.repeat, memory )
+
+        nrecipes = len ( recipes )
+        ncmds = 0
+        ngui = 0
+        for rxx in recipes:
+            if rxx [ "type" ] == "gui":
+                ngui += 1
+                ncmds += int ( rxx [ "size" ] )
+
+        print ( "{} - MacroBench".format ( MacroScanner.ReVersion ) )
+        print ( "cookbook = {}, {} bytes".format ( "single.macro" if options.single else "all.macro", os.path.getsize ( cookbook ) ) )
+        print ( "recipes = {}, GUI = {}, Lua = {}, GUI commands = {}".format ( nrecipes, ngui, nrecipes - ngui, ncmds ) )
+        print ( "{:<10}{:>10}{:>14}{:>14}{:>10}".format ( "phase", "seconds", "recipes/sec", "commands/sec", "peak MB" ) )
+        for name, ( best, peak, result ) in ( ( "parse", parse ), ( "codegen", codegen ), ( "output", output ), ( "scan", scan ) ):
+            rps = nrecipes / best if best > 0 else 0.0
+            cps = ncmds / best if best > 0 else 0.0
+            mb = "-" if peak is None else "{:.1f}".format ( peak / ( 1024 * 1024 ) )
+            print ( "{:<10}{:>10.3f}{:>14.1f}{:>14.1f}{:>10}".format ( name, best, rps, cps, mb ) )
+            results.append ( { "phase": name, "seconds": best, "recipes_per_sec": rps,
+                               "commands_per_sec": cps, "peak_bytes": peak } )
+
+        if options.json:
+            with open ( options.json, "w", encoding = "utf-8" ) as fout:
+                json.dump ( { "version": MacroScanner.ReVersion, "recipes": nrecipes, "gui": ngui,
+                              "commands": ncmds, "bytes": os.path.getsize ( cookbook ),
+                              "options": sys.argv [ 1: ], "phases": results }, fout, indent = 2 )
+                fout.write ( "\n" )
+    finally:
+        shutil.rmtree ( workdir, ignore_errors = True )
+
+if __name__ == "__main__":
+   main ()
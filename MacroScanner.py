@@ -44,14 +44,75 @@
         + handle missing number of iterations for GUI example 1
         + streamline some of the common error conditions
         + handle single.macro format
+    version 1.2
+        + single-pass JSON Spirit parser replaces the regex de-escape
+          and the repeated JSONize of each nested sub-document, only
+          actions and ingredients are parsed, other text is left as is
+        + JSONize runs in linear time on long recipes
+        + added jobs option to convert recipes in a process pool
+        + added batch option to scan many cookbooks in one run
+        + added cache option to reuse the Lua for unchanged recipes
+        + added incremental option to skip recipes unchanged since the last scan
+        + cookbooks are memory-mapped, and only the lines needed are decoded
+        + single.macro actions are converted as they're read
+        + GUI command generators are methods of CmdWriter, with the dispatch
+          tables built once instead of for every recipe
+        + the Lua for each recipe is collected in memory and written in one go,
+          new --atomic option writes it under a temporary name, then renames it
+        + new --archive option puts all the Lua files in one zip or tar archive
+        + added stats option to time each phase, per recipe and in total
+        + added results option to write a JSON Lines record for each recipe
+        + GUI recipes are parsed once into GuiCommand objects with typed,
+          pre-decoded ingredients, and the Lua is generated from those
+        + the Lua for GUI commands comes from LuaTemplates built once from
+          shared loop fragments, and the commands are written with one join
+        + new --dedup option converts recipes which do the same thing only once
+        + Cookbook.open indexes the recipes in a cookbook without decoding
+          them, for converting just the ones needed
+        + new --name, --folder, --player, --type, --script-version, --min-size
+          and --max-size options pick recipes without decoding the others
+        + new --serve option runs MacroScanner as an HTTP server, on a port or
+          a Unix socket, reusing its workers for each cookbook posted to it
+        + new --pipeline option reads, converts, and writes in overlapping
+          stages, with bounded asyncio queues between them
+        + trivial commands, like wiggle or quicksave, are parsed and converted
+          once for each different text, then just looked up
+        + ingredients are decoded once for each different text, and kept in
+          a bounded LRU memo, with its hits and misses in the summary
+        + new --skip-identical option leaves Lua files alone if they already
+          hold the same Lua, and counts the files written and unchanged
+        + each recipe in a cookbook gets its own Lua file, recipes whose names
+          come out the same get a numbered suffix instead of overwriting
 '''
 
 import argparse
+import asyncio
 import sys
 import os
 import json
 import re
+import string
+import collections
+import itertools
+import concurrent.futures
+import filecmp
+import glob
+import hashlib
+import shutil
+import io
+import mmap
+import tempfile
+import contextlib
+import http.server
+import socketserver
+import stat
+import zipfile
+import tarfile
+import threading
+import time
+import warnings
 
+ReVersion = "MacroScanner 1.2"
 
 #
 #   JSONize - convert JSON-spirit to JSON
@@ -68,6 +129,12 @@ import re
 #
 #   motto: we're gonna needa bigger hammer!
 #
+#   The hammer used to glue the output together
+#   one line at a time, which took forever on a
+#   long script. Now it just notes where the lines
+#   start and end (the same places splitlines would
+#   break them), and joins the pieces once at the end.
+#
 #   arguments:
 #   
 #   spirit - string containing the spirit-formatted pairs
@@ -78,32 +145,494 @@ import re
 #   The values in the dictionary may in turn 
 #   need to be JSONized.
 #
+#   Values which have already been through
+#   SpiritLoads (below) are dictionaries, or
+#   for trivial commands, GuiCommands, and
+#   get passed back as is.
+#
+JSONizeBreaks = re.compile ( r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]" )
+
 def JSONize ( spirit ):
-    rlines = spirit.splitlines ()
-    scount = len ( rlines )
-    rout = ""
+    if not isinstance ( spirit, str ):
+        return spirit
+    starts = [ 0 ]
+    ends = []
+    for brk in JSONizeBreaks.finditer ( spirit ):
+        ends.append ( brk.start () )
+        starts.append ( brk.end () )
+    ends.append ( len ( spirit ) )
+    if starts [ -1 ] == len ( spirit ):   # no empty line after the last break
+        starts.pop ()
+        ends.pop ()
+    scount = len ( starts )
+    rout = [ "{\n" ]
     lout = 0
-    for rll in rlines:
+    for start, end in zip ( starts, ends ):
         lout = lout + 1
-        if  not rll.find ( "{" ) == 0 \
-        and not rll.find ( "}" ) == 0:
+        if  not spirit.startswith ( "{", start, end ) \
+        and not spirit.startswith ( "}", start, end ):
+            rout.append ( spirit [ start:end ] )
             if lout < scount - 1:
-                rout = rout + rll + ",\n" # add a comma
-            else:
-                rout = rout + rll         # no comma on last one
-    rout = "{\n" + rout + "\n}\n"         # we know it can do that
-    rxx = json.loads ( rout )
+                rout.append ( ",\n" )    # add a comma, but no comma on last one
+    rout.append ( "\n}\n" )             # we know it can do that
+    rxx = json.loads ( "".join ( rout ) )
     return rxx
 
-def ListLua ( rxx, outdir ):
+#
+#   SpiritLoads - parse JSON Spirit in a single pass
+#
+#   Finally, the parser we shoulda wrote.
+#
+#   Handles the Foldit quirks directly:
+#
+#   + commas between the K-V pairs are optional
+#   + a run of backslashes in front of "," or "#" is
+#     dropped, same as the old regular expression
+#     de-escape did to the entire line
+#   + a string value which is itself a JSON Spirit
+#     object (recipes, actions, ingredients) is parsed
+#     into a dictionary as soon as it's decoded, so
+#     the whole nested structure comes out in one go
+#
+#   Only the values of keys known to hold objects get
+#   the nested treatment (see spiritContainer below), 
+#   so a description or comment that happens to look 
+#   like JSON stays the text the user typed.
+#
+#   Strings are decoded by the json module's own
+#   scanner, so long Lua scripts aren't walked one
+#   character at a time in Python.
+#
+#   SpiritLoads coughs up a json.JSONDecodeError
+#   if it can't cope with its input.
+#
+#   arguments:
+#
+#   spirit - string containing a JSON Spirit value
+#
+#   returns:
+#
+#   Python dictionary (usually) with any nested
+#   JSON Spirit objects already converted to
+#   dictionaries
+#
+SpiritStringEnd = re.compile ( r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL )
+SpiritCommas = re.compile ( r"(\\+)([#,])" )
+SpiritSpace = re.compile ( r'[ \t\n\r]*' )
+SpiritColon = re.compile ( r'[ \t\n\r]*:[ \t\n\r]*' )
+SpiritComma = re.compile ( r'[ \t\n\r]*(?:,[ \t\n\r]*)?' )
+SpiritNumber = re.compile ( r'-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?' )
+SpiritConstants = {
+    "true":     True,
+    "false":    False,
+    "null":     None,
+    }
+
+def spiritString ( doc, pos ):
+#
+#   pos is just past the opening quote,
+#   returns the decoded string and the
+#   position just past the closing quote
+#
+#   a run of backslashes in front of "," or "#"
+#   survives decoding as a (shorter) run, so it
+#   gets dropped from the decoded value, same as
+#   the old regular expression de-escape did to
+#   the entire line
+#
+    try:
+        value, pos = json.decoder.scanstring ( doc, pos, False )
+    except json.JSONDecodeError:
+    #
+    #   the scanner choked, most likely on an odd
+    #   number of backslashes in front of "," or "#",
+    #   so drop those before decoding
+    #
+        end = SpiritStringEnd.match ( doc, pos )
+        if end is None:
+            raise json.JSONDecodeError ( "Unterminated string starting at", doc, pos - 1 )
+        raw = SpiritCommas.sub ( r"\2", doc [ pos:end.end () ] )
+        try:
+            value, rend = json.decoder.scanstring ( raw, 0, False )
+        except json.JSONDecodeError as erred:
+            raise json.JSONDecodeError ( erred.msg, doc, pos + erred.pos ) from None
+        return value, end.end ()
+    if "\\," in value or "\\#" in value:
+        value = SpiritCommas.sub ( r"\2", value )
+    return value, pos
+
+SpiritContainers = ( "start", "index", "step" )
+
+def spiritContainer ( key ):
+#
+#   true if the value of key is a nested JSON Spirit
+#   object: an action, an ingredient, or one of the 
+#   parts of a residues ingredient
+#
+    return key [ :7 ] == "action-" or key in rxargs or key in SpiritContainers
+
+def spiritNested ( value, key = None ):
+#
+#   a string that looks like a JSON Spirit object
+#   gets parsed, anything else stays a string
+#
+#   a short action may be a trivial command seen 
+#   before, which comes back as its GuiCommand
+#   (see TrivialCommand below)
+#
+#   key is the name it goes by, if that's one of
+#   the rxargs, the value is an ingredient, which 
+#   comes back decoded (see IngredientMemo below)
+#
+    if value [ :1 ] != "{":
+        return value
+    trivial = key is not None and key [ :7 ] == "action-" and len ( value ) <= TrivialLength
+    if trivial:
+        cmd = TrivialCommands.get ( value )
+        if cmd is not None:
+            return cmd
+    getter = rxargs.get ( key )
+    if getter is not None:
+        if len ( value ) > IngredientLength:
+            getter = None
+        else:
+            found = Ingredients.get ( getter, value )
+            if found is not None:
+                return found
+    try:
+        obj, pos = spiritObject ( value, 1 )
+    except json.JSONDecodeError:
+        return value
+    if SpiritSpace.match ( value, pos ).end () != len ( value ):
+        return value
+    if getter is not None:
+        return Ingredients.add ( getter, key, value, obj )
+    if trivial and obj.get ( "name" ) in TrivialArgs:
+        return TrivialCommand ( value, obj )
+    return obj
+
+def spiritValue ( doc, pos ):
+    try:
+        nxt = doc [ pos ]
+    except IndexError:
+        raise json.JSONDecodeError ( "Expecting value", doc, pos )
+    if nxt == '"':
+        return spiritString ( doc, pos + 1 )
+    if nxt == "{":
+        return spiritObject ( doc, pos + 1 )
+    if nxt == "[":
+        return spiritArray ( doc, pos + 1 )
+    for word, const in SpiritConstants.items ():
+        if doc.startswith ( word, pos ):
+            return const, pos + len ( word )
+    number = SpiritNumber.match ( doc, pos )
+    if number is None:
+        raise json.JSONDecodeError ( "Expecting value", doc, pos )
+    if number.group ( 1 ) or number.group ( 2 ):
+        return float ( number.group () ), number.end ()
+    return int ( number.group () ), number.end ()
+
+def spiritObject ( doc, pos, closer = "}", recipes = False ):
+#
+#   pos is just past the opening brace,
+#   commas between pairs are optional
+#
+#   with no closer, the pairs run to the
+#   end of doc, which is how they appear
+#   one per line in all.macro
+#
+#   with recipes, every value is a whole recipe,
+#   otherwise only the values of container keys
+#   get parsed
+#
+    obj = {}
+    end = len ( doc )
+    pos = SpiritSpace.match ( doc, pos ).end ()
+    while True:
+        if closer:
+            if doc [ pos:pos + 1 ] == closer:
+                return obj, pos + 1
+        elif pos >= end:
+            return obj, pos
+        if doc [ pos:pos + 1 ] != '"':
+            raise json.JSONDecodeError ( "Expecting property name enclosed in double quotes", doc, pos )
+        key, pos = spiritString ( doc, pos + 1 )
+        colon = SpiritColon.match ( doc, pos )
+        if colon is None:
+            raise json.JSONDecodeError ( "Expecting ':' delimiter", doc, pos )
+        pos = colon.end ()
+    #
+    #   string values are by far the most common,
+    #   so they get the short way around
+    #
+        if doc [ pos:pos + 1 ] == '"':
+            value, pos = spiritString ( doc, pos + 1 )
+            if value [ :1 ] == "{" and ( recipes or spiritContainer ( key ) ):
+                value = spiritNested ( value, key )
+            obj [ key ] = value
+        else:
+            obj [ key ], pos = spiritValue ( doc, pos )
+        pos = SpiritComma.match ( doc, pos ).end ()
+
+def spiritArray ( doc, pos ):
+    arr = []
+    pos = SpiritSpace.match ( doc, pos ).end ()
+    if doc [ pos:pos + 1 ] == "]":
+        return arr, pos + 1
+    while True:
+        value, pos = spiritValue ( doc, pos )
+        arr.append ( value )
+        pos = SpiritComma.match ( doc, pos ).end ()
+        if doc [ pos:pos + 1 ] == "]":
+            return arr, pos + 1
+        if pos >= len ( doc ):
+            raise json.JSONDecodeError ( "Expecting ',' delimiter", doc, pos )
+
+def SpiritLoads ( spirit ):
+    pos = SpiritSpace.match ( spirit, 0 ).end ()
+    obj, pos = spiritValue ( spirit, pos )
+    pos = SpiritSpace.match ( spirit, pos ).end ()
+    if pos != len ( spirit ):
+        raise json.JSONDecodeError ( "Extra data", spirit, pos )
+    return obj
+
+#
+#   SpiritMembers - parse K-V pairs without the enclosing braces
+#
+#   A line of all.macro is just one "key" : "value" pair,
+#   this saves gluing braces around it first.
+#
+#   recipes is true for a line of all.macro, where the
+#   value is a recipe, and false for a line of 
+#   single.macro, where it's one recipe attribute.
+#
+def SpiritMembers ( spirit, recipes = False ):
+    obj, pos = spiritObject ( spirit, 0, "", recipes )
+    return obj
+
+FileNameDrop = re.compile ( r'(?u)[^-\w.]' )
+
+def get_valid_filename(s):  # borrowed from Django
+    s = str(s).strip().replace(' ', '_')
+    return FileNameDrop.sub('', s)
+
+#
+#   LuaFileName - name of the Lua file for a recipe
+#
+def LuaFileName ( rxx ):
+    return get_valid_filename ( rxx [ "name" ] ) + ".lua" 
+
+#
+#   LuaFileNames - hand out the Lua file names for one cookbook
+#
+#   Two recipes can end up with the same LuaFileName, since 
+#   get_valid_filename drops characters, and on Windows and 
+#   macOS, names that differ only in case are the same file.
+#   "Recipe 8#3" and "Recipe 83" both make "Recipe_83.lua",
+#   and the second one used to overwrite the first.
+#
+#   ScanCookbook allocates a name for every recipe in the 
+#   cookbook, in cookbook order, before any recipe goes to
+#   the RecipeQueue, so every recipe has its own file, and no 
+#   two workers ever write the same one. A name that's taken 
+#   gets a suffix, "Recipe_83_2.lua", then "Recipe_83_3.lua",
+#   and so on. Recipes which are skipped, filtered out, or 
+#   can't be decoded get a name too, even though nothing is 
+#   written, so a recipe's file has the same name whatever 
+#   the options, and Cookbook, which names every entry, 
+#   agrees with ScanCookbook.
+#
+class LuaFileNames:
+    def __init__ ( self ):
+        self.used = set ()
+
+    def allocate ( self, rxx ):
+        base = get_valid_filename ( rxx [ "name" ] )
+        fname = base + ".lua"
+        seq = 1
+        while fname.casefold () in self.used:
+            seq = seq + 1
+            fname = "{}_{}.lua".format ( base, seq )
+        self.used.add ( fname.casefold () )
+        return fname
+
+#
+#   LuaFile - collect the Lua for one recipe, and write it 
+#   to disk in one go
+#
+#   The generators make lots of little writes, which are slow
+#   on a network drive. A LuaFile keeps them in memory, and 
+#   writes the file when the with block ends. If the block
+#   ends with an exception, nothing is written, so there's no 
+#   partial Lua file left behind.
+#
+#   With atomic, the file is written under a temporary name,
+#   then renamed, so a crash in the middle of the write can't 
+#   leave a partial file either.
+#
+#   With archive, the file goes into the archive instead of 
+#   outdir (see LuaArchive below).
+#
+#   LuaFile.save writes text that's already in hand, and with 
+#   identical, leaves the file alone if it already holds the
+#   same text, so its modification time doesn't change and 
+#   whatever syncs outdir has nothing to do.
+#
+class LuaFile ( io.StringIO ):
+    def __init__ ( self, path, atomic = False, archive = None ):
+        super ().__init__ ()
+        self.path = path
+        self.atomic = atomic
+        self.archive = archive
+
+    def __exit__ ( self, etype, evalue, tb ):
+        if etype is None:
+            start = time.perf_counter ()
+            if self.archive is not None:
+                self.archive.add ( self.path, self.getvalue () )
+            else:
+                with LuaFile.create ( self.path, self.atomic ) as fout:
+                    fout.write ( self.getvalue () )
+            if Timing is not None:
+                Timing [ "output" ] += time.perf_counter () - start
+        return super ().__exit__ ( etype, evalue, tb )
+
+    @staticmethod
+    @contextlib.contextmanager
+    def create ( path, atomic = False, archive = None ):
+    #
+    #   open a Lua file for writing, under a 
+    #   temporary name first if atomic
+    #
+        if archive is not None:
+            fout = io.StringIO ()
+            yield fout
+            archive.add ( path, fout.getvalue () )
+            return
+        if not atomic:
+            with open ( path, "w" ) as fout:
+                yield fout
+            return
+        tmppath = "{}.{}.tmp".format ( path, os.getpid () )
+        try:
+            with open ( tmppath, "w" ) as fout:
+                yield fout
+            os.replace ( tmppath, path )
+        except BaseException:
+            if os.path.exists ( tmppath ):
+                os.remove ( tmppath )
+            raise
+
+    @staticmethod
+    def same ( path, text ):
+    #
+    #   True if the file at path already holds text,
+    #   exactly as open ( path, "w" ) would write it
+    #
+        if os.linesep != "\n":
+            text = text.replace ( "\n", os.linesep )
+        try:
+            if os.path.getsize ( path ) < len ( text ):
+                return False
+            with open ( path, newline = "" ) as fin:
+                return fin.read () == text
+        except ( OSError, UnicodeDecodeError ):
+            return False
+
+    @staticmethod
+    def save ( path, text, atomic = False, identical = False ):
+    #
+    #   returns False if the file was left alone
+    #
+        if identical and LuaFile.same ( path, text ):
+            return False
+        with LuaFile.create ( path, atomic ) as fout:
+            fout.write ( text )
+        return True
+
+#
+#   LuaArchive - put the Lua files in one zip or tar archive
+#
+#   With --archive, no Lua files are written to outdir. There's
+#   one archive instead, laid out the way outdir would have been.
+#   The archive type follows the extension: .zip, or .tar with
+#   optional .gz, .bz2, or .xz compression.
+#
+#   A recipe may be converted in a worker process, which can't
+#   write to the archive. There, the Lua goes in a LuaArchive 
+#   with no path, which just keeps a list of ( path, text )
+#   entries. The list goes back to the main process, which 
+#   adds the entries to the real archive.
+#
+#   With fileobj, the archive is written there instead, the
+#   path just says what type of archive it is.
+#
+#   Each recipe gets its own entry, with a name from 
+#   LuaFileNames.
+#
+TarModes = (
+    ( ".tar",       "w" ),
+    ( ".tar.gz",    "w:gz" ),
+    ( ".tgz",       "w:gz" ),
+    ( ".tar.bz2",   "w:bz2" ),
+    ( ".tar.xz",    "w:xz" ),
+    )
+
+class LuaArchive:
+    def __init__ ( self, path = None, root = ".", fileobj = None ):
+        self.root = root
+        self.entries = []
+        self.count = 0
+        self.zip = None
+        self.tar = None
+        if path is None:
+            return
+        lower = path.lower ()
+        if lower.endswith ( ".zip" ):
+            self.zip = zipfile.ZipFile ( fileobj or path, "w", zipfile.ZIP_DEFLATED )
+            return
+        for ext, mode in TarModes:
+            if lower.endswith ( ext ):
+                self.tar = tarfile.open ( path, mode, fileobj )
+                return
+        raise ValueError ( "archive type not recognized: {}".format ( path ) )
+
+    def add ( self, path, text ):
+        if self.zip is None and self.tar is None:
+            self.entries.append ( ( path, text ) )
+            return
+        arcname = os.path.relpath ( path, self.root ).replace ( os.sep, "/" )
+        data = text.encode ( "utf-8" )
+        if self.zip is not None:
+            info = zipfile.ZipInfo ( arcname, time.localtime () [ :6 ] )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with warnings.catch_warnings ():
+                warnings.simplefilter ( "ignore" )      # duplicate names
+                self.zip.writestr ( info, data )
+        else:
+            info = tarfile.TarInfo ( arcname )
+            info.size = len ( data )
+            info.mtime = time.time ()
+            info.mode = 0o644
+            self.tar.addfile ( info, io.BytesIO ( data ) )
+        self.count += 1
+
+    def extend ( self, entries ):
+        for path, text in entries:
+            self.add ( path, text )
+
+    def close ( self ):
+        if self.zip is not None:
+            self.zip.close ()
+        if self.tar is not None:
+            self.tar.close ()
+
+def ListLua ( rxx, outdir, atomic = False, archive = None, filename = None ):
 #
 #   process entire recipe
 #
-    def get_valid_filename(s):  # borrowed from Django
-        s = str(s).strip().replace(' ', '_')
-        return re.sub(r'(?u)[^-\w.]', '', s)
-    rxxfile = get_valid_filename ( rxx [ "name" ] ) + ".lua" 
-    with open ( os.path.join ( outdir, rxxfile ), "w" ) as fout:
+    rxxfile = filename or LuaFileName ( rxx )
+    with LuaFile ( os.path.join ( outdir, rxxfile ), atomic, archive ) as fout:
     #
     #   print the recipe attributes as a Lua block comment
     #   (slightly different list than the one for a GUI recipe)
@@ -135,7 +664,7 @@ def ListLua ( rxx, outdir ):
             fout.write ( "{}\n".format ( line ) )
         except:
             pass
-    return
+    return os.path.join ( outdir, rxxfile )
 
 #
 #   ListCmds - list the commands in a GUI recipe
@@ -145,854 +674,1155 @@ def ListLua ( rxx, outdir ):
 #   rxx    - JSON object containing recipe
 #   detail - include dump of GUI values as comments if true
 #   outdir - output directory
+#   atomic - write the file under a temporary name, then rename it
+#   archive - LuaArchive to put the file in, instead of outdir
+#   filename - name of the Lua file, from LuaFileNames, 
+#              if not just the LuaFileName
 #
-#   note: lots of helper functions first - 
-#         the action starts far down below,
-#         just before "def main" 
+#   returns:
+#
+#   path of the Lua file written
+#
+def ListCmds ( rxx, detail, outdir, atomic = False, archive = None, filename = None ):
+    rxxfile = filename or LuaFileName ( rxx )
+    with LuaFile ( os.path.join ( outdir, rxxfile ), atomic, archive ) as fout:
+        ListCmdsHeader ( rxx, fout )
+        gencmd = CmdWriter ( fout, detail )
+    #
+    #   print each command 
+    #
+        for cmdnum, cmd in enumerate ( CompileRecipe ( rxx ) ):
+            gencmd ( cmdnum, cmd )
+        gencmd.flush ()
+
+    return os.path.join ( outdir, rxxfile )
+
+def ListCmdsHeader ( rxx, fout ):
+#
+#   print the recipe attributes as a Lua block comment
+#   (this list of attributes is specific to GUI recipes)
+#
+    rxattrs = [
+         "name",
+         "desc",
+         "size",
+         "type",
+         "folder_name", 
+         "hidden",
+         "mid",
+         "mrid",
+         "parent",
+         "parent_mrid",
+         "player_id",
+         "share_scope",
+         "uses"
+         ]
+    fout.write ( "--[[\n\n" )
+    for attr in rxattrs:
+        fout.write ( "    {} = {}\n".format ( attr, rxx [ attr ] ) )
+    fout.write ( "\n]]--\n" )
+    return
+
+#
+#   Ingredients - the arguments of the GUI commands
+#
+#   each getXxx function takes the name of an argument
+#   and its JSON object, and returns the decoded ingredient
+#
+#   the ingredients are small typed objects rather than 
+#   dictionaries, so the generators get attributes, and 
+#   counts like iterations, indexes and slots come back 
+#   as ints
+#
+def Count ( val ):
+#
+#   decode a count, but only if it goes back to exactly 
+#   the same text, so the Lua comes out as it always did 
+#
+    try:
+        num = int ( val )
+    except ValueError:
+        return val
+    if str ( num ) == val:
+        return num
+    return val
+
+class Ingredient:
+#
+#   base for the ingredient types, only the attributes 
+#   actually found are set, in the order they were found
+#
+    __slots__ = ()
+    fields = ()
+
+    def __init__ ( self, name, **kwargs ):
+        self.name = name
+        for key in kwargs:
+            setattr ( self, key, kwargs [ key ] )
+
+    def asdict ( self ):
+    #
+    #   the ingredient as text, the way --detail shows it
+    #
+        out = {}
+        for key in self.fields:
+            if hasattr ( self, key ):
+                out [ key ] = str ( getattr ( self, key ) )
+        return out
+
+class Residues ( Ingredient ):
+    __slots__ = ( "name", "startnam", "startval", "stepval", "ref" )
+    fields = __slots__
+
+class Bands ( Ingredient ):
+    __slots__ = ( "name", "ref" )
+    fields = __slots__
+
+class Value ( Ingredient ):
+    __slots__ = ( "name", "val" )
+    fields = __slots__
+
+#
+#   complex residues ingredient
+#
+def getResAll ( rxx ):
+    return {}
+def getResByStride ( rxx ):
+    startxx = JSONize ( rxx [ "start" ] )
+    startnam = startxx [ "name" ]
+    startval = -1
+    if startnam == "single_residue_by_index":
+        indexxx = JSONize ( startxx [ "index" ] )
+        if indexxx [ "is_defined" ] == "1":
+            startval = Count ( indexxx [ "value" ] )
+    if startnam == "residues_ref":
+        startval = Count ( startxx [ "ref-id" ] )
+    stepxx = JSONize ( rxx [ "step" ] )
+    stepval = -1
+    if stepxx [ "is_defined" ] == "1":
+        stepval = Count ( stepxx [ "value" ] )
+
+    return { "startnam": startnam, "startval": startval, "stepval": stepval } # really not *that* bad
+def getResReference ( rxx ):
+    val = Count ( rxx [ "ref-id" ] )
+    return { "ref": val }
+def getResUndefined ( rxx ):
+    return {}
+resnames = {
+    "residues_all":         [ "all",        getResAll ],
+    "residues_by_stride":   [ "by_stride",  getResByStride ],
+    "residues_ref":         [ "reference",  getResReference ],
+    "residues_undefined":   [ "undefined",  getResUndefined ],
+    }
+def getResidues ( arg, rxx ):
+    rnam = rxx [ "name" ]        
+    return Residues ( rnam, **resnames [ rnam ] [ 1 ] ( rxx ) )
 #
-def ListCmds ( rxx, detail, outdir ):
+#   somewhat complex bands ingredient
+#
+def getBndAll ( rxx ):
+    return {}
+def getBndConnected ( rxx ):
+    return {}
+def getBndReference ( rxx ):
+    val = Count ( rxx [ "ref-id" ] )
+    return { "ref": val }
+def getBndUndefined ( rxx ):
+    return {}
+bndnames = {
+    "bands_all":        [ "all",        getBndAll ],
+    "bands_connected":  [ "connected",  getBndConnected ],
+    "bands_reference":  [ "reference",  getBndReference ],
+    "bands_undefined":  [ "undefined",  getBndUndefined ],
+    }
+def getBands ( arg, rxx ):
+    rnam = rxx [ "name" ]        
+    return Bands ( rnam, **bndnames [ rnam ] [ 1 ] ( rxx ) )
+#
+#   simple ingredients, just one value each
+#
+def getIters ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = Count ( rxx [ "value" ] )
+    else:
+        val = -1
+    return Value ( rxx [ "name" ], val=val )
+def getStructure ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = Count ( rxx [ "value" ] )
+    else:
+        val = -1
+    return Value ( rxx [ "name" ], val=val )
+def getAA ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = rxx [ "value" ]
+    else:
+        val = "-1"
+    return Value ( rxx [ "name" ], val=val )
+def getStrength ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = rxx [ "value" ]
+    else:
+        val = "-1"
+    return Value ( rxx [ "name" ], val=val )
+def getImportance ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = rxx [ "value" ]
+    else:
+        val = "-1"
+    return Value ( rxx [ "name" ], val=val )
+def getSlot ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = Count ( rxx [ "value" ] )
+    else:
+        val = -1
+    return Value ( rxx [ "name" ], val=val )
+def getComment ( arg, rxx ):
+    if rxx [ "is_defined" ] == "1":
+        val = rxx [ "value" ]
+    else:
+        val = "(TODO: add comment here)"
+    return Value ( rxx [ "name" ], val=val )
+
+#
+#   rxargs tells which function to call for a given ingredient
 #   
+rxargs = {
+    "num_of_iterations":                    getIters,
+    "residues":                             getResidues,
+    "residues1":                            getResidues,
+    "residues2":                            getResidues,
+    "structure":                            getStructure,
+    "aa":                                   getAA,
+    "bands":                                getBands,
+    "strength":                             getStrength,
+    "importance":                           getImportance,
+    "slot":                                 getSlot,
+    "comment":                              getComment,
+    }
+
+#
+#   IngredientMemo - ingredients decoded from their text, 
+#   most recently used first
+#
+#   The same few ingredients turn up all through a cookbook,
+#   "all residues", iterations of 1 or 25, a stride of 1 
+#   starting at 1, and so on. spiritNested looks the text of
+#   each ingredient up here before parsing it. On a miss, it
+#   parses the text, and the getter from rxargs decodes it,
+#   as ParseCommand would, and the result is kept for next
+#   time. The getter is part of the key, so the text only 
+#   ever gets decoded the way the ingredient's name says.
+#
+#   The memo holds at most size ingredients, the ones used 
+#   least recently are dropped when it's full. The decoded
+#   ingredients are shared, so nothing may change them.
+#
+#   Ingredients with text longer than IngredientLength, like
+#   long comments, aren't kept.
+#
+class IngredientMemo:
+    def __init__ ( self, size ):
+        self.size = size
+        self.memo = collections.OrderedDict ()
+        self.hits = 0
+        self.misses = 0
+
+    def clear ( self ):
+        self.memo.clear ()
+        self.hits = 0
+        self.misses = 0
+
+    def get ( self, getter, text ):
+        found = self.memo.get ( ( getter, text ) )
+        if found is not None:
+            self.memo.move_to_end ( ( getter, text ) )
+            self.hits += 1
+        return found
+
+    def add ( self, getter, arg, text, obj ):
+    #
+    #   returns the decoded ingredient, or obj as is,
+    #   for ParseCommand to complain about, if it can't
+    #   be decoded
+    #
+        self.misses += 1
+        timing = Timing
+        if timing is not None:
+            start = time.perf_counter ()
+        try:
+            found = getter ( arg, obj )
+        except ( KeyError, TypeError, AttributeError, ValueError ):
+            return obj
+        finally:
+            if timing is not None:
+                timing [ "ingredients" ] += time.perf_counter () - start
+        self.memo [ ( getter, text ) ] = found
+        if len ( self.memo ) > self.size:
+            self.memo.popitem ( last = False )
+        return found
+
+Ingredients = IngredientMemo ( 4096 )
+IngredientLength = 1024
+
+#
+#   GuiCommand - one GUI command, with its ingredients decoded
+#
+#   the ingredients are attributes named after the arguments,
+#   and argnames keeps them in the order the recipe had them
+#
+class GuiCommand:
+    __slots__ = ( "name", "argnames", "lua" ) + tuple ( rxargs )
+
+    def __init__ ( self, name ):
+        self.name = name
+        self.argnames = []
+        self.lua = None     # see TrivialCommand
+
+    def asdict ( self ):
+        out = {}
+        for arg in self.argnames:
+            out [ arg ] = getattr ( self, arg ).asdict ()
+        return out
+
+def ParseCommand ( cmdobj ):
+#
+#   decode the JSON object for a command into a GuiCommand
+#
+    if isinstance ( cmdobj, GuiCommand ):
+        return cmdobj
+    timing = Timing
+    if timing is not None:
+        start = time.perf_counter ()
+    cmd = GuiCommand ( cmdobj [ "name" ] )
+    for arg in cmdobj:
+        if arg != "name":
+            value = cmdobj [ arg ]
+            if not isinstance ( value, Ingredient ):
+                value = rxargs [ arg ] ( arg, JSONize ( value ) )
+            setattr ( cmd, arg, value )
+            cmd.argnames.append ( arg )
+    if timing is not None:
+        timing [ "ingredients" ] += time.perf_counter () - start
+    return cmd
+
+def CompileRecipe ( rxx ):
+#
+#   decode all the commands of a GUI recipe, in order
+#
+    cmds = []
+    for cmdnum in range ( int ( rxx [ "size" ] ) ):
+        cmdnam = "action-{}".format ( cmdnum )
+        if Timing is None:
+            cmdobj = JSONize ( rxx [ cmdnam ] )
+        else:
+            start = time.perf_counter ()
+            cmdobj = JSONize ( rxx [ cmdnam ] )
+            Timing [ "jsonize" ] += time.perf_counter () - start
+        cmds.append ( ParseCommand ( cmdobj ) )
+    return cmds
+
+#
+#   LuaTemplate - a snippet of Lua, put together once
+#
+#   the lines of a snippet are joined when the module loads,
+#   and fields are {name}, as in str.format -- render is the 
+#   bound format method of the joined text, and a snippet 
+#   without fields is just its text
+#
+#   the snippets for the GUI commands are built from the
+#   fragments below, the loops over the segments picked by
+#   a residues ingredient being mostly the same for each
+#   command
+#
+class LuaTemplate:
+    __slots__ = ( "text", "render" )
+
+    def __init__ ( self, *lines ):
+        text = "".join ( lines )
+        fields = [ fld for lit, fld, spec, conv in string.Formatter ().parse ( text ) if fld is not None ]
+        if fields:
+            self.text = text
+            self.render = text.format
+        else:
+            self.text = text.format ()
+            self.render = self.constant
+
+    def constant ( self, **fields ):
+        return self.text
+
+LuaEnd = "    end\n"
+LuaDeselect = "    selection.DeselectAll ()\n"
+LuaSelectAll = "    selection.SelectAll ()\n"
+LuaForStride = "    for seg = {start}, structure.GetCount (), {incr} do\n"
+LuaForRef = "    for seg = 1, #{segref} do\n"
+
+def SelectedLua ( alllua, action ):
+#
+#   snippets for a command that selects the segments
+#   of its residues ingredient, then does the action
+#   to the selection
+#
+    return {
+        "all":          LuaTemplate ( *alllua ),
+        "stride":       LuaTemplate ( LuaDeselect, LuaForStride, "       selection.Select ( seg )\n", LuaEnd, action, LuaDeselect ),
+        "strideref":    LuaTemplate ( LuaDeselect, LuaForRef, "        selection.Select ( {segref} [ seg ] )\n", LuaEnd, action, LuaDeselect ),
+        "reference":    LuaTemplate ( LuaDeselect, LuaForRef, "        selection.Select ( {segref} [ seg ]  )\n", LuaEnd, action, LuaDeselect ),
+        "undefined":    LuaTemplate ( action ),
+        }
+
+#
+#   fragments for add_bands, which loops over two sets of segments
+#
+LuaFor1All = "    for seg1 = 1, structure.GetCount () do\n"
+LuaFor1Stride = "    for seg1 = {start1}, structure.GetCount (), {incr1} do\n"
+LuaFor1Ref = "    for segidx1 = 1, #{segref1} do\n"
+LuaFor2Stride = "        for seg2 = {start2}, structure.GetCount (), {incr2} do\n"
+LuaFor2Ref = "        for segidx2 = 1, #{segref2} do\n"
+LuaEndIf = "            end\n"
+LuaEnd2 = "        end\n"
+LuaBandsUndefined1 = (
+    "--  TODO: undefined residues1 ingredient\n",
+    "--  TODO: select segments for segmentIndex1 argument to band.AddBetweenSegments\n",
+    )
+LuaBandsUndefined2 = (
+    "--  TODO: undefined residues2 ingredient\n",
+    "--  TODO: select segments for segmentIndex2 argument to band.AddBetweenSegments\n",
+    )
+LuaBandsRefRef = (
+    "--  TODO: generating for loop using \"{segref2}\" as reference\n",
+    "--  TODO: for loop syntax is valid, but \"{segref2}\" is undefined\n",
+    )
+
+#
+#   fragments for the commands on bands
+#
+LuaBandsConnected = (
+    "--  TODO: the \"connected\" option actually selected spacebands...\n",
+    "--  TODO: the for loop below selects spacebands in the same way\n",
+    "    for bnd = 1, band.GetCount () do\n",
+    "        if band.GetResidueEnd ( bnd ) == 0 then\n",
+    )
+LuaForBand = "    for bnd = 1, #{bndref} do\n"
+
+#
+#   CmdWriter - write the Lua for GUI commands
+#
+#   arguments:
+#
+#   fout   - file the Lua goes to
+#   detail - include dump of GUI values as comments if true
+#
+#   a CmdWriter gets called as gencmd ( cmdnum, cmd ),
+#   which writes the Lua for command number cmdnum (counting
+#   from 0), given the GuiCommand cmd from ParseCommand
+#
+#   the commands of a recipe have to go through
+#   the same CmdWriter in order, since it keeps track
+#   of the user picks made along the way
+#
+#   the generators are methods, and the tables which pick
+#   them are built once, along with the class, rather than
+#   for every recipe
+#
+#   the generators render LuaTemplates into a list, and
+#   flush writes the Lua for the commands with one join
+#
+#   note: lots of helper functions first -
+#         the action starts far down below,
+#         just before "def checkAttrs"
+#
+class CmdWriter:
+    def __init__ ( self, fout, detail ):
+        self.fout = fout
+        self.detail = detail
+    #
+    #   track user picks for segments and bands
+    #
+        self.segpick = []
+        self.bndpick = []
+    #
+    #   the Lua for the commands not yet written
+    #
+        self.out = []
+
+#
 #   railroad methods on full display in these generator routines
 #
-    def doSegPick ( ref ):
-        refi = int ( ref ) 
+    luaSelectSegments = LuaTemplate ( "    {segref} = dialog.SelectSegments ()\n" )
+    def doSegPick ( self, ref ):
+        refi = int ( ref )
 
     #
     #   segref is the Lua table containing a list of segments
     #
-        segref = "segList_"
-        segref = segref + ref
+        segref = "segList_{}".format ( ref )
 
-    #   
+    #
     #   if the referenced user pick doesn't exist, create it
     #   using dialog.SelectSegments
     #
-        if refi > len ( segpick ):
-            segpick.append ( segref )
-            fout.write ( "    {} = dialog.SelectSegments ()\n".format ( segref ) )
+        if refi > len ( self.segpick ):
+            self.segpick.append ( segref )
+            self.out.append ( self.luaSelectSegments.render ( segref = segref ) )
         return segref
 
-    def doBndPick ( ref ):
-        refi = int ( ref ) 
+    luaSelectBands = LuaTemplate ( "    {bndref} = dialog.SelectBands ()\n" )
+    def doBndPick ( self, ref ):
+        refi = int ( ref )
 
     #
     #   bndref is the Lua table containing a list of segments
     #
-        bndref = "bndList_"
-        bndref = bndref + ref
+        bndref = "bndList_{}".format ( ref )
 
-    #   
+    #
     #   if the referenced user pick doesn't exist, create it
     #   using dialog.SelectBands
     #
-        if refi > len ( bndpick ):
-            bndpick.append ( bndref )
-            fout.write ( "    {} = dialog.SelectBands ()\n".format ( bndref ) )
+        if refi > len ( self.bndpick ):
+            self.bndpick.append ( bndref )
+            self.out.append ( self.luaSelectBands.render ( bndref = bndref ) )
         return bndref
 
-    def safeVal ( rxx, top, key, missing ):
+    def safeVal ( self, cmd, top, key, missing ):
     #
-    #   handle a missing ingredient -- 
-    #   mainly to allow processing old 
+    #   handle a missing ingredient --
+    #   mainly to allow processing old
     #   GUI example recipes
     #
         val = missing
         try:
-            val = rxx [ top ] [ key ]
-        except:
+            val = getattr ( getattr ( cmd, top ), key )
+        except AttributeError:
             pass
         return val
 
-    def safeIters ( rxx ):
-        val = safeVal ( rxx, "num_of_iterations", "val", "-1" ) 
-        if val == "-1":
-            fout.write ( "--  TODO: set missing iterations\n" )
-        if val == "0":
-            fout.write ( "--  TODO: set iterations for \"until stopped\"\n" )
+    luaMissingIters = LuaTemplate ( "--  TODO: set missing iterations\n" )
+    luaUntilStopped = LuaTemplate ( "--  TODO: set iterations for \"until stopped\"\n" )
+    def safeIters ( self, cmd ):
+        val = self.safeVal ( cmd, "num_of_iterations", "val", -1 )
+        if val == -1:
+            self.out.append ( self.luaMissingIters.text )
+        if val == 0:
+            self.out.append ( self.luaUntilStopped.text )
         return val
-    
-    def safeStart ( rxx, resnam ):
-        start = safeVal ( rxx, resnam, "startval", "-1" ) 
-        if start == "-1":
-            fout.write ( "--  TODO: starting index for \"by stride\" not specified\n" )
-            fout.write ( "--  TODO: incomplete {} ingredient\n".format ( resnam ) )
+
+    luaMissingStart = LuaTemplate (
+        "--  TODO: starting index for \"by stride\" not specified\n",
+        "--  TODO: incomplete {resnam} ingredient\n",
+        )
+    def safeStart ( self, cmd, resnam ):
+        start = self.safeVal ( cmd, resnam, "startval", -1 )
+        if start == -1:
+            self.out.append ( self.luaMissingStart.render ( resnam = resnam ) )
         return start
-    def safeIncr ( rxx, resnam ):
-        incr = safeVal ( rxx, resnam, "stepval", "-1" ) 
-        if incr == "-1":
-            fout.write ( "--  TODO: increment for \"by stride\" not specified\n" )
-            fout.write ( "--  TODO: incomplete {} ingredient\n".format ( resnam ) )
+    luaMissingIncr = LuaTemplate (
+        "--  TODO: increment for \"by stride\" not specified\n",
+        "--  TODO: incomplete {resnam} ingredient\n",
+        )
+    def safeIncr ( self, cmd, resnam ):
+        incr = self.safeVal ( cmd, resnam, "stepval", -1 )
+        if incr == -1:
+            self.out.append ( self.luaMissingIncr.render ( resnam = resnam ) )
         return incr
 
-    def missingRes ( funcname, value ):
-        fout.write ( "--  TODO: undefined residues ingredient\n" )
+    luaMissingRes = LuaTemplate (
+        "--  TODO: undefined residues ingredient\n",
+        "--  TODO: select segments for {func} ( {value} )\n",
+        )
+    luaMissingResNoValue = LuaTemplate (
+        "--  TODO: undefined residues ingredient\n",
+        "--  TODO: select segments for {func} ()\n",
+        )
+    def missingRes ( self, funcname, value ):
         sval = str ( value )
         if len ( sval ) > 0:
-            fout.write ( "--  TODO: select segments for {} ( {} )\n".format ( funcname, sval ) )
+            self.out.append ( self.luaMissingRes.render ( func = funcname, value = sval ) )
         else:
-            fout.write ( "--  TODO: select segments for {} ()\n".format ( funcname ) )
+            self.out.append ( self.luaMissingResNoValue.render ( func = funcname ) )
         return
 
-    def genShake ( args ):
-        val = safeIters ( args )
-        fout.write ( "    structure.ShakeSidechainsAll ( {} )\n".format ( val ) )
+    luaShake = LuaTemplate ( "    structure.ShakeSidechainsAll ( {iters} )\n" )
+    def genShake ( self, args ):
+        val = self.safeIters ( args )
+        self.out.append ( self.luaShake.render ( iters = val ) )
         return
-    def genWiggle ( args ):
-        val = safeIters ( args )
-        fout.write ( "    structure.WiggleAll ( {} )\n".format ( val ) )        
+    luaWiggle = LuaTemplate ( "    structure.WiggleAll ( {iters} )\n" )
+    def genWiggle ( self, args ):
+        val = self.safeIters ( args )
+        self.out.append ( self.luaWiggle.render ( iters = val ) )
         return
 
-    def genLocalWiggle ( args ):
-        def genAll ():
-            val = safeIters ( args )
-            fout.write ( "    structure.LocalWiggleAll ( {} )\n".format ( val ) )
-            return
-        def genByStride ():
-            val = safeIters ( args )
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        selection.DeselectAll ()\n" )
-                fout.write ( "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n" )
-                fout.write ( "        selection.Select ( seg )\n" )
-                fout.write ( "        structure.LocalWiggleSelected ( {} )\n".format ( val ) )
-                fout.write ( "    end\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        selection.DeselectAll ()\n" )
-                fout.write ( "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n" )
-                fout.write ( "        selection.Select ( {} [ seg ] )\n".format ( segref ) )
-                fout.write ( "        structure.LocalWiggleSelected ( {} )\n".format ( val ) )
-                fout.write ( "    end\n" )
-            return
-        def genReference ():
-            val = safeIters ( args )
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        selection.DeselectAll ()\n" )
-            fout.write ( "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n" )
-            fout.write ( "        selection.Select ( {} [ seg ] )\n".format ( segref ) )
-            fout.write ( "        structure.LocalWiggleSelected ( {},  true, true )\n".format ( val ) ) 
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            val = safeIters ( args )
-            missingRes ( "structure.LocalWiggleSelected", val )
-            fout.write ( "    structure.LocalWiggleSelected ( {} )\n".format ( val ) )
-            return
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+#
+#   commands on the segments picked by a residues ingredient
+#
+#   genSelected writes a command from its table of snippets,
+#   one for each shape of the loop over the segments:
+#
+#   all       - residues_all
+#   stride    - residues_by_stride, starting from an index
+#   strideref - residues_by_stride, starting from a user pick
+#   reference - residues_ref, a user pick
+#   undefined - residues_undefined, after the TODOs
+#
+#   the snippets get {func}, the Lua function named in the
+#   TODOs, and {value}, the other ingredient of the command
+#
+    resshapes = {
+        "residues_all":         "all",
+        "residues_by_stride":   "stride",
+        "residues_ref":         "reference",
+        "residues_undefined":   "undefined",
+        }
+    def genSelected ( self, args, luas, funcname, value = "" ):
+        res = args.residues
+        shape = self.resshapes [ res.name ]
+        if shape == "stride":
+            if res.startnam == "single_residue_by_index":
+                start = self.safeStart ( args, "residues" )
+                incr = self.safeIncr ( args, "residues" )
+                self.out.append ( luas [ "stride" ].render ( func = funcname, value = value, start = start, incr = incr ) )
+            if res.startnam == "residues_ref":
+                segref = self.doSegPick ( res.startval )
+                self.out.append ( luas [ "strideref" ].render ( func = funcname, value = value, segref = segref ) )
+        elif shape == "reference":
+            segref = self.doSegPick ( res.ref )
+            self.out.append ( luas [ "reference" ].render ( func = funcname, value = value, segref = segref ) )
+        else:
+            if shape == "undefined":
+                self.missingRes ( funcname, value )
+            self.out.append ( luas [ shape ].render ( func = funcname, value = value ) )
         return
 
-    def genFreeze ( args ):
-        def genAll ():
-            fout.write ( "    freeze.FreezeAll ()\n" )
-            return
-        def genByStride ():
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        freeze.Freeze ( seg, true, true )\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        freeze.Freeze ( {} [ seg ], true, true )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-            return
-        def genReference ():
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        freeze.Freeze ( {} [ seg ], true, true )\n".format ( segref ) ) 
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            missingRes ( "freeze.Freeze", "" )
-            fout.write ( "    freeze.Freeze ()\n" )
-            return
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+    luaLocalWiggle = {
+        "all":          LuaTemplate ( "    structure.LocalWiggleAll ( {value} )\n" ),
+        "stride":       LuaTemplate (
+                            LuaForStride,
+                            "        selection.DeselectAll ()\n",
+                            "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n",
+                            "        selection.Select ( seg )\n",
+                            "        {func} ( {value} )\n",
+                            LuaEnd,
+                            ),
+        "strideref":    LuaTemplate (
+                            LuaForRef,
+                            "        selection.DeselectAll ()\n",
+                            "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n",
+                            "        selection.Select ( {segref} [ seg ] )\n",
+                            "        {func} ( {value} )\n",
+                            LuaEnd,
+                            ),
+        "reference":    LuaTemplate (
+                            LuaForRef,
+                            "        selection.DeselectAll ()\n",
+                            "    --  TODO: use selection.SelectRange to local wiggle multiple segments\n",
+                            "        selection.Select ( {segref} [ seg ] )\n",
+                            "        {func} ( {value},  true, true )\n",
+                            LuaEnd,
+                            ),
+        "undefined":    LuaTemplate ( "    {func} ( {value} )\n" ),
+        }
+    def genLocalWiggle ( self, args ):
+        val = self.safeIters ( args )
+        self.genSelected ( args, self.luaLocalWiggle, "structure.LocalWiggleSelected", val )
         return
 
-    def genUnfreeze ( args ):
-        def genAll ():
-            fout.write ( "    freeze.UnfreezeAll ()\n" )
-            return
-        def genByStride ():
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        freeze.Unfreeze ( seg, true, true )\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        freeze.Unfreeze ( {} [ seg ], true, true )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-            return
-        def genReference ():
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        freeze.Unfreeze ( {} [ seg ], true, true )\n".format ( segref ) ) 
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            missingRes ( "freeze.Unfreeze", "" )
-            fout.write ( "    freeze.Unfreeze ()\n" )
-            return        
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+    luaFreeze = {
+        "all":          LuaTemplate ( "    {func}All ()\n" ),
+        "stride":       LuaTemplate ( LuaForStride, "        {func} ( seg, true, true )\n", LuaEnd ),
+        "strideref":    LuaTemplate ( LuaForRef, "        {func} ( {segref} [ seg ], true, true )\n", LuaEnd ),
+        "reference":    LuaTemplate ( LuaForRef, "        {func} ( {segref} [ seg ], true, true )\n", LuaEnd ),
+        "undefined":    LuaTemplate ( "    {func} ()\n" ),
+        }
+    def genFreeze ( self, args ):
+        self.genSelected ( args, self.luaFreeze, "freeze.Freeze" )
         return
-    def genSetSS ( args ):
-        sscodes = ( "H", "L", "E" )
-        def decodeSS ():
-            ss = args [ "structure" ] [ "val" ]
-            if ss != "-1":
-                ss = sscodes [ int ( ss ) ]
-            else:
-                fout.write ( "--  TODO: undefined secondary structure ingredient\n" )
-            return ss
-        def genAll ():
-            ss = decodeSS ()
-            fout.write ( "    selection.SelectAll ()\n" )
-            fout.write ( "    structure.SetSecondaryStructureSelected ( \"{}\" )\n".format ( ss ) )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genByStride ():
-            ss = decodeSS ()
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) ) 
-                fout.write ( "       selection.Select ( seg )\n")
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.SetSecondaryStructureSelected ( \"{}\" )\n".format ( ss ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        selection.Select ( {} [ seg ] )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.SetSecondaryStructureSelected ( \"{}\" )\n".format ( ss ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genReference ():
-            ss = decodeSS ()
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        selection.Select ( {} [ seg ]  )\n".format ( segref ) ) 
-            fout.write ( "    end\n" )
-            fout.write ( "    structure.SetSecondaryStructureSelected ( \"{}\" )\n".format ( ss ) )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genUndefined ():
-            ss = decodeSS ()
-            missingRes ( "structure.SetSecondaryStructureSelected", ss )
-            fout.write ( "    structure.SetSecondaryStructureSelected ( \"{}\" )\n".format ( ss ) )
-            return
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+    def genUnfreeze ( self, args ):
+        self.genSelected ( args, self.luaFreeze, "freeze.Unfreeze" )
         return
-    def genSetAA ( args ):
-        def decodeAA ():
-            aa = args [ "aa" ] [ "val" ]
-            if aa == "-1":
-                fout.write ( "--  TODO: undefined amino acid ingredient\n" )
-            return aa
-        def genAll ():
-            aa = decodeAA ()
-            fout.write ( "    selection.SelectAll ()\n" )
-            fout.write ( "    structure.structure.SetAminoAcidSelected ( \"{}\" )\n".format ( aa ) )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genByStride ():
-            aa = decodeAA ()
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "       selection.Select ( seg )\n" )
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.SetAminoAcidSelected ( \"{}\" )\n".format ( aa ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        selection.Select ( {} [ seg ] )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.SetAminoAcidSelected ( \"{}\" )\n".format ( aa ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genReference ():
-            aa = decodeAA ()
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        selection.Select ( {} [ seg ]  )\n".format ( segref ) ) 
-            fout.write ( "    end\n" )
-            fout.write ( "    structure.SetAminoAcidSelected ( \"{}\" )\n".format ( aa ) )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genUndefined ():
-            aa = decodeAA ()
-            missingRes ( "structure.SetAminoAcidSelected", aa )
-            fout.write ( "    structure.SetAminoAcidSelected ( \"{}\" )\n".format ( aa ) )
-            return
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+
+    sscodes = ( "H", "L", "E" )
+    luaMissingSS = LuaTemplate ( "--  TODO: undefined secondary structure ingredient\n" )
+    def decodeSS ( self, args ):
+        ss = args.structure.val
+        if ss != -1:
+            ss = self.sscodes [ int ( ss ) ]
+        else:
+            self.out.append ( self.luaMissingSS.text )
+        return ss
+    luaSetSS = SelectedLua (
+        ( LuaSelectAll, "    structure.SetSecondaryStructureSelected ( \"{value}\" )\n", LuaDeselect ),
+        "    structure.SetSecondaryStructureSelected ( \"{value}\" )\n",
+        )
+    def genSetSS ( self, args ):
+        ss = self.decodeSS ( args )
+        self.genSelected ( args, self.luaSetSS, "structure.SetSecondaryStructureSelected", ss )
         return
-    def genMutate ( args ):
-        def genAll ():
-            iters = safeIters ( args )
-            fout.write ( "    structure.MutateSidechainsAll ( {} )\n".format ( iters ) )
-            return
-        def genByStride ():
-            iters = safeIters ( args )
-            if args [ "residues" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues" )
-                incr = safeIncr ( args, "residues" )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = {}, structure.GetCount (), {} do\n".format ( start, incr ) ) 
-                fout.write ( "       selection.Select ( seg )\n")
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.MutateSidechainsSelected  ( \"{}\" )\n".format ( iters ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            if args [ "residues" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues" ] [ "startval" ] )
-                fout.write ( "    selection.DeselectAll ()\n" )
-                fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        selection.Select ( {} [ seg ] )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-                fout.write ( "    structure.MutateSidechainsSelected  ( \"{}\" )\n".format ( iters ) )
-                fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genReference ():
-            iters = safeIters ( args )
-            segref = doSegPick (  args [ "residues" ] [ "ref" ] )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            fout.write ( "    for seg = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        selection.Select ( {} [ seg ]  )\n".format ( segref ) ) 
-            fout.write ( "    end\n" )
-            fout.write ( "    structure.MutateSidechainsSelected  ( \"{}\" )\n".format ( iters ) )
-            fout.write ( "    selection.DeselectAll ()\n" )
-            return
-        def genUndefined ():
-            iters = safeIters ( args )
-            missingRes ( "structure.MutateSidechainsSelected", iters )
-            fout.write ( "    structure.MutateSidechainsSelected  ( \"{}\" )\n".format ( iters ) )
-            return
-        restyps = {
-            "residues_all":         genAll,
-            "residues_by_stride":   genByStride,
-            "residues_ref":         genReference, 
-            "residues_undefined":   genUndefined,
-            }
-        typ = args [ "residues" ] [ "name" ] 
-        restyps [ typ ] ()
+
+    luaMissingAA = LuaTemplate ( "--  TODO: undefined amino acid ingredient\n" )
+    def decodeAA ( self, args ):
+        aa = args.aa.val
+        if aa == "-1":
+            self.out.append ( self.luaMissingAA.text )
+        return aa
+    luaSetAA = SelectedLua (
+        ( LuaSelectAll, "    structure.structure.SetAminoAcidSelected ( \"{value}\" )\n", LuaDeselect ),
+        "    structure.SetAminoAcidSelected ( \"{value}\" )\n",
+        )
+    def genSetAA ( self, args ):
+        aa = self.decodeAA ( args )
+        self.genSelected ( args, self.luaSetAA, "structure.SetAminoAcidSelected", aa )
+        return
+
+    luaMutate = SelectedLua (
+        ( "    structure.MutateSidechainsAll ( {value} )\n", ),
+        "    structure.MutateSidechainsSelected  ( \"{value}\" )\n",
+        )
+    def genMutate ( self, args ):
+        iters = self.safeIters ( args )
+        self.genSelected ( args, self.luaMutate, "structure.MutateSidechainsSelected", iters )
         return
 #  ===================================================================================================================
 #  genAddBands expands to 4 x 4 = 16 routines
 #  ===================================================================================================================
-    def genAddBands ( args ):
-        def genAllAll ():
-            fout.write ( "    for seg1 = 1, structure.GetCount () do\n"  )
-            fout.write ( "        for seg2 = seg1  + 1, structure.GetCount () do\n" )
-            fout.write ( "            band.AddBetweenSegments ( seg1, seg2 )\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genAllByStride ():
-            if args [ "residues2" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues2" )
-                incr = safeIncr ( args, "residues2" )
-                fout.write ( "    for seg1 = 1, structure.GetCount () do\n"  )
-                fout.write ( "        for seg2 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "            if seg1 ~= seg2 then\n" )
-                fout.write ( "                band.AddBetweenSegments ( seg1, seg2 )\n" )
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues2" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues2" ] [ "startval" ] )
-                fout.write ( "    for seg1 = 1, structure.GetCount () do\n"  )
-                fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref ) )
-                fout.write ( "            if seg1 ~= seg2 then\n" )
-                fout.write ( "                band.AddBetweenSegments ( seg1,  {} [ segidx2 ] )\n".format ( segref ) ) 
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            return
-        def genAllReference ():
-            segref = doSegPick (  args [ "residues2" ] [ "ref" ] )
-            fout.write ( "    for seg1 = 1, structure.GetCount () do\n"  )
-            fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref ) )
-            fout.write ( "            if seg1 ~= {} [ segidx2 ] then\n".format ( segref ) )
-            fout.write ( "                band.AddBetweenSegments ( seg1, {} [ segidx2 ] )\n".format ( segref ) )
-            fout.write ( "            end\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genAllUndefined ():
-            fout.write ( "--  TODO: undefined residues2 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex2 argument to band.AddBetweenSegments\n" )
-            fout.write ( "    for seg1 = 1, structure.GetCount () do\n"  )
-            fout.write ( "        band.AddBetweenSegments ( seg1, )\n" )
-            fout.write ( "    end\n" )
-            return
-        def genByStrideAll ():
-            if args [ "residues1" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues1" )
-                incr = safeIncr ( args, "residues1" )
-                fout.write ( "    for seg1 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        for seg2 = seg1 + 1, structure.GetCount () do\n"  )
-                fout.write ( "            if seg1 ~= seg2 then\n" )
-                fout.write ( "                band.AddBetweenSegments ( seg1, seg2 )\n" )
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues1" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues1" ] [ "startval" ] )
-                fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        for seg2 = 1, structure.GetCount () do\n" )
-                fout.write ( "            if {} [ segidx1 ] ~= seg2 then\n".format ( segref ) )
-                fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], seg2 )\n".format ( segref ) )
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n")
-                fout.write ( "    end\n" )
-            return
+    luaBandsAllAll = LuaTemplate (
+        LuaFor1All,
+        "        for seg2 = seg1  + 1, structure.GetCount () do\n",
+        "            band.AddBetweenSegments ( seg1, seg2 )\n",
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsAllAll ( self, args ):
+        self.out.append ( self.luaBandsAllAll.text )
+        return
+    luaBandsAllStride = LuaTemplate (
+        LuaFor1All,
+        LuaFor2Stride,
+        "            if seg1 ~= seg2 then\n",
+        "                band.AddBetweenSegments ( seg1, seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsAllStrideRef = LuaTemplate (
+        LuaFor1All,
+        LuaFor2Ref,
+        "            if seg1 ~= seg2 then\n",
+        "                band.AddBetweenSegments ( seg1,  {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsAllByStride ( self, args ):
+        if args.residues2.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues2" )
+            incr = self.safeIncr ( args, "residues2" )
+            self.out.append ( self.luaBandsAllStride.render ( start2 = start, incr2 = incr ) )
+        if args.residues2.startnam == "residues_ref":
+            segref = self.doSegPick (  args.residues2.startval )
+            self.out.append ( self.luaBandsAllStrideRef.render ( segref2 = segref ) )
+        return
+    luaBandsAllRef = LuaTemplate (
+        LuaFor1All,
+        LuaFor2Ref,
+        "            if seg1 ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( seg1, {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsAllReference ( self, args ):
+        segref = self.doSegPick (  args.residues2.ref )
+        self.out.append ( self.luaBandsAllRef.render ( segref2 = segref ) )
+        return
+    luaBandsAllUndefined = LuaTemplate (
+        *LuaBandsUndefined2,
+        LuaFor1All,
+        "        band.AddBetweenSegments ( seg1, )\n",
+        LuaEnd,
+        )
+    def genAddBandsAllUndefined ( self, args ):
+        self.out.append ( self.luaBandsAllUndefined.text )
+        return
+    luaBandsStrideAll = LuaTemplate (
+        LuaFor1Stride,
+        "        for seg2 = seg1 + 1, structure.GetCount () do\n",
+        "            if seg1 ~= seg2 then\n",
+        "                band.AddBetweenSegments ( seg1, seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsStrideRefAll = LuaTemplate (
+        LuaFor1Ref,
+        "        for seg2 = 1, structure.GetCount () do\n",
+        "            if {segref1} [ segidx1 ] ~= seg2 then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsByStrideAll ( self, args ):
+        if args.residues1.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues1" )
+            incr = self.safeIncr ( args, "residues1" )
+            self.out.append ( self.luaBandsStrideAll.render ( start1 = start, incr1 = incr ) )
+        if args.residues1.startnam == "residues_ref":
+            segref = self.doSegPick (  args.residues1.startval )
+            self.out.append ( self.luaBandsStrideRefAll.render ( segref1 = segref ) )
+        return
     #
     #  lot of branches on the main line of this railroad
     #
-        def genByStrideByStride ():
-            if args [ "residues1" ] [ "startnam" ] == "single_residue_by_index":
-                start1 = safeStart ( args, "residues1" )
-                incr1 = safeIncr ( args, "residues1" )
-                if args [ "residues2" ] [ "startnam" ] == "single_residue_by_index":
-                    start2 = safeStart ( args, "residues2" )
-                    incr2 = safeIncr ( args, "residues2" )
-                    fout.write ( "    for seg1 = {}, structure.GetCount (), {} do\n".format ( start1, incr1 ) )
-                    fout.write ( "        for seg2 = {}, structure.GetCount (), {} do\n".format ( start2, incr2 ) )
-                    fout.write ( "            if seg1 ~= seg2 then\n" )
-                    fout.write ( "                band.AddBetweenSegments ( seg1, seg2 )\n" )
-                    fout.write ( "            end\n" )
-                    fout.write ( "        end\n" )
-                    fout.write ( "    end\n" )
-                if args [ "residues2" ] [ "startnam" ] == "residues_ref":
-                    segref2 = doSegPick (  args [ "residues2" ] [ "startval" ] )
-                    fout.write ( "    for seg1 = {}, structure.GetCount (), {} do\n".format ( start1, incr1 ) )
-                    fout.write ( "       for segidx2 = 1, #{} do\n".format ( segref2 ) )
-                    fout.write ( "            if seg1 ~= {} [ segidx2 ] then\n".format ( segref2 ) )
-                    fout.write ( "                band.AddBetweenSegments ( seg1, {} [ segidx2 ] )\n".format ( segref2 ) )
-                    fout.write ( "            end\n" )
-                    fout.write ( "        end\n")
-                    fout.write ( "    end\n" )
-            if args [ "residues1" ] [ "startnam" ] == "residues_ref":
-                segref1 = doSegPick (  args [ "residues1" ] [ "startval" ] )
-                if args [ "residues2" ] [ "startnam" ] == "single_residue_by_index":
-                    start2 = safeStart ( args, "residues2" )
-                    incr2 = safeIncr ( args, "residues2" )
-                    fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-                    fout.write ( "        for seg2 = {}, structure.GetCount (), {} do\n".format ( start2, incr2 ) )
-                    fout.write ( "            if seg1 ~= seg2 then\n" )
-                    fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], seg2 )\n".format ( segref1 ) )
-                    fout.write ( "            end\n" )
-                    fout.write ( "        end\n" )
-                    fout.write ( "    end\n" )
-                if args [ "residues2" ] [ "startnam" ] == "residues_ref":
-                    segref2 = doSegPick (  args [ "residues2" ] [ "startval" ] )
-                    fout.write ( "--  TODO: generating for loop using \"{}\" as reference\n".format ( segref2 ) )
-                    fout.write ( "--  TODO: for loop syntax is valid, but \"{}\" is undefined\n".format ( segref2 ) )
-                    fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-                    fout.write ( "       for segidx2 = 1, #{} do\n".format ( segref2 ) )
-                    fout.write ( "            if {} [ segidx1 ] ~= {} [ segidx2 ] then\n".format ( segref1, segref2 ) )
-                    fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], {} [ segidx2 ] )\n".format ( segref1, segref2 ) )
-                    fout.write ( "            end\n" )
-                    fout.write ( "        end\n")
-                    fout.write ( "    end\n" )
-            return
-        def genByStrideReference ():
-            if args [ "residues1" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues1" )
-                incr = safeIncr ( args, "residues1" )
-                segref2 = doSegPick (  args [ "residues2" ] [ "ref" ] )
-                fout.write ( "    for seg1 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref2 ) )
-                fout.write ( "            if seg1 ~= {} [ segidx2 ] then\n".format ( segref2 ) )
-                fout.write ( "                band.AddBetweenSegments ( seg1, {} [ segidx2 ] )\n".format ( segref2 ) )
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues1" ] [ "startnam" ] == "residues_ref":
-                segref1 = doSegPick (  args [ "residues1" ] [ "startval" ] )
-                segref2 = doSegPick (  args [ "residues2" ] [ "ref" ] )
-                fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-                fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref2 ) )
-                fout.write ( "            if {} [ segidx1 ] ~= {} [ segidx2 ] then\n".format ( segref1, segref2 ) )
-                fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ],  {} [ segidx2 ] )\n".format ( segref1, segref2 ) ) 
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            return
-        def genByStrideUndefined ():
-            fout.write ( "--  TODO: undefined residues2 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex2 argument to band.AddBetweenSegments\n" )
-
-            if args [ "residues1" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues1" )
-                incr = safeIncr ( args, "residues1" )
-                fout.write ( "    for seg1 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        band.AddBetweenSegments ( seg1, )\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues1" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues1" ] [ "startval" ] )
-                fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        band.AddBetweenSegments ( {} [ segidx1 ], )\n".format ( segref ) )
-                fout.write ( "    end\n" )
-            return
-        def genReferenceAll ():
-            segref = doSegPick (  args [ "residues1" ] [ "ref" ] )
-            fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        for seg2 = 1, structure.GetCount () do\n"  )
-            fout.write ( "            if {} [ segidx1 ] ~= seg2 then\n".format ( segref ) )
-            fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], seg2 )\n".format ( segref ) )
-            fout.write ( "            end\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReferenceByStride ():
-            segref1 = doSegPick (  args [ "residues1" ] [ "ref" ] )
-            if args [ "residues2" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues2" )
-                incr = safeIncr ( args, "residues2" )
-                fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-                fout.write ( "        for seg2 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "            if {} [ segidx1 ] ~= seg2 then\n".format ( segref1 ) )
-                fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], seg2 )\n".format ( segref1 ) )
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues2" ] [ "startnam" ] == "residues_ref":
-                segref2 = doSegPick (  args [ "residues2" ] [ "ref" ] )
-                fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-                fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref2 ) )
-                fout.write ( "            if {} [ segidx1 ] ~= {} [ segidx2 ] then\n" )
-                fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], {} [ segidx2 ] )\n".format ( segref1, segref2 ) ) 
-                fout.write ( "            end\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            return
-        def genReferenceReference ():
-            segref1 = doSegPick (  args [ "residues1" ] [ "ref" ] )
-            segref2 = doSegPick (  args [ "residues2" ] [ "ref" ] )
-            fout.write ( "--  TODO: generating for loop using \"{}\" as reference\n".format ( segref2 ) )
-            fout.write ( "--  TODO: for loop syntax is valid, but \"{}\" is undefined\n".format ( segref2 ) )
-
-            fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref1 ) )
-            fout.write ( "        for segidx2 = 1, #{} do\n".format ( segref2 ) )
-            fout.write ( "            if {} [ segidx1 ] ~= {} [ segidx2 ] then\n".format ( segref1, segref2 ) )
-            fout.write ( "                band.AddBetweenSegments ( {} [ segidx1 ], {} [ segidx2 ] )\n".format ( segref1, segref2 ) )
-            fout.write ( "            end\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReferenceUndefined ():
-            segref = doSegPick (  args [ "residues1" ] [ "ref" ] )
-            fout.write ( "--  TODO: undefined residues2 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex2 argument to band.AddBetweenSegments\n" )
-            fout.write ( "    for segidx1 = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        band.AddBetweenSegments ( {} [ segidx1 ], )\n".format ( segref ) )
-            return
-        def genUndefinedAll ():
-            fout.write ( "--  TODO: undefined residues1 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex1 argument to band.AddBetweenSegments\n" )
-            fout.write ( "    for seg2 = 1, structure.GetCount () do\n" )
-            fout.write ( "        band.AddBetweenSegments ( , seg2 )\n" )
-            fout.write ( "    end\n" )
-            return
-        def genUndefinedByStride ():
-            fout.write ( "--  TODO: undefined residues1 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex1 argument to band.AddBetweenSegments\n" )
-            if args [ "residues2" ] [ "startnam" ] == "single_residue_by_index":
-                start = safeStart ( args, "residues2" )
-                incr = safeIncr ( args, "residues2" )
-                fout.write ( "    for seg2 = {}, structure.GetCount (), {} do\n".format ( start, incr ) )
-                fout.write ( "        if seg1 ~= seg2 then\n" )
-                fout.write ( "            band.AddBetweenSegments ( , seg2 )\n" )
-                fout.write ( "        end\n" )
-                fout.write ( "    end\n" )
-            if args [ "residues2" ] [ "startnam" ] == "residues_ref":
-                segref = doSegPick (  args [ "residues2" ] [ "startval" ] )
-                fout.write ( "    for segidx2 = 1, #{} do\n".format ( segref ) )
-                fout.write ( "        band.AddBetweenSegments ( ,  {} [ segidx2 ] )\n".format ( segref ) ) 
-                fout.write ( "    end\n" )
-            return
-        def genUndefinedReference ():
-            fout.write ( "--  TODO: undefined residues1 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex1 argument to band.AddBetweenSegments\n" )
-            segref = doSegPick (  args [ "residues2" ] [ "ref" ] )
-            fout.write ( "    for segidx2 = 1, #{} do\n".format ( segref ) )
-            fout.write ( "        band.AddBetweenSegments ( , {} [ segidx2 ] )\n".format ( segref ) )
-            fout.write ( "    end\n" )
-            return
-        def genUndefinedUndefined ():
-            fout.write ( "--  TODO: undefined residues1 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex1 argument to band.AddBetweenSegments\n" )
-            fout.write ( "--  TODO: undefined residues2 ingredient\n" )
-            fout.write ( "--  TODO: select segments for segmentIndex2 argument to band.AddBetweenSegments\n" )
-            fout.write ( "    band.AddBetweenSegments ()\n" )
-            return
-    #   ============================
-    #   16 candles there on the wall
-    #   ============================
-        restyps = {
-            "residues_all_residues_all":                genAllAll,
-            "residues_all_residues_by_stride":          genAllByStride,
-            "residues_all_residues_ref":                genAllReference,
-            "residues_all_residues_undefined":          genAllUndefined,
-            "residues_by_stride_residues_all":          genByStrideAll,
-            "residues_by_stride_residues_by_stride":    genByStrideByStride,
-            "residues_by_stride_residues_ref":          genByStrideReference,
-            "residues_by_stride_residues_undefined":    genByStrideUndefined,
-            "residues_ref_residues_all":                genReferenceAll, 
-            "residues_ref_residues_by_stride":          genReferenceByStride, 
-            "residues_ref_residues_ref":                genReferenceReference, 
-            "residues_ref_residues_undefined":          genReferenceUndefined, 
-            "residues_ref_residues_all":                genReferenceAll, 
-            "residues_ref_residues_by_stride":          genReferenceByStride, 
-            "residues_ref_residues_ref":                genReferenceReference, 
-            "residues_ref_residues_undefined":          genReferenceUndefined, 
-            "residues_undefined_residues_all":          genUndefinedAll,
-            "residues_undefined_residues_by_stride":    genUndefinedByStride,
-            "residues_undefined_residues_ref":          genUndefinedReference,
-            "residues_undefined_residues_undefined":    genUndefinedUndefined,
-            }
-        typ1 = args [ "residues1" ] [ "name" ] 
-        typ2 = args [ "residues2" ] [ "name" ] 
+    luaBandsStrideStride = LuaTemplate (
+        LuaFor1Stride,
+        LuaFor2Stride,
+        "            if seg1 ~= seg2 then\n",
+        "                band.AddBetweenSegments ( seg1, seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsStrideStrideRef = LuaTemplate (
+        LuaFor1Stride,
+        "       for segidx2 = 1, #{segref2} do\n",
+        "            if seg1 ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( seg1, {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsStrideRefStride = LuaTemplate (
+        LuaFor1Ref,
+        LuaFor2Stride,
+        "            if seg1 ~= seg2 then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsStrideRefStrideRef = LuaTemplate (
+        *LuaBandsRefRef,
+        LuaFor1Ref,
+        "       for segidx2 = 1, #{segref2} do\n",
+        "            if {segref1} [ segidx1 ] ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsByStrideByStride ( self, args ):
+        if args.residues1.startnam == "single_residue_by_index":
+            start1 = self.safeStart ( args, "residues1" )
+            incr1 = self.safeIncr ( args, "residues1" )
+            if args.residues2.startnam == "single_residue_by_index":
+                start2 = self.safeStart ( args, "residues2" )
+                incr2 = self.safeIncr ( args, "residues2" )
+                self.out.append ( self.luaBandsStrideStride.render ( start1 = start1, incr1 = incr1, start2 = start2, incr2 = incr2 ) )
+            if args.residues2.startnam == "residues_ref":
+                segref2 = self.doSegPick (  args.residues2.startval )
+                self.out.append ( self.luaBandsStrideStrideRef.render ( start1 = start1, incr1 = incr1, segref2 = segref2 ) )
+        if args.residues1.startnam == "residues_ref":
+            segref1 = self.doSegPick (  args.residues1.startval )
+            if args.residues2.startnam == "single_residue_by_index":
+                start2 = self.safeStart ( args, "residues2" )
+                incr2 = self.safeIncr ( args, "residues2" )
+                self.out.append ( self.luaBandsStrideRefStride.render ( segref1 = segref1, start2 = start2, incr2 = incr2 ) )
+            if args.residues2.startnam == "residues_ref":
+                segref2 = self.doSegPick (  args.residues2.startval )
+                self.out.append ( self.luaBandsStrideRefStrideRef.render ( segref1 = segref1, segref2 = segref2 ) )
+        return
+    luaBandsStrideRef = LuaTemplate (
+        LuaFor1Stride,
+        LuaFor2Ref,
+        "            if seg1 ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( seg1, {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsStrideRefRef = LuaTemplate (
+        LuaFor1Ref,
+        LuaFor2Ref,
+        "            if {segref1} [ segidx1 ] ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ],  {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsByStrideReference ( self, args ):
+        if args.residues1.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues1" )
+            incr = self.safeIncr ( args, "residues1" )
+            segref2 = self.doSegPick (  args.residues2.ref )
+            self.out.append ( self.luaBandsStrideRef.render ( start1 = start, incr1 = incr, segref2 = segref2 ) )
+        if args.residues1.startnam == "residues_ref":
+            segref1 = self.doSegPick (  args.residues1.startval )
+            segref2 = self.doSegPick (  args.residues2.ref )
+            self.out.append ( self.luaBandsStrideRefRef.render ( segref1 = segref1, segref2 = segref2 ) )
+        return
+    luaBandsUndefined2 = LuaTemplate ( *LuaBandsUndefined2 )
+    luaBandsStrideUndefined = LuaTemplate (
+        LuaFor1Stride,
+        "        band.AddBetweenSegments ( seg1, )\n",
+        LuaEnd,
+        )
+    luaBandsStrideRefUndefined = LuaTemplate (
+        LuaFor1Ref,
+        "        band.AddBetweenSegments ( {segref1} [ segidx1 ], )\n",
+        LuaEnd,
+        )
+    def genAddBandsByStrideUndefined ( self, args ):
+        self.out.append ( self.luaBandsUndefined2.text )
+
+        if args.residues1.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues1" )
+            incr = self.safeIncr ( args, "residues1" )
+            self.out.append ( self.luaBandsStrideUndefined.render ( start1 = start, incr1 = incr ) )
+        if args.residues1.startnam == "residues_ref":
+            segref = self.doSegPick (  args.residues1.startval )
+            self.out.append ( self.luaBandsStrideRefUndefined.render ( segref1 = segref ) )
+        return
+    def genAddBandsReferenceAll ( self, args ):
+        segref = self.doSegPick (  args.residues1.ref )
+        self.out.append ( self.luaBandsStrideRefAll.render ( segref1 = segref ) )
+        return
+    luaBandsRefStride = LuaTemplate (
+        LuaFor1Ref,
+        LuaFor2Stride,
+        "            if {segref1} [ segidx1 ] ~= seg2 then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], seg2 )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsRefStrideRef = LuaTemplate (
+        LuaFor1Ref,
+        LuaFor2Ref,
+        "            if {{}} [ segidx1 ] ~= {{}} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsReferenceByStride ( self, args ):
+        segref1 = self.doSegPick (  args.residues1.ref )
+        if args.residues2.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues2" )
+            incr = self.safeIncr ( args, "residues2" )
+            self.out.append ( self.luaBandsRefStride.render ( segref1 = segref1, start2 = start, incr2 = incr ) )
+        if args.residues2.startnam == "residues_ref":
+            segref2 = self.doSegPick (  args.residues2.ref )
+            self.out.append ( self.luaBandsRefStrideRef.render ( segref1 = segref1, segref2 = segref2 ) )
+        return
+    luaBandsRefRef = LuaTemplate (
+        *LuaBandsRefRef,
+        LuaFor1Ref,
+        LuaFor2Ref,
+        "            if {segref1} [ segidx1 ] ~= {segref2} [ segidx2 ] then\n",
+        "                band.AddBetweenSegments ( {segref1} [ segidx1 ], {segref2} [ segidx2 ] )\n",
+        LuaEndIf,
+        LuaEnd2,
+        LuaEnd,
+        )
+    def genAddBandsReferenceReference ( self, args ):
+        segref1 = self.doSegPick (  args.residues1.ref )
+        segref2 = self.doSegPick (  args.residues2.ref )
+        self.out.append ( self.luaBandsRefRef.render ( segref1 = segref1, segref2 = segref2 ) )
+        return
+    luaBandsRefUndefined = LuaTemplate (
+        *LuaBandsUndefined2,
+        LuaFor1Ref,
+        "        band.AddBetweenSegments ( {segref1} [ segidx1 ], )\n",
+        )
+    def genAddBandsReferenceUndefined ( self, args ):
+        segref = self.doSegPick (  args.residues1.ref )
+        self.out.append ( self.luaBandsRefUndefined.render ( segref1 = segref ) )
+        return
+    luaBandsUndefinedAll = LuaTemplate (
+        *LuaBandsUndefined1,
+        "    for seg2 = 1, structure.GetCount () do\n",
+        "        band.AddBetweenSegments ( , seg2 )\n",
+        LuaEnd,
+        )
+    def genAddBandsUndefinedAll ( self, args ):
+        self.out.append ( self.luaBandsUndefinedAll.text )
+        return
+    luaBandsUndefined1 = LuaTemplate ( *LuaBandsUndefined1 )
+    luaBandsUndefinedStride = LuaTemplate (
+        "    for seg2 = {start2}, structure.GetCount (), {incr2} do\n",
+        "        if seg1 ~= seg2 then\n",
+        "            band.AddBetweenSegments ( , seg2 )\n",
+        LuaEnd2,
+        LuaEnd,
+        )
+    luaBandsUndefinedStrideRef = LuaTemplate (
+        "    for segidx2 = 1, #{segref2} do\n",
+        "        band.AddBetweenSegments ( ,  {segref2} [ segidx2 ] )\n",
+        LuaEnd,
+        )
+    def genAddBandsUndefinedByStride ( self, args ):
+        self.out.append ( self.luaBandsUndefined1.text )
+        if args.residues2.startnam == "single_residue_by_index":
+            start = self.safeStart ( args, "residues2" )
+            incr = self.safeIncr ( args, "residues2" )
+            self.out.append ( self.luaBandsUndefinedStride.render ( start2 = start, incr2 = incr ) )
+        if args.residues2.startnam == "residues_ref":
+            segref = self.doSegPick (  args.residues2.startval )
+            self.out.append ( self.luaBandsUndefinedStrideRef.render ( segref2 = segref ) )
+        return
+    luaBandsUndefinedRef = LuaTemplate (
+        "    for segidx2 = 1, #{segref2} do\n",
+        "        band.AddBetweenSegments ( , {segref2} [ segidx2 ] )\n",
+        LuaEnd,
+        )
+    def genAddBandsUndefinedReference ( self, args ):
+        self.out.append ( self.luaBandsUndefined1.text )
+        segref = self.doSegPick (  args.residues2.ref )
+        self.out.append ( self.luaBandsUndefinedRef.render ( segref2 = segref ) )
+        return
+    luaBandsUndefinedUndefined = LuaTemplate (
+        *LuaBandsUndefined1,
+        *LuaBandsUndefined2,
+        "    band.AddBetweenSegments ()\n",
+        )
+    def genAddBandsUndefinedUndefined ( self, args ):
+        self.out.append ( self.luaBandsUndefinedUndefined.text )
+        return
+#   ============================
+#   16 candles there on the wall
+#   ============================
+    restypsAddBands = {
+        "residues_all_residues_all":                genAddBandsAllAll,
+        "residues_all_residues_by_stride":          genAddBandsAllByStride,
+        "residues_all_residues_ref":                genAddBandsAllReference,
+        "residues_all_residues_undefined":          genAddBandsAllUndefined,
+        "residues_by_stride_residues_all":          genAddBandsByStrideAll,
+        "residues_by_stride_residues_by_stride":    genAddBandsByStrideByStride,
+        "residues_by_stride_residues_ref":          genAddBandsByStrideReference,
+        "residues_by_stride_residues_undefined":    genAddBandsByStrideUndefined,
+        "residues_ref_residues_all":                genAddBandsReferenceAll,
+        "residues_ref_residues_by_stride":          genAddBandsReferenceByStride,
+        "residues_ref_residues_ref":                genAddBandsReferenceReference,
+        "residues_ref_residues_undefined":          genAddBandsReferenceUndefined,
+        "residues_ref_residues_all":                genAddBandsReferenceAll,
+        "residues_ref_residues_by_stride":          genAddBandsReferenceByStride,
+        "residues_ref_residues_ref":                genAddBandsReferenceReference,
+        "residues_ref_residues_undefined":          genAddBandsReferenceUndefined,
+        "residues_undefined_residues_all":          genAddBandsUndefinedAll,
+        "residues_undefined_residues_by_stride":    genAddBandsUndefinedByStride,
+        "residues_undefined_residues_ref":          genAddBandsUndefinedReference,
+        "residues_undefined_residues_undefined":    genAddBandsUndefinedUndefined,
+        }
+    def genAddBands ( self, args ):
+        typ1 = args.residues1.name
+        typ2 = args.residues2.name
         ttyp = typ1 + "_" + typ2
-        restyps [ ttyp ] ()
+        self.restypsAddBands [ ttyp ] ( self, args )
         return
-    def genDisable ( args ):
-        def genAll ():
-            fout.write ( "    band.DisableAll ()\n" )
-            return
-        def genConnected ():
-            fout.write ( "--  TODO: the \"connected\" option actually selected spacebands...\n" )
-            fout.write ( "--  TODO: the for loop below selects spacebands in the same way\n" )
-            fout.write ( "    for bnd = 1, band.GetCount () do\n" )
-            fout.write ( "        if band.GetResidueEnd ( bnd ) == 0 then\n" )
-            fout.write ( "            band.Disable ( bnd )\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReference ():
-            bndref = doBndPick ( args [ "bands" ] [ "ref" ] )
-            fout.write ( "    for bnd = 1, #{} do\n".format ( bndref ) )
-            fout.write ( "        band.Disable ( {} [ bnd ] )\n".format ( bndref ) )
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            fout.write ( "--  TODO: undefined bands ingredient\n" )
-            fout.write ( "--  TODO: select bands for band.Disable\n" )
-            fout.write ( "    band.Disable ()\n" )
-            return
-        bndtyps = {
-            "bands_all":        genAll,
-            "bands_connected":  genConnected,
-            "bands_reference":  genReference, 
-            "bands_undefined":  genUndefined,
-            }
-        typ = args [ "bands" ] [ "name" ] 
-        bndtyps [ typ ] ()
+
+#
+#   commands on the bands picked by a bands ingredient
+#
+#   like genSelected, genBanded writes a command from its
+#   table of snippets, keyed by the name of the ingredient
+#
+    def genBanded ( self, args, luas, funcname, value = "" ):
+        bands = args.bands
+        lua = luas [ bands.name ]
+        bndref = None
+        if bands.name == "bands_reference":
+            bndref = self.doBndPick ( bands.ref )
+        self.out.append ( lua.render ( func = funcname, value = value, bndref = bndref ) )
         return
-    def genEnable ( args ):
-        def genAll ():
-            fout.write ( "    band.EnableAll ()\n" )
-            return
-        def genConnected ():
-            fout.write ( "--  TODO: the \"connected\" option actually selected spacebands...\n" )
-            fout.write ( "--  TODO: the for loop below selects spacebands in the same way\n" )
-            fout.write ( "    for bnd = 1, band.GetCount () do\n" )
-            fout.write ( "        if band.GetResidueEnd ( bnd ) == 0 then\n" )
-            fout.write ( "            band.Enable ( bnd )\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReference ():
-            bndref = doBndPick ( args [ "bands" ] [ "ref" ] )
-            fout.write ( "    for bnd = 1, #{} do\n".format ( bndref ) )
-            fout.write ( "        band.Enable ( {} [ bnd ] )\n".format ( bndref ) )
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            fout.write ( "--  TODO: undefined bands ingredient\n" )
-            fout.write ( "--  TODO: select bands for band.Enable\n" )
-            fout.write ( "    band.Enable ()\n" )
-            return
-        bndtyps = {
-            "bands_all":        genAll,
-            "bands_connected":  genConnected,
-            "bands_reference":  genReference, 
-            "bands_undefined":  genUndefined,
-            }
-        typ = args [ "bands" ] [ "name" ] 
-        bndtyps [ typ ] ()
+    luaBands = {
+        "bands_all":        LuaTemplate ( "    {func}All ()\n" ),
+        "bands_connected":  LuaTemplate ( *LuaBandsConnected, "            {func} ( bnd )\n", LuaEnd2, LuaEnd ),
+        "bands_reference":  LuaTemplate ( LuaForBand, "        {func} ( {bndref} [ bnd ] )\n", LuaEnd ),
+        "bands_undefined":  LuaTemplate (
+                                "--  TODO: undefined bands ingredient\n",
+                                "--  TODO: select bands for {func}\n",
+                                "    {func} ()\n",
+                                ),
+        }
+    def genDisable ( self, args ):
+        self.genBanded ( args, self.luaBands, "band.Disable" )
         return
-    def genRemove ( args ):
-        def genAll ():
-            fout.write ( "    band.DeleteAll ()\n" )
-            return
-        def genConnected ():
-            fout.write ( "--  TODO: the \"connected\" option actually selected spacebands...\n" )
-            fout.write ( "--  TODO: the for loop below selects spacebands in the same way\n" )
-            fout.write ( "    for bnd = 1, band.GetCount () do\n" )
-            fout.write ( "        if band.GetResidueEnd ( bnd ) == 0 then\n" )
-            fout.write ( "            band.Delete ( bnd )\n" )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReference ():
-            bndref = doBndPick ( args [ "bands" ] [ "ref" ] )
-            fout.write ( "    for bnd = 1, #{} do\n".format ( bndref ) )
-            fout.write ( "        band.Delete ( {} [ bnd ] )\n".format ( bndref ) )
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            fout.write ( "--  TODO: undefined bands ingredient\n" )
-            fout.write ( "--  TODO: select bands for band.Delete\n" )
-            fout.write ( "    band.Delete ()\n" )
-            return
-        bndtyps = {
-            "bands_all":        genAll,
-            "bands_connected":  genConnected,
-            "bands_reference":  genReference, 
-            "bands_undefined":  genUndefined,
-            }
-        typ = args [ "bands" ] [ "name" ] 
-        bndtyps [ typ ] ()
+    def genEnable ( self, args ):
+        self.genBanded ( args, self.luaBands, "band.Enable" )
         return
-    def genSetStrength ( args ):
-        def genAll ():
-            bndstr = args [ "strength" ] [ "val" ]
-            if bndstr == "-1":
-                fout.write ( "--  TODO: missing strength ingredient\n" )
-            fout.write ( "    for bnd = 1, band.GetCount () do\n" )
-            fout.write ( "        band.SetStrength ( bnd, {} )\n".format ( bndstr ) )
-            fout.write ( "    end\n" )
-            return
-        def genConnected ():
-            bndstr = args [ "strength" ] [ "val" ]
-            if bndstr == "-1":
-                fout.write ( "--  TODO: missing strength ingredient\n" )
-            fout.write ( "--  TODO: the \"connected\" option actually selected spacebands...\n" )
-            fout.write ( "--  TODO: the for loop below selects spacebands in the same way\n" )
-            fout.write ( "    for bnd = 1, band.GetCount () do\n" )
-            fout.write ( "        if band.GetResidueEnd ( bnd ) == 0 then\n" )
-            fout.write ( "            band.SetStrength ( bnd, {} )\n".format ( bndstr ) )
-            fout.write ( "        end\n" )
-            fout.write ( "    end\n" )
-            return
-        def genReference ():
-            bndstr = args [ "strength" ] [ "val" ]
-            if bndstr == "-1":
-                fout.write ( "--  TODO: missing strength ingredient\n" )
-            bndref = doBndPick ( args [ "bands" ] [ "ref" ] )
-            fout.write ( "    for bnd = 1, #{} do\n".format ( bndref ) )
-            fout.write ( "        band.SetStrength ( {} [ bnd ], {} )\n".format ( bndref, bndstr ) )
-            fout.write ( "    end\n" )
-            return
-        def genUndefined ():
-            bndstr = args [ "strength" ] [ "val" ]
-            if bndstr == "-1":
-                fout.write ( "--  TODO: missing strength ingredient\n" )
-            fout.write ( "--  TODO: undefined bands ingredient\n" )
-            fout.write ( "--  TODO: select bands for band.SetStrength ( {} )\n".format ( bndstr )  )
-            fout.write ( "    band.SetStrength ()\n" )
-            return
-        bndtyps = {
-            "bands_all":        genAll,
-            "bands_connected":  genConnected,
-            "bands_reference":  genReference, 
-            "bands_undefined":  genUndefined,
-            }
-        typ = args [ "bands" ] [ "name" ] 
-        bndtyps [ typ ] ()        
+    def genRemove ( self, args ):
+        self.genBanded ( args, self.luaBands, "band.Delete" )
+        return
+    luaMissingStrength = LuaTemplate ( "--  TODO: missing strength ingredient\n" )
+    luaSetStrength = {
+        "bands_all":        LuaTemplate (
+                                "    for bnd = 1, band.GetCount () do\n",
+                                "        {func} ( bnd, {value} )\n",
+                                LuaEnd,
+                                ),
+        "bands_connected":  LuaTemplate ( *LuaBandsConnected, "            {func} ( bnd, {value} )\n", LuaEnd2, LuaEnd ),
+        "bands_reference":  LuaTemplate ( LuaForBand, "        {func} ( {bndref} [ bnd ], {value} )\n", LuaEnd ),
+        "bands_undefined":  LuaTemplate (
+                                "--  TODO: undefined bands ingredient\n",
+                                "--  TODO: select bands for {func} ( {value} )\n",
+                                "    {func} ()\n",
+                                ),
+        }
+    def genSetStrength ( self, args ):
+        bndstr = args.strength.val
+        if bndstr == "-1":
+            self.out.append ( self.luaMissingStrength.text )
+        self.genBanded ( args, self.luaSetStrength, "band.SetStrength", bndstr )
         return
-    def genSetCI ( args ):
-        val = args [ "importance" ] [ "val" ]
+    luaMissingImportance = LuaTemplate ( "--  TODO: missing importance ingredient\n" )
+    luaSetCI = LuaTemplate ( "    behavior.SetClashingImportance ( {value} )\n" )
+    def genSetCI ( self, args ):
+        val = args.importance.val
         if val == "-1":
-            fout.write ( "--  TODO: missing importance ingredient\n" )
-        fout.write ( "    behavior.SetClashingImportance ( {} )\n".format ( val ) )
+            self.out.append ( self.luaMissingImportance.text )
+        self.out.append ( self.luaSetCI.render ( value = val ) )
         return
-    def genResetPuzzle ( args ):
-        fout.write ( "    puzzle.StartOver ()\n" )
+    luaResetPuzzle = LuaTemplate ( "    puzzle.StartOver ()\n" )
+    def genResetPuzzle ( self, args ):
+        self.out.append ( self.luaResetPuzzle.text )
         return
-    def genRestoreAbs ( args ):
-        fout.write ( "    absolutebest.Restore ()\n" )
+    luaRestoreAbs = LuaTemplate ( "    absolutebest.Restore ()\n" )
+    def genRestoreAbs ( self, args ):
+        self.out.append ( self.luaRestoreAbs.text )
         return
-    def genSetRecent ( args ):
-        fout.write ( "    recentbest.Save ()\n" )
+    luaSetRecent = LuaTemplate ( "    recentbest.Save ()\n" )
+    def genSetRecent ( self, args ):
+        self.out.append ( self.luaSetRecent.text )
         return
-    def genRestoreRecent ( args ):
-        fout.write ( "    recentbest.Restore ()\n" )
+    luaRestoreRecent = LuaTemplate ( "    recentbest.Restore ()\n" )
+    def genRestoreRecent ( self, args ):
+        self.out.append ( self.luaRestoreRecent.text )
         return
-    def genQuicksave ( args ):
-        val = args [ "slot" ] [ "val" ]
-        if val == "-1":
-            fout.write ( "--  TODO: missing slot ingredient\n" )
-        fout.write ( "    save.Quicksave ( {} )\n".format ( val ) )
+    luaMissingSlot = LuaTemplate ( "--  TODO: missing slot ingredient\n" )
+    luaQuicksave = LuaTemplate ( "    save.Quicksave ( {value} )\n" )
+    def genQuicksave ( self, args ):
+        val = args.slot.val
+        if val == -1:
+            self.out.append ( self.luaMissingSlot.text )
+        self.out.append ( self.luaQuicksave.render ( value = val ) )
         return
-    def genQuickload ( args ):
-        val = args [ "slot" ] [ "val" ]
-        if val == "-1":
-            fout.write ( "--  TODO: missing slot ingredient\n" )
-        fout.write ( "    save.Quickload ( {} )\n".format ( val ) )
+    luaQuickload = LuaTemplate ( "    save.Quickload ( {value} )\n" )
+    def genQuickload ( self, args ):
+        val = args.slot.val
+        if val == -1:
+            self.out.append ( self.luaMissingSlot.text )
+        self.out.append ( self.luaQuickload.render ( value = val ) )
         return
-    def genComment ( args ):
-        val = args [ "comment" ] [ "val" ]
+    luaCommentLine = LuaTemplate ( "--  {line}\n" )
+    def genComment ( self, args ):
+        val = args.comment.val
         lines = val.splitlines ()
-        fout.write ( "--\n" )
+        self.out.append ( "--\n" )
         for line in lines:
-            fout.write ( "--  {}\n".format ( line ) )
-        fout.write ( "--\n" )
+            self.out.append ( self.luaCommentLine.render ( line = line ) )
+        self.out.append ( "--\n" )
         return
 #
 #   rxcmds list functions to generate the Lua for each command
@@ -1030,204 +1860,106 @@ def ListCmds ( rxx, detail, outdir ):
         }
 
 #
-#   complex residues ingredient
+#   process one command
 #
-    def getResidues ( arg, rxx ):
-        def getAll ( rxx ):
-            return {}
-        def getByStride ( rxx ):
-            startxx = JSONize ( rxx [ "start" ] )
-            startnam = startxx [ "name" ]
-            startval = "-1"
-            if startnam == "single_residue_by_index":
-                indexxx = JSONize ( startxx [ "index" ] )
-                if indexxx [ "is_defined" ] == "1":
-                    startval = indexxx [ "value" ]
-            if startnam == "residues_ref":
-                startval = startxx [ "ref-id" ]
-            stepxx = JSONize ( rxx [ "step" ] )
-            stepval = "-1"
-            if stepxx [ "is_defined" ] == "1":
-                stepval = stepxx [ "value" ]
-
-            return { "startnam": startnam, "startval": startval, "stepval": stepval } # really not *that* bad
-        def getReference ( rxx ):
-            val = rxx [ "ref-id" ]
-            return { "ref": val }
-        def getUndefined ( rxx ):
-            return {}
-        names = {
-            "residues_all":         [ "all",        getAll ],
-            "residues_by_stride":   [ "by_stride",  getByStride ],
-            "residues_ref":         [ "reference",  getReference ],
-            "residues_undefined":   [ "undefined",  getUndefined ],
-            }
-        rnam = rxx [ "name" ]        
-        rlst = { arg: { "name": rnam } }
-        rlst [ arg ].update ( names [ rnam ] [ 1 ] ( rxx ) )
-        return rlst
+    def __call__ ( self, cmdnum, cmd ):
+        if self.detail:
+            self.out.append ( "--  command {} = {} ({})\n".format ( cmdnum + 1, cmd.name, ", ".join ( cmd.argnames ) ) )
+            argl = cmd.asdict ()
+            for axx in argl:
+                self.out.append ( "--  {} = {}\n".format ( axx, argl [ axx ] ) )
+                
+    #
+    #   generate the Lua for the command, unless 
+    #   it's a trivial one, with the Lua ready made
+    #
+        if cmd.lua is not None:
+            self.out.append ( cmd.lua )
+            return
+        cmdgen = self.rxcmds [ cmd.name ]
+        cmdgen [ 0 ] ( self, cmd )
+        return
+
 #
-#   somewhat complex bands ingredient
+#   write out the Lua for the commands so far
 #
-    def getBands ( arg, rxx ):
-        def getAll ( rxx ):
-            return {}
-        def getConnected ( rxx ):
-            return {}
-        def getReference ( rxx ):
-            val = rxx [ "ref-id" ]
-            return { "ref": val }
-        def getUndefined ( rxx ):
-            return {}
-        names = {
-            "bands_all":        [ "all",        getAll ],
-            "bands_connected":  [ "connected",  getConnected ],
-            "bands_reference":  [ "reference",  getReference ],
-            "bands_undefined":  [ "undefined",  getUndefined ],
-            }
-        rnam = rxx [ "name" ]        
-        rlst = { arg: { "name": rnam } }
-        rlst [ arg ].update ( names [ rnam ] [ 1 ] ( rxx ) )
-        return rlst
+    def flush ( self ):
+        if len ( self.out ) > 0:
+            self.fout.write ( "".join ( self.out ) )
+            self.out = []
+        return
+
 #
-#   simple ingredients, just one value each
+#   TrivialCommand - fast path for the most common GUI commands
 #
-    def getIters ( arg, rxx ):
-        val = ""
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getStructure ( arg, rxx ):
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getAA ( arg, rxx ):
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getStrength ( arg, rxx ):
-        val = ""
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getImportance ( arg, rxx ):
-        val = ""
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getSlot ( arg, rxx ):
-        val = ""
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "-1"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
-    def getComment ( arg, rxx ):
-        val = ""
-        if rxx [ "is_defined" ] == "1":
-            val = rxx [ "value" ]
-        else:
-            val = "(TODO: add comment here)"
-        return { arg: { "name": rxx [ "name" ], "val": val } }
+#   Most of the commands in a typical recipe are ones like 
+#   "wiggle", "ActionStandaloneQuicksave", or 
+#   "ActionStandaloneResetPuzzle", with no ingredients, or
+#   just the iterations or the slot. The Lua for one of 
+#   those depends on nothing but the text of its action, 
+#   and the same text shows up over and over again. 
+#
+#   So the first time the text of a trivial action is seen,
+#   it's parsed, turned into a GuiCommand, and its Lua is 
+#   generated, all as usual. The GuiCommand, Lua included,
+#   goes in TrivialCommands, keyed by the text. After that,
+#   spiritNested finds the text there, and hands back the 
+#   same GuiCommand, without parsing anything, and CmdWriter
+#   just copies its Lua.
+#
+#   TrivialArgs lists the trivial commands, with the one 
+#   ingredient they may have. An action with anything else 
+#   takes the long way around. TrivialCommands stops growing 
+#   at TrivialLimit entries, and actions longer than 
+#   TrivialLength aren't looked up at all.
+#
+TrivialArgs = {
+    "shake":                                "num_of_iterations",
+    "wiggle":                               "num_of_iterations",
+    "ActionStandaloneResetPuzzle":          None,
+    "ActionStandaloneRestoreAbsoluteBest":  None,
+    "ActionNoviceRestoreAbsoluteBest":      None,
+    "ActionStandaloneResetRecentBest":      None,
+    "ActionNoviceResetRecentBest":          None,
+    "ActionStandaloneRestoreRecentBest":    None,
+    "ActionNoviceRestoreRecentBest":        None,
+    "ActionStandaloneQuicksave":            "slot",
+    "ActionNoviceQuicksave":                "slot",
+    "ActionStandaloneQuickload":            "slot",
+    "ActionNoviceQuickload":                "slot",
+    }
+TrivialCommands = {}
+TrivialLength = 256
+TrivialLimit = 4096
 
+def TrivialCommand ( text, cmdobj ):
 #
-#   rxargs tells which function to call for a given ingredient
-#   
-    rxargs = {
-        "num_of_iterations":                    getIters,
-        "residues":                             getResidues,
-        "residues1":                            getResidues,
-        "residues2":                            getResidues,
-        "structure":                            getStructure,
-        "aa":                                   getAA,
-        "bands":                                getBands,
-        "strength":                             getStrength,
-        "importance":                           getImportance,
-        "slot":                                 getSlot,
-        "comment":                              getComment,
-        }
+#   returns the GuiCommand for a trivial action,
+#   or cmdobj if it isn't one after all
 #
-#   process entire recipe
+    arg = TrivialArgs [ cmdobj [ "name" ] ]
+    for key in cmdobj:
+        if key != "name" and key != arg:
+            return cmdobj
+    try:
+        cmd = ParseCommand ( cmdobj )
+        writer = CmdWriter ( None, False )
+        writer ( 0, cmd )
+    except ( KeyError, TypeError, AttributeError ):
+        return cmdobj
+    cmd.lua = "".join ( writer.out )
+    if len ( TrivialCommands ) < TrivialLimit:
+        TrivialCommands [ text ] = cmd
+    return cmd
+
 #
-    def get_valid_filename(s):  # borrowed from Django
-        s = str(s).strip().replace(' ', '_')
-        return re.sub(r'(?u)[^-\w.]', '', s)
-    rxxfile = get_valid_filename ( rxx [ "name" ] ) + ".lua" 
-    with open ( os.path.join ( outdir, rxxfile ), "w" ) as fout:
-    #
-    #   print the recipe attributes as a Lua block comment
-    #   (this list of attributes is specific to GUI recipes)
-    #
-        rxattrs = [
-             "name",
-             "desc",
-             "size",
-             "type",
-             "folder_name", 
-             "hidden",
-             "mid",
-             "mrid",
-             "parent",
-             "parent_mrid",
-             "player_id",
-             "share_scope",
-             "uses"
-             ]
-        fout.write ( "--[[\n\n" )
-        for attr in rxattrs:
-            fout.write ( "    {} = {}\n".format ( attr, rxx [ attr ] ) )
-        fout.write ( "\n]]--\n" )
-    #
-    #   track user picks for segments and bands
-    #
-        segpick = []
-        bndpick = []
-    #
-    #   print each command 
-    #
-        cmdcnt = int ( rxx [ "size" ] )
-        for cmdnum in range ( cmdcnt ):
-            cmdnam = "action-{}".format ( cmdnum )
-            cmdobj = JSONize ( rxx [ cmdnam ] )
-            cmdcmd = cmdobj [ "name" ]
-            cmdarg = ""
-            for arg in cmdobj:
-                if arg != "name":
-                    if len ( cmdarg ) > 0:
-                        cmdarg += ", "
-                    cmdarg += arg
-
-            if detail:
-                fout.write ( "--  command {} = {} ({})\n".format ( cmdnum + 1, cmdcmd, cmdarg ) )
-        #
-        #   get the ingredients/arguments for the command
-        #
-            argl = {}
-            for arg in cmdobj:
-                if arg != "name":
-                    argl.update ( rxargs [ arg ] ( arg, JSONize ( cmdobj [ arg ] ) ) )
-
-            if detail:
-                for axx in argl:
-                    fout.write ( "--  {} = {}\n".format ( axx, argl [ axx ] ) )
-                    
-        #
-        #   generate the Lua for the command
-        #
-            cmdgen = rxcmds [ cmdcmd ]
-            cmdgen [ 0 ] ( argl )
+#   ResetMemos - forget the ingredients and trivial commands,
+#   so the next scan starts cold, the way a new process does
+#
+def ResetMemos ():
+    Ingredients.clear ()
+    TrivialCommands.clear ()
 
-    return
 def checkAttrs ( rxx ):
 #
 #   check for the presence of each 
@@ -1263,188 +1995,2098 @@ def checkAttrs ( rxx ):
             rxx [ attr ] = attrvals [ attr ]
             pass
     return
-def main ():
-    ReVersion = "MacroScanner 1.1" 
+#
+#   ConvertRecipe - generate the Lua file for one recipe
+#
+#   This is the piece of work handed to a worker process
+#   when --jobs is used, so it sticks to module-level
+#   functions and arguments that can be pickled.
+#
+#   If cachefile is given, the new Lua file is copied
+#   there for next time.
+#
+#   The Lua is generated in memory, then written out,
+#   so the size and TODO count come for free.
+#
+#   returns:
+#
+#   the path of the Lua file, or with archived, the list of 
+#   ( path, text ) for the archive, since nothing is written 
+#   to outdir
+#
+#   and a dictionary describing the Lua (see LuaInfo), with
+#   the time taken, with timed, the phase times (see 
+#   PhaseTimer), and whether the file was written (see 
+#   LuaFile.save, which leaves it alone with identical)
+#
+#   an action or ingredient that isn't valid JSON Spirit only
+#   turns up here, and in a worker process, there's nobody to
+#   catch it, so the json.JSONDecodeError comes back as the
+#   "error" in the dictionary, with no path, for the 
+#   RecipeQueue to report (see ListJSONError)
+#
+def ConvertRecipe ( rxx, detail, outdir, cachefile = None, atomic = False, archived = False, timed = False,
+                    identical = False, filename = None ):
+    times = None
+    if timed:
+        times = collections.Counter ()
+    begin = time.perf_counter ()
+    held = LuaArchive ()
+    with PhaseTimer ( times ):
+        try:
+            if rxx [ "type" ] == "gui":
+                ListCmds ( rxx, detail, outdir, atomic, held, filename )
+            else:
+                ListLua ( rxx, outdir, atomic, held, filename )
+        except json.JSONDecodeError as erred:
+            return None, { "error": erred }
+    outpath, text = held.entries [ -1 ]
+    start = time.perf_counter ()
+    written = None
+    if not archived:
+        written = LuaFile.save ( outpath, text, atomic, identical )
+    if cachefile is not None:
+        RecipeCache.store ( outpath, cachefile, text )
+    if times is not None:
+        times [ "output" ] += time.perf_counter () - start
+    info = LuaInfo ( text )
+    info [ "seconds" ] = time.perf_counter () - begin
+    info [ "times" ] = times
+    info [ "written" ] = written
+    if archived:
+        return held.entries, info
+    return outpath, info
 
-    prog = 'python MacroScanner.py'
-    description = ('Scan Foldit cookbook all.macro file for '
-                   'GUI recipes and generate Lua equivalents.')
-    parser = argparse.ArgumentParser(prog=prog, description=description)
-    parser.add_argument('infile', nargs='?',
-                        type=argparse.FileType(),
-                        help='an all.macro file to be scanned',
-                        default="all.macro")
-    parser.add_argument('outfile', nargs='?',
-                        type=argparse.FileType('w', encoding="utf-8"),
-                        help='output file listing all recipes and their descriptions',
-                        default=sys.stdout)
-    parser.add_argument('--detail', action='store_true', default=False,
-                        help='include details of each GUI command in Lua output')
-    parser.add_argument('--LuaV1', action='store_true', default=False,
-                        help='include recipes written using V1 of the Foldit Lua interface')
-    parser.add_argument('--LuaV2', action='store_true', default=False,
-                        help='include recipes written using V2 of the Foldit Lua interface')
-    parser.add_argument('--noGUI', action='store_true', default=False,
-                        help='don\'t include GUI recipes')
-    parser.add_argument('--outdir', default=".",
-                        help='output directory')
+#
+#   RecipeFingerprint - hash of what a recipe does
+#
+#   the name, description, and the other attributes are left
+#   out, so recipes which were shared or copied come out the
+#   same -- for a GUI recipe, it's the commands, decoded the
+#   way they're converted, for a Lua recipe, the script
+#
+def RecipeFingerprint ( rxx ):
+    sha = hashlib.sha256 ()
+    if rxx [ "type" ] == "gui":
+        sha.update ( b"gui\n" )
+        for cmd in CompileRecipe ( rxx ):
+            sha.update ( json.dumps ( [ cmd.name, cmd.asdict () ], sort_keys = True ).encode ( "utf-8" ) )
+            sha.update ( b"\n" )
+    else:
+        sha.update ( "script {}\n".format ( rxx.get ( "script_version" ) ).encode ( "utf-8" ) )
+        sha.update ( rxx.get ( "script", "" ).encode ( "utf-8" ) )
+    return sha.hexdigest ()
 
-    options = parser.parse_args()
+def LuaInfo ( text ):
+#
+#   size in bytes and number of TODOs in the Lua for a recipe
+#
+    return { "bytes": len ( text.encode ( "utf-8" ) ), "todos": text.count ( "TODO:" ) }
+
+#
+#   PhaseTimer - time the phases of converting a recipe
+#
+#   With --stats, the time spent converting a recipe is split
+#   into phases. The phases deep in the conversion add their
+#   time to the Counter in Timing as they go:
+#
+#   jsonize     - JSONize of each action (ListCmds)
+#   ingredients - decoding the ingredients (rxargs), in 
+#                 ParseCommand, or in IngredientMemo.add
+#   output      - writing the Lua file
+#
+#   and whatever's left over is "codegen", generating 
+#   the Lua (rxcmds, and the header comment).
+#
+#   ScanCookbook uses a PhaseTimer too, with the rest going
+#   to "parse", since most ingredients are decoded as the 
+#   line is parsed, the first time they're seen.
+#
+#   Timing is None unless a recipe is being timed, so 
+#   there's next to no cost without --stats.
+#
+Timing = None
 
-    recipes = 0
-    guirecipes = 0
-    guiskips = 0
-    luarecipes = 0
-    v1skips = 0
-    v2skips = 0
-    jsonerrors = 0
+@contextlib.contextmanager
+def PhaseTimer ( times, rest = "codegen" ):
+    global Timing
+    if times is None:
+        yield
+        return
+    Timing = times
+    before = sum ( times.values () )
+    start = time.perf_counter ()
+    try:
+        yield
+    finally:
+        Timing = None
+        times [ rest ] += time.perf_counter () - start - ( sum ( times.values () ) - before )
 
-    linecnt = 0
+#
+#   RecipeStats - time spent in each phase, per recipe and in total
+#
+#   The phases of reading the cookbook are timed by ScanCookbook:
+#
+#   read    - reading a line from the cookbook
+#   decode  - decoding the line from UTF-8
+#   parse   - JSON Spirit to dictionaries, including the 
+#             de-escape and string decoding (SpiritMembers),
+#             but not the ingredients decoded along the way,
+#             which count as "ingredients"
+#
+#   and the phases of converting a recipe by PhaseTimer, in
+#   whichever process converts it. The times for a line go 
+#   to the next recipe listed, which for single.macro is the 
+#   one recipe made from all the lines.
+#
+#   Each recipe's times go in the "times" of its record
+#   (see RecipeRecord).
+#
+class RecipeStats:
+    phases = ( "read", "decode", "parse", "jsonize", "ingredients", "codegen", "output" )
 
-    outdir = options.outdir
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
+    def __init__ ( self ):
+        self.totals = dict.fromkeys ( self.phases, 0.0 )
+        self.recipes = []
+        self.pending = {}
+        self.start = time.perf_counter ()
+
+    def add ( self, phase, seconds, record = None ):
+        self.totals [ phase ] += seconds
+        times = self.pending if record is None else record [ "times" ]
+        times [ phase ] = times.get ( phase, 0.0 ) + seconds
+
+    def merge ( self, times, record ):
+        for phase, seconds in times.items ():
+            self.add ( phase, seconds, record )
+
+    def recipe ( self, record ):
+    #
+    #   start timing a recipe, which gets
+    #   the times for its line(s)
+    #
+        record [ "times" ] = self.pending
+        self.pending = {}
+        self.recipes.append ( record )
+        return record
+
+    def drop ( self ):
+    #
+    #   forget the line times for a recipe that isn't listed
+    #   on its own (unchanged in an incremental scan)
+    #
+        self.pending = {}
+
+    def lines ( self, lines ):
+    #
+    #   time the reading of each line
+    #
+        lines = iter ( lines )
+        while True:
+            start = time.perf_counter ()
+            try:
+                item = next ( lines )
+            except StopIteration:
+                return
+            self.add ( "read", time.perf_counter () - start )
+            yield item
+
+    def report ( self, fo, slowest = 10 ):
+        fo.write ( "=========================================================================\n" )
+        fo.write ( "time by phase (seconds)\n" )
+        for phase in self.phases:
+            fo.write ( "{} = {:.6f}\n".format ( phase, self.totals [ phase ] ) )
+        fo.write ( "total = {:.6f}\n".format ( sum ( self.totals.values () ) ) )
+        fo.write ( "elapsed = {:.6f}\n".format ( time.perf_counter () - self.start ) )
+        ranked = sorted ( self.recipes, key = lambda record: sum ( record [ "times" ].values () ), reverse = True )
+        if len ( ranked ) > 0:
+            fo.write ( "slowest recipes (seconds)\n" )
+        for record in ranked [ :slowest ]:
+            times = record [ "times" ]
+            phases = ", ".join ( "{} {:.6f}".format ( phase, times [ phase ] ) for phase in self.phases if phase in times )
+            fo.write ( "{:.6f} = \"{}\" ({})\n".format ( sum ( times.values () ), record [ "name" ], phases ) )
+
+    def save ( self, path ):
+        with open ( path, "w", encoding = "utf-8" ) as fout:
+            json.dump ( { "version": ReVersion,
+                          "elapsed": time.perf_counter () - self.start,
+                          "totals": self.totals,
+                          "recipes": self.recipes }, fout, indent = 1 )
+            fout.write ( "\n" )
 
 #
-#   process the outer level, removing version and verify
+#   RecipeRecord - what happened to one recipe, for --results 
+#   and --stats
 #
-#   the top level has a keyword-value pair for each recipe
+#   status is one of:
+#
+#   converted - Lua generated
+#   cached    - Lua copied from the cache
+#   unchanged - left alone by an incremental scan
+#   skipped   - not converted, due to the options
+#   error     - the line couldn't be parsed
+#
+#   output, bytes, todos, and seconds are filled in when the 
+#   Lua is written, which may be after a worker finishes.
+#
+def RecipeRecord ( cookbook, key, rxx, status = "skipped" ):
+    commands = None
+    if rxx [ "type" ] == "gui" and "size" in rxx:
+        commands = int ( rxx [ "size" ] )
+    return {
+        "cookbook":         cookbook,
+        "key":              key,
+        "name":             rxx [ "name" ],
+        "type":             rxx [ "type" ],
+        "script_version":   rxx.get ( "script_version" ),
+        "commands":         commands,
+        "status":           status,
+        "output":           None,
+        "bytes":            None,
+        "todos":            None,
+        "seconds":          None,
+        }
+
 #
-    with options.infile as fp, options.outfile as fo:
+#   RecipeResults - JSON Lines stream of recipe records
+#
+#   One line per recipe, written as soon as the recipe is 
+#   done, so the stream can be followed during a long run.
+#
+class RecipeResults:
+    def __init__ ( self, path ):
+        self.fout = open ( path, "w", encoding = "utf-8" )
+
+    def write ( self, record ):
+        self.fout.write ( json.dumps ( record, ensure_ascii = False ) )
+        self.fout.write ( "\n" )
+
+    def close ( self ):
+        self.fout.close ()
+
+#
+#   RecipeCache - keep converted recipes around for next time
+#
+#   Each entry is the Lua generated for a recipe, named for a 
+#   hash of the recipe's raw JSON Spirit text plus everything
+#   else which changes the output: the MacroScanner version
+#   and the detail option. The recipe name is in the raw text,
+#   so the same hash always means the same Lua file name too.
+#
+#   The modification time of an entry is bumped each time 
+#   it's used, and at the end of a run, the least recently 
+#   used entries are deleted until the cache fits in maxsize. 
+#
+class RecipeCache:
+    def __init__ ( self, cachedir, maxsize ):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists ( cachedir ):
+            os.makedirs ( cachedir )
+
+    def hasher ( self, detail ):
+    #
+    #   hash object for building a key a piece at a time
+    #
+        sha = hashlib.sha256 ()
+        sha.update ( "{}\n{}\n".format ( ReVersion, bool ( detail ) ).encode ( "utf-8" ) )
+        return sha
+
+    def key ( self, raw, detail ):
+        sha = self.hasher ( detail )
+        sha.update ( raw.encode ( "utf-8" ) )
+        return sha.hexdigest ()
+
+    def path ( self, key ):
+        return os.path.join ( self.cachedir, key [ :2 ], key + ".lua" )
+
+    def fetch ( self, key, outpath, archive = None, identical = False, atomic = False ):
+    #
+    #   copy a cached recipe to outpath, or add it 
+    #   to archive, returns None if it's not cached
+    #
+    #   with identical, outpath is left alone if it's
+    #   the same as the cached copy, and the return is
+    #   False, otherwise it's True
+    #
+    #   with atomic, the copy goes through LuaFile.create,
+    #   so outpath is never left half written
+    #
+        cachefile = self.path ( key )
+        written = True
         try:
-            singlefmt = False
-            singledict = {}
-            fo.write ( ReVersion )
-            fo.write ( "\n" )
-            for line in fp:
-                linecnt = linecnt + 1
-                outpath = "line{0}.out".format ( linecnt )
-                if  not line.find ( "version" ) == 0 \
-                and not line.find ( "verify" ) == 0 \
-                and not line.find ( "{" ) == 0 \
-                and not line.find ( "}" ) == 0:
-                    recipes = recipes + 1
-                    #fo.write ( "line length = {}\n".format ( len ( line ) ) )
-                    #fo.write ( "line slice = {}\n".format ( line [ 0:100 ] ) )
-                    line = "{\n" + line + "}\n"
-                    try:
-                    #
-                    #   the Foldit JSON Spirit escapes "," and "#", 
-                    #   which is not standard
-                    #   
-                    #   we'll de-escape them here, with a regular 
-                    #   expression which matches a variable number
-                    #   of backslashes followed by  "," or "#"
-                    #   
-                    #   the backslashes are the first group, which is dropped
-                    #   the  "," or "#" is the second group, the replacement
-                    #
-                        linex = re.sub ( r"(\\+)([#,])", r"\2", line )
-                        rx = json.loads ( linex )
- 
-                    #
-                    #   detect single.macro format in typical brute-force style
-                    #
-                        if not singlefmt:
-                            for kk, vv in rx.items ():
-                                if kk == "action-0":
-                                    singlefmt = True
-                                    fo.write ( "single.macro format\n")
-                                    break
-                    #
-                    #   in single.macro format, accumulate each line into a dictionary
-                    #
-                        if singlefmt:
-                            singledict.update ( rx )
-                    #
-                    #   in normal mode, the entire recipe is contained in the line we just read
-                    #
-                        else:
-                            for kk, vv in rx.items ():
-                            #
-                            #   next level down has the content of each recipe
-                            #
-                                rxx = JSONize ( vv )
-                                checkAttrs ( rxx )
-                                fo.write ( "=========================================================================\n" )
-
-                                fo.write ( "recipe = \"{}\", type = \"{}\"\n".format ( rxx [ "name" ], rxx [ "type"] ) )
-                                fo.write ( "description = \"{}\"\n".format ( rxx [ "desc" ] ) )
-                                if rxx [ "type" ] == "gui":
-                                    guirecipes = guirecipes + 1
-                                    if not options.noGUI:
-                                        ListCmds ( rxx, options.detail, outdir )
-                                    else:
-                                        print ( "recipe skipped" )
-                                        guiskips = guiskips + 1
-                                if rxx [ "type" ] == "script":
-                                    luarecipes = luarecipes + 1
-                                    sver = rxx [ "script_version" ]
-                                    if options.LuaV1 and sver == "1" or options.LuaV2 and sver == "2":
-                                        ListLua ( rxx, outdir )
-                                    else:
-                                        print ( "recipe skipped" )
-                                        if sver == "1":
-                                            v1skips = v1skips + 1
-                                        if sver == "2":
-                                            v2skips = v2skips + 1
-
-                    except json.JSONDecodeError as erred:
-                        fo.write ( "JSON decode error: {}\n".format ( erred ) )
-                        fo.write ( "error position {}\n".format ( erred.pos ) )
-                        errchar = erred.doc [ erred.pos + 1 ]
-                        fo.write ( "error character = \"{}\"\n".format ( errchar ) )
-                        dlen = len ( erred.doc ) 
-                        dstart = max ( 0, erred.pos - 10 )
-                        dend = min ( dlen, erred.pos + 10 )
-                        fo.write ( "error context = \"{}\" [ {}:{} ]\n".format ( erred.doc [ dstart: dend ], dstart, dend ) )
-                        jsonerrors = jsonerrors + 1
-                        pass
-        #
-        #   at the end, for single.macro format, dump the recipe
-        #
-            if singlefmt:
-                checkAttrs ( singledict )
-                fo.write ( "=========================================================================\n" )
+            if archive is not None:
+                with open ( cachefile ) as fin:
+                    archive.add ( outpath, fin.read () )
+            elif identical and os.path.exists ( outpath ) \
+            and filecmp.cmp ( cachefile, outpath, shallow = False ):
+                written = False
+            elif atomic:
+                with open ( cachefile ) as fin:
+                    with LuaFile.create ( outpath, atomic ) as fout:
+                        shutil.copyfileobj ( fin, fout )
+            else:
+                shutil.copyfile ( cachefile, outpath )
+            os.utime ( cachefile )
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return written
 
-                fo.write ( "recipe = \"{}\", type = \"{}\"\n".format ( singledict [ "name" ], singledict [ "type"] ) )
-                fo.write ( "description = \"{}\"\n".format ( singledict [ "desc" ] ) )
-                if singledict [ "type" ] == "gui":
-                    guirecipes = guirecipes + 1
-                    if not options.noGUI:
-                        ListCmds ( singledict, options.detail, outdir )
-                    else:
-                        print ( "recipe skipped" )
-                        guiskips = guiskips + 1
-                if singledict [ "type" ] == "script":
-                    luarecipes = luarecipes + 1
-                    sver = singledict [ "script_version" ]
-                    if options.LuaV1 and sver == "1" or options.LuaV2 and sver == "2":
-                        ListLua ( singledict, outdir )
-                    else:
-                        print ( "recipe skipped" )
-                        if sver == "1":
-                            v1skips = v1skips + 1
-                        if sver == "2":
-                            v2skips = v2skips + 1
-
-        except UnicodeDecodeError as erred:
-            fo.write ( erred )
-            fo.write ( "\n" )
-            pass
+    @staticmethod
+    def store ( outpath, cachefile, text = None ):
+    #
+    #   copy to a temporary name first, so a reader 
+    #   never sees a partial entry
+    #
+    #   with text, that's what goes in the cache, 
+    #   since there's no file at outpath
+    #
+        cachedir = os.path.dirname ( cachefile )
+        if not os.path.exists ( cachedir ):
+            os.makedirs ( cachedir, exist_ok = True )
+        tmpfile = "{}.{}.tmp".format ( cachefile, os.getpid () )
+        if text is not None:
+            with open ( tmpfile, "w" ) as fout:
+                fout.write ( text )
+        else:
+            shutil.copyfile ( outpath, tmpfile )
+        os.replace ( tmpfile, cachefile )
+
+    def evict ( self ):
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk ( self.cachedir ):
+            for fname in files:
+                fpath = os.path.join ( root, fname )
+                try:
+                    st = os.stat ( fpath )
+                except FileNotFoundError:
+                    continue
+                entries.append ( ( st.st_mtime, st.st_size, fpath ) )
+                total += st.st_size
+        entries.sort ()
+        evicted = 0
+        for mtime, size, fpath in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove ( fpath )
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        return evicted
+
+#
+#   RecipeQueue - run ConvertRecipe, here or in a process pool
+#
+#   With one job, each recipe is converted on the spot, 
+#   same as always. With more, recipes are handed to a
+#   process pool, with a limited number in flight so a
+#   big cookbook doesn't pile up in memory. Results are
+#   collected in the order the recipes were queued, so
+#   any exception raised by a worker surfaces in order.
+#
+#   With a RecipeCache, a recipe which has been converted
+#   before is copied from the cache instead.
+#
+#   With dedup, a recipe which does the same as one already 
+#   queued in this run, going by its RecipeFingerprint, isn't
+#   converted again, it shares the Lua of the first one.
+#
+#   With identical, a Lua file which already holds what would
+#   be written isn't written again. written and unchanged count
+#   the files written and left alone.
+#
+class RecipeQueue:
+    def __init__ ( self, jobs, cache = None, atomic = False, archive = None, stats = None, results = None,
+                   dedup = False, identical = False ):
+        self.pool = None
+        self.cache = cache
+        self.identical = identical
+        self.written = 0
+        self.unchanged = 0
+        self.shared = None
+        if dedup:
+            self.shared = {}
+        self.atomic = atomic
+        self.archive = archive
+        self.stats = stats
+        self.results = results
+        self.cookbook = None
+        self.fo = None          # where ScanCookbook lists the recipes,
+        self.counts = None      # its counts,
+        self.index = None       # and its RecipeIndex, for ListJSONError
+        self.pending = collections.deque ()
+        self.backlog = jobs * 4
+        if jobs > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor ( max_workers = jobs )
+
+    def recording ( self ):
+    #
+    #   True if recipes need a RecipeRecord
+    #
+        return self.stats is not None or self.results is not None
+
+    def deferred ( self ):
+    #
+    #   True if a recipe may be collected after
+    #   the recipes that follow it have been listed
+    #
+        return self.pool is not None
+
+    def done ( self, record ):
+        if self.results is not None and record is not None:
+            self.results.write ( record )
+
+    def wrote ( self, written ):
+    #
+    #   count a Lua file written (True), or left alone 
+    #   because it was the same (False), None is neither
+    #
+        if written is True:
+            self.written += 1
+        elif written is False:
+            self.unchanged += 1
+
+    def convert ( self, rxx, detail, outdir, raw = None, record = None, filename = None, line = None, key = None ):
+    #
+    #   record is the RecipeRecord for the recipe, which
+    #   gets filled in when the Lua has been written
+    #
+    #   filename is the name from LuaFileNames
+    #
+    #   line and key say where the recipe came from, 
+    #   in case it turns out to have a JSON error
+    #
+    #   returns the path of the Lua file of the first recipe
+    #   if this one is a duplicate, otherwise None
+    #
+        cachefile = None
+        timed = self.stats is not None
+        outpath = os.path.join ( outdir, filename or LuaFileName ( rxx ) )
+        if self.shared is not None:
+            fingerprint = RecipeFingerprint ( rxx )
+            if fingerprint in self.shared:
+                if record is not None:
+                    record [ "status" ] = "duplicate"
+                    record [ "output" ] = self.shared [ fingerprint ]
+                    self.done ( record )
+                return self.shared [ fingerprint ]
+            self.shared [ fingerprint ] = outpath
+        if record is not None:
+            record [ "status" ] = "converted"
+            record [ "output" ] = outpath
+        if self.cache is not None and raw is not None:
+            start = time.perf_counter ()
+            key = self.cache.key ( raw, detail )
+            fetched = self.cache.fetch ( key, outpath, self.archive, self.identical, self.atomic )
+            if timed:
+                self.stats.add ( "output", time.perf_counter () - start, record )
+            if fetched is not None:
+                if self.archive is None:
+                    self.wrote ( fetched )
+                if record is not None:
+                    record [ "status" ] = "cached"
+                    with open ( self.cache.path ( key ) ) as fin:
+                        record.update ( LuaInfo ( fin.read () ) )
+                    record [ "seconds" ] = time.perf_counter () - start
+                    self.done ( record )
+                return None
+            cachefile = self.cache.path ( key )
+        self.submit ( ( rxx, detail, outdir, cachefile, self.atomic, self.archive is not None, timed, self.identical,
+                        filename ), record, ( line, key, rxx.get ( "name" ) ) )
+        return None
+
+    def submit ( self, args, record, origin ):
+    #
+    #   args are the arguments for ConvertRecipe,
+    #   origin is the ( line, key, name ) of the recipe
+    #
+        if self.pool is None:
+            self.collect ( ConvertRecipe ( *args ), record, origin )
+            return
+        future = self.pool.submit ( ConvertRecipe, *args )
+        self.pending.append ( ( future, record, origin ) )
+        while len ( self.pending ) > self.backlog:
+            future, record, origin = self.pending.popleft ()
+            self.collect ( future.result (), record, origin )
+
+    def collect ( self, result, record, origin ):
+    #
+    #   in archive mode, the result includes 
+    #   the Lua that goes in the archive
+    #
+    #   a recipe with a JSON error is reported the same 
+    #   way as one ScanCookbook couldn't parse, and its
+    #   record is replaced by the error, and it's left
+    #   out of the index, so it's tried again next time
+    #
+    #   if other recipes have been listed since, the 
+    #   error says which recipe it belongs to
+    #
+        output, info = result
+        if "error" in info:
+            if self.counts is None:
+                raise info [ "error" ]
+            line, key, name = origin
+            ListJSONError ( self.fo, info [ "error" ], self.counts, self, line,
+                            name if self.deferred () else None )
+            if self.index is not None and key is not None:
+                self.index.forget ( key )
+            return
+        if self.archive is not None:
+            self.archive.extend ( output )
+        self.wrote ( info [ "written" ] )
+        if record is None:
+            return
+        if info [ "times" ] is not None:
+            self.stats.merge ( info [ "times" ], record )
+        record [ "bytes" ] = info [ "bytes" ]
+        record [ "todos" ] = info [ "todos" ]
+        record [ "seconds" ] = info [ "seconds" ]
+        self.done ( record )
+
+    def drain ( self ):
+        while self.pending:
+            future, record, origin = self.pending.popleft ()
+            self.collect ( future.result (), record, origin )
+
+    def close ( self ):
+        self.drain ()
+        if self.pool is not None:
+            self.pool.shutdown ()
+
+#
+#   PipelineQueue - RecipeQueue that converts and writes in stages
+#
+#   With --pipeline, reading the cookbook, converting the 
+#   recipes, and writing the Lua files overlap, instead of
+#   each recipe waiting for the one before to be written.
+#   ScanCookbook is the read stage, as always. The convert
+#   and write stages run in an asyncio event loop on their
+#   own thread, with a bounded asyncio.Queue in front of 
+#   each, so a slow stage holds up the ones ahead of it
+#   rather than letting recipes pile up in memory:
+#
+#       ScanCookbook -> converting -> convert stage -> writing -> write stage
+#
+#   The convert stage hands each recipe to an executor, the
+#   --jobs process pool, or one thread, and passes the future
+#   straight on. The write stage waits for each future in 
+#   turn, and writes the Lua on a writer thread. What's done
+#   is handed back to the main thread, which collects it,
+#   so the records, stats, and archive are only ever touched
+#   there, same as with RecipeQueue.
+#
+class PipelineQueue ( RecipeQueue ):
+    def __init__ ( self, jobs, *args, **kwargs ):
+        super ().__init__ ( 1, *args, **kwargs )
+        self.backlog = max ( jobs, 2 ) * 4
+        if jobs > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor ( max_workers = jobs )
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor ( max_workers = 1 )
+        self.writer = concurrent.futures.ThreadPoolExecutor ( max_workers = 1 )
+        self.finished = collections.deque ()
+        self.loop = asyncio.new_event_loop ()
+        self.thread = threading.Thread ( target = self.loop.run_forever, daemon = True )
+        self.thread.start ()
+        self.call ( self.start () )
+
+    def call ( self, coro ):
+    #
+    #   run a coroutine in the event loop, and wait for it
+    #
+        return asyncio.run_coroutine_threadsafe ( coro, self.loop ).result ()
+
+    async def start ( self ):
+        self.converting = asyncio.Queue ( self.backlog )
+        self.writing = asyncio.Queue ( self.backlog )
+        self.stages = [ asyncio.ensure_future ( self.convertStage () ),
+                        asyncio.ensure_future ( self.writeStage () ) ]
+
+    async def convertStage ( self ):
+        loop = asyncio.get_event_loop ()
+        while True:
+            item = await self.converting.get ()
+            if item is None:
+                await self.writing.put ( None )
+                return
+            args, record, origin = item
+            future = loop.run_in_executor ( self.executor, ConvertRecipe, *args )
+            await self.writing.put ( ( future, record, origin ) )
+
+    async def writeStage ( self ):
+        loop = asyncio.get_event_loop ()
+        while True:
+            item = await self.writing.get ()
+            if item is None:
+                return
+            future, record, origin = item
+            try:
+                result = await future
+                if self.archive is None:
+                    await loop.run_in_executor ( self.writer, self.write, result )
+            except Exception as erred:
+                result = erred
+            self.finished.append ( ( result, record, origin ) )
+
+    def write ( self, result ):
+        entries, info = result
+        if "error" in info:
+            return
+        start = time.perf_counter ()
+        for path, text in entries:
+            info [ "written" ] = LuaFile.save ( path, text, self.atomic, self.identical )
+        if info [ "times" ] is not None:
+            info [ "times" ] [ "output" ] += time.perf_counter () - start
+
+    def submit ( self, args, record, origin ):
+    #
+    #   the Lua always comes back from ConvertRecipe,
+    #   to be written by the write stage
+    #
+        rxx, detail, outdir, cachefile, atomic, archived, timed, identical, filename = args
+        self.call ( self.converting.put ( ( ( rxx, detail, outdir, cachefile, atomic, True, timed, False, filename ),
+                                            record, origin ) ) )
+        self.collectFinished ()
+
+    def deferred ( self ):
+        return True
+
+    def collectFinished ( self ):
+        while self.finished:
+            result, record, origin = self.finished.popleft ()
+            if isinstance ( result, Exception ):
+                raise result
+            self.collect ( result, record, origin )
+
+    async def flush ( self, restart = True ):
+    #
+    #   let everything queued go through, then start over
+    #
+        await self.converting.put ( None )
+        await asyncio.gather ( *self.stages )
+        if restart:
+            await self.start ()
+
+    def drain ( self ):
+        self.call ( self.flush () )
+        self.collectFinished ()
+
+    def close ( self ):
+        try:
+            self.call ( self.flush ( False ) )
+            self.collectFinished ()
+        finally:
+            self.loop.call_soon_threadsafe ( self.loop.stop )
+            self.thread.join ()
+            self.loop.close ()
+            self.executor.shutdown ()
+            self.writer.shutdown ()
+
+#
+#   ListRecipe - list a recipe in the output file, and 
+#   decide whether it gets converted
+#
+#   arguments:
+#
+#   rxx     - dictionary containing the recipe
+#   options - command line options
+#   fo      - output file listing the recipes
+#   counts  - dictionary of recipe counts, updated here
+#
+#   returns:
+#
+#   True if the recipe should be converted
+#
+def ListRecipe ( rxx, options, fo, counts ):
+    checkAttrs ( rxx )
+    fo.write ( "=========================================================================\n" )
+
+    fo.write ( "recipe = \"{}\", type = \"{}\"\n".format ( rxx [ "name" ], rxx [ "type"] ) )
+    fo.write ( "description = \"{}\"\n".format ( rxx [ "desc" ] ) )
+    if rxx [ "type" ] == "gui":
+        counts [ "guirecipes" ] += 1
+        if not options.noGUI:
+            return True
+        print ( "recipe skipped" )
+        counts [ "guiskips" ] += 1
+    if rxx [ "type" ] == "script":
+        counts [ "luarecipes" ] += 1
+        sver = rxx [ "script_version" ]
+        if options.LuaV1 and sver == "1" or options.LuaV2 and sver == "2":
+            return True
+        print ( "recipe skipped" )
+        if sver == "1":
+            counts [ "v1skips" ] += 1
+        if sver == "2":
+            counts [ "v2skips" ] += 1
+    return False
+
+#
+#   RecipeIndex - remember where each recipe was, for an incremental scan
+#
+#   The index lives in the output directory, and lists each 
+#   recipe in the cookbook by its top-level key, with the 
+#   byte offset, length, and hash of its line, plus the few 
+#   attributes needed to list it and the Lua file it went to.
+#
+#   On the next run, a line whose hash hasn't changed is 
+#   listed from the index, and isn't parsed or converted 
+#   again, as long as its Lua file is still there. If the 
+#   cookbook hasn't been touched at all (same size and 
+#   modification time), it isn't even read. The Lua files of 
+#   recipes which have disappeared from the cookbook are deleted.
+#   Recipes the filters don't want keep their entries, and their
+#   Lua files, from the last scan that converted them.
+#
+#   The index is only used for the cookbook it was made from, and
+#   entries are only reused if the options which change the output
+#   are the same.
+#
+RecipeKey = re.compile ( rb'"((?:[^"\\]|\\.)*)"' )
+
+class RecipeIndex:
+    FileName = ".MacroScanner.idx"
+    ListAttrs = ( "name", "desc", "type", "script_version" )
+
+    def __init__ ( self, cookbook, outdir, options ):
+        self.path = os.path.join ( outdir, self.FileName )
+        self.outdir = outdir
+        self.cookbook = os.path.abspath ( cookbook )
+        self.signature = "{} detail={} noGUI={} LuaV1={} LuaV2={} {}".format ( 
+            ReVersion, options.detail, options.noGUI, options.LuaV1, options.LuaV2,
+            RecipeFilter.fromOptions ( options ) )
+        self.old = {}
+        self.new = {}
+        self.oldstat = None
+        self.reusable = False
+        self.removed = 0
+        try:
+            with open ( self.path, encoding = "utf-8" ) as fi:
+                saved = json.load ( fi )
+        except ( OSError, ValueError ):
+            return
+        if saved.get ( "cookbook" ) != self.cookbook:
+            return
+        self.old = saved.get ( "recipes", {} )
+        self.reusable = saved.get ( "signature" ) == self.signature
+        if self.reusable and saved.get ( "errors", 1 ) == 0:
+            self.oldstat = saved.get ( "stat" )
+
+    @staticmethod
+    def digest ( bline ):
+        return hashlib.sha1 ( bline ).hexdigest ()
+
+    def outputExists ( self, entry ):
+        return not entry [ "output" ] \
+            or os.path.exists ( os.path.join ( self.outdir, entry [ "output" ] ) )
+
+    def untouched ( self, fstat ):
+    #
+    #   True if the cookbook is exactly as we left it
+    #
+        if self.oldstat != [ fstat.st_size, fstat.st_mtime_ns ]:
+            return False
+        for entry in self.old.values ():
+            if not self.outputExists ( entry ):
+                return False
+        return True
+
+    def unchanged ( self, key, digest ):
+    #
+    #   the saved entry for key, if it can be reused
+    #
+        entry = self.old.get ( key )
+        if not self.reusable or entry is None or entry [ "hash" ] != digest:
+            return None
+        if not self.outputExists ( entry ):
+            return None
+        return entry
+
+    def keep ( self, key, entry, offset, length ):
+        entry = dict ( entry )
+        entry.pop ( "filtered", None )
+        entry [ "offset" ] = offset
+        entry [ "length" ] = length
+        self.new [ key ] = entry
+
+    def filter ( self, key, peeked, offset, length ):
+    #
+    #   a recipe the filters don't want carries its old entry,
+    #   and so its Lua, forward, with the attributes PeekRecipe 
+    #   found, so an untouched cookbook lists it as filtered
+    #
+        entry = dict ( self.old.get ( key, { "hash": None, "output": "" } ) )
+        entry [ "filtered" ] = peeked
+        entry [ "offset" ] = offset
+        entry [ "length" ] = length
+        self.new [ key ] = entry
+
+    def forget ( self, key ):
+    #
+    #   a recipe that couldn't be converted isn't 
+    #   indexed, so it's tried again next time
+    #
+        self.new.pop ( key, None )
+
+    def record ( self, key, offset, length, digest, rxx, output ):
+        entry = { "offset": offset, "length": length, "hash": digest, "output": output }
+        for attr in self.ListAttrs:
+            if attr in rxx:
+                entry [ attr ] = rxx [ attr ]
+        self.new [ key ] = entry
+
+    def entries ( self ):
+    #
+    #   saved entries in cookbook order
+    #
+        return sorted ( self.old.items (), key = lambda item: item [ 1 ] [ "offset" ] )
+
+    def finish ( self, fstat, errors ):
+    #
+    #   delete the Lua for recipes that are gone, or were 
+    #   converted again under another name, and save the 
+    #   new index
+    #
+    #   recipes still in the cookbook which weren't converted,
+    #   filtered out or skipped, keep their Lua
+    #
+        live = set ( entry [ "output" ] for entry in self.new.values () )
+        for key, entry in self.old.items ():
+            renamed = key in self.new and self.new [ key ] [ "output" ] not in ( "", entry [ "output" ] )
+            if entry [ "output" ] and entry [ "output" ] not in live \
+            and ( key not in self.new or renamed ):
+                try:
+                    os.remove ( os.path.join ( self.outdir, entry [ "output" ] ) )
+                    self.removed += 1
+                except FileNotFoundError:
+                    pass
+        saved = {
+            "cookbook":     self.cookbook,
+            "signature":    self.signature,
+            "stat":         [ fstat.st_size, fstat.st_mtime_ns ],
+            "errors":       errors,
+            "recipes":      self.new,
+            }
+        tmpfile = self.path + ".tmp"
+        with open ( tmpfile, "w", encoding = "utf-8" ) as fi:
+            json.dump ( saved, fi )
+        os.replace ( tmpfile, self.path )
+
+#
+#   CookbookLines - the lines of a cookbook, without copying them
+#
+#   The cookbook is memory-mapped, and each line is handed 
+#   back as a memoryview slice of the map, so nothing is 
+#   copied until a line is actually decoded. Files which 
+#   can't be mapped (stdin, empty files) are read normally.
+#
+#   yields:
+#
+#   ( byte offset, line ) for each line, including the "\n"
+#
+def CookbookLines ( fp ):
+    try:
+        mm = mmap.mmap ( fp.fileno (), 0, access = mmap.ACCESS_READ )
+    except ( AttributeError, OSError, ValueError, io.UnsupportedOperation ):
+        offset = 0
+        for bline in fp:
+            yield offset, bline
+            offset = offset + len ( bline )
+        return
+    view = memoryview ( mm )
+    try:
+        start = 0
+        size = len ( mm )
+        while start < size:
+            end = mm.find ( b"\n", start )
+            end = size if end < 0 else end + 1
+            yield start, view [ start:end ]
+            start = end
+    finally:
+        view.release ()
+        try:
+            mm.close ()
+        except BufferError:
+            pass    # the caller still has a line, the map goes when it does
+
+#
+#   Cookbook - index of the recipes in a cookbook, for use as a library
+#
+#   Cookbook.open scans all.macro once, and lists each recipe 
+#   by its key, name, type, script_version, size, folder_name,
+#   and player_id, with the byte offset and length of its line, 
+#   without decoding the commands or the script. Those attributes are picked out 
+#   of the raw line by PeekAttrs. A recipe is only decoded, 
+#   and converted, when it's asked for:
+#
+#       with Cookbook.open ( "all.macro" ) as book:
+#           for entry in book:
+#               print ( entry.name, entry.type, entry.size )
+#           entry = book.find ( "Recipe 1" ) [ 0 ]
+#           lua = book.lua ( entry )
+#
+#   A single.macro file has just one recipe, spread over 
+#   many lines, so its entry covers all of them, and the
+#   attributes come from decoding the lines which aren't
+#   actions.
+#
+#   Each entry gets its own Lua file name from LuaFileNames,
+#   in cookbook order, as filename.
+#
+#   The top level attributes of a recipe show up in the raw 
+#   line as \n\"name\" : \"value\", with the value escaped
+#   once for JSON, on top of the JSON Spirit escapes. The 
+#   same attributes in an action, or quotes in a script, are
+#   escaped once more, so PeekAttrs doesn't see them.
+#
+PeekAttrs = re.compile ( rb'\\n\\"(name|type|script_version|size|folder_name|player_id)\\" : \\"((?:[^"\\]|\\[^"\\]|\\\\(?:[^"\\]|\\.))*)\\"' )
+
+def PeekValue ( raw ):
+#
+#   decode the JSON escapes, then the JSON Spirit ones
+#
+    spirit = json.loads ( b'"' + bytes ( raw ) + b'"' )
+    value, pos = spiritString ( spirit + '"', 0 )
+    return value
+
+def PeekRecipe ( bline ):
+#
+#   returns the key and the attributes found
+#   in the line for one recipe in all.macro
+#
+    key = None
+    keymatch = RecipeKey.match ( bline )
+    if keymatch:
+        key = keymatch.group ( 1 ).decode ( "utf-8" )
+    attrs = {}
+    for found in PeekAttrs.finditer ( bline ):
+        attr = found.group ( 1 ).decode ( "utf-8" )
+        if attr not in attrs:
+            attrs [ attr ] = PeekValue ( found.group ( 2 ) )
+            if len ( attrs ) == 6:
+                break
+    return key, attrs
+
+class CookbookEntry:
+    __slots__ = ( "key", "name", "type", "script_version", "size", "folder_name", "player_id",
+                  "offset", "length", "filename" )
+
+    def __init__ ( self, key, attrs, offset, length ):
+    #
+    #   missing attributes get the same defaults as in checkAttrs
+    #
+        self.key = key
+        self.name = attrs.get ( "name", "unknown" )
+        self.type = attrs.get ( "type", "gui" )
+        self.script_version = attrs.get ( "script_version" )
+        self.size = Count ( attrs.get ( "size", "0" ) )
+        self.folder_name = attrs.get ( "folder_name" )
+        self.player_id = attrs.get ( "player_id" )
+        self.offset = offset
+        self.length = length
+        self.filename = None
+
+    def __repr__ ( self ):
+        return "CookbookEntry ( {!r}, {!r}, {!r} )".format ( self.key, self.name, self.type )
+
+class Cookbook:
+    def __init__ ( self, fp, path = None ):
+        self.fp = fp
+        self.path = path
+        self.single = False
+        self.entries = []
+        self.keys = {}
+        self.names = LuaFileNames ()
+        self.scan ()
+
+    @classmethod
+    def open ( cls, path ):
+        return cls ( open ( path, "rb" ), path )
+
+    def scan ( self ):
+        attrs = {}
+        for offset, bline in CookbookLines ( self.fp ):
+            if bline [ :7 ] == b"version" \
+            or bline [ :6 ] == b"verify" \
+            or bline [ :1 ] == b"{" \
+            or bline [ :1 ] == b"}":
+                continue
+        #
+        #   in single.macro format, every line is an attribute,
+        #   only the ones which aren't actions get decoded
+        #
+            if not self.single and RawActionKey.match ( bline ):
+                self.single = True
+                first = offset
+            if self.single:
+                if not RawActionKey.match ( bline ):
+                    attrs.update ( SpiritMembers ( str ( bline, "utf-8" ) ) )
+                last = offset + len ( bline )
+                continue
+            key, peeked = PeekRecipe ( bline )
+            self.add ( CookbookEntry ( key, peeked, offset, len ( bline ) ) )
+        if self.single:
+            self.add ( CookbookEntry ( None, attrs, first, last - first ) )
+
+    def add ( self, entry ):
+        entry.filename = self.names.allocate ( { "name": entry.name } )
+        self.entries.append ( entry )
+        self.keys [ entry.key ] = entry
+
+    def __len__ ( self ):
+        return len ( self.entries )
+
+    def __iter__ ( self ):
+        return iter ( self.entries )
+
+    def __getitem__ ( self, key ):
+        return self.keys [ key ]
+
+    def find ( self, name ):
+    #
+    #   returns the entries for the recipes with this name,
+    #   there can be more than one
+    #
+        return [ entry for entry in self.entries if entry.name == name ]
+
+    def select ( self, wanted ):
+    #
+    #   returns the entries a RecipeFilter wants
+    #
+        return [ entry for entry in self.entries if wanted ( entry ) ]
+
+    def recipe ( self, entry ):
+    #
+    #   read and decode the recipe for an entry
+    #
+        self.fp.seek ( entry.offset )
+        text = str ( self.fp.read ( entry.length ), "utf-8" )
+        if self.single:
+            rxx = {}
+            for line in text.splitlines ():
+                rxx.update ( SpiritMembers ( line ) )
+        else:
+            rxx = JSONize ( SpiritMembers ( text, True ) [ entry.key ] )
+        checkAttrs ( rxx )
+        return rxx
+
+    def lua ( self, entry, detail = False ):
+    #
+    #   the Lua for the recipe, as text
+    #
+        held = LuaArchive ()
+        self.convert ( entry, "", detail, archive = held )
+        return held.entries [ -1 ] [ 1 ]
+
+    def convert ( self, entry, outdir = ".", detail = False, atomic = False, archive = None ):
+    #
+    #   write the Lua file for the recipe, returns its path
+    #
+        rxx = self.recipe ( entry )
+        if rxx [ "type" ] == "gui":
+            return ListCmds ( rxx, detail, outdir, atomic, archive, entry.filename )
+        return ListLua ( rxx, outdir, atomic, archive, entry.filename )
+
+    def close ( self ):
+        self.fp.close ()
+
+    def __enter__ ( self ):
+        return self
+
+    def __exit__ ( self, exc_type, exc_value, traceback ):
+        self.close ()
+        return False
+
+#
+#   RecipeFilter - pick recipes by their top level attributes
+#
+#   The filters only look at what PeekRecipe finds in the raw 
+#   line, so a recipe that's filtered out is never decoded. 
+#   Every filter given has to match:
+#
+#   name            - regular expression, searched for in the name
+#   folder          - folder_name, exactly
+#   player          - player_id, exactly
+#   type            - "gui" or "script"
+#   script_version  - "1" or "2", for script recipes
+#   minsize/maxsize - range for size, the number of GUI commands
+#
+#   A filter is called with a CookbookEntry, and returns True
+#   if the recipe is wanted.
+#
+class RecipeFilter:
+    def __init__ ( self, name = None, folder = None, player = None, type = None, 
+                   script_version = None, minsize = None, maxsize = None ):
+        self.name = re.compile ( name ) if name is not None else None
+        self.folder = folder
+        self.player = player
+        self.type = type
+        self.script_version = script_version
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.active = any ( test is not None for test in ( name, folder, player, type, 
+                            script_version, minsize, maxsize ) )
+
+    @classmethod
+    def fromOptions ( cls, options ):
+        return cls ( options.name, options.folder, options.player, options.type,
+                     options.script_version, options.min_size, options.max_size )
+
+    def __str__ ( self ):
+    #
+    #   the filters, for the index signature
+    #
+        return "name={} folder={} player={} type={} script_version={} size={}-{}".format (
+            self.name.pattern if self.name is not None else None, self.folder, self.player,
+            self.type, self.script_version, self.minsize, self.maxsize )
+
+    def __call__ ( self, entry ):
+        if self.name is not None and not self.name.search ( entry.name ):
+            return False
+        if self.folder is not None and entry.folder_name != self.folder:
+            return False
+        if self.player is not None and entry.player_id != self.player:
+            return False
+        if self.type is not None and entry.type != self.type:
+            return False
+        if self.script_version is not None and entry.script_version != self.script_version:
+            return False
+        if self.minsize is not None or self.maxsize is not None:
+            if not isinstance ( entry.size, int ):
+                return False
+            if self.minsize is not None and entry.size < self.minsize:
+                return False
+            if self.maxsize is not None and entry.size > self.maxsize:
+                return False
+        return True
+
+#
+#   SingleStream - convert a single.macro recipe as it's read
+#
+#   single.macro has the attributes of one GUI recipe, one 
+#   per line, sorted by name, so "action-10" shows up before 
+#   "action-2", and "name" doesn't show up until after all 
+#   the actions.
+#
+#   Each action is converted as soon as the ones before it
+#   have been, and the Lua goes to a temporary file in the 
+#   output directory. An action which arrives ahead of its 
+#   turn is kept as the raw line until its turn comes. At the 
+#   end, when the name and the other attributes are known, 
+#   the header and the converted commands are written to the 
+#   real Lua file.
+#
+#   So the only parts of the recipe held in memory are the
+#   attributes and the actions waiting their turn.
+#
+#   "size" sorts after the actions, so it isn't known until 
+#   they've been converted. Where each command starts in the
+#   temporary file is kept (counting characters, which is much
+#   cheaper than asking the file), and the commands from size 
+#   on are cut off at the end, so the Lua stops at size, as it
+#   does in ListCmds. Actions that arrive once size is known
+#   are dropped.
+#
+RawActionKey = re.compile ( rb'"action-(\d+)"' )
+ActionKey = re.compile ( r"action-(\d+)$" )
+
+class SingleStream:
+    def __init__ ( self, detail, outdir, cache = None, timed = False ):
+        self.attrs = {}
+        self.early = {}
+        self.nextcmd = 0
+        self.marks = []
+        self.chars = 0
+        self.cache = cache
+        self.times = None
+        if timed:
+            self.times = collections.Counter ()
+        self.sha = None
+        if cache is not None:
+            self.sha = cache.hasher ( detail )
+        self.body = tempfile.TemporaryFile ( "w+", dir = outdir if os.path.isdir ( outdir ) else None )
+        self.gencmd = CmdWriter ( self.body, detail )
+        self.written = None
+
+    def feed ( self, bline ):
+    #
+    #   look at a line before it's decoded, returns True if
+    #   it's an action that has to wait its turn, in which
+    #   case the stream holds on to it
+    #
+        if self.sha is not None:
+            self.sha.update ( bline )
+        action = RawActionKey.match ( bline )
+        if action is not None and int ( action.group ( 1 ) ) != self.nextcmd:
+            self.early [ int ( action.group ( 1 ) ) ] = bytes ( bline )
+            return True
+        return False
+
+    def add ( self, rx ):
+    #
+    #   add the pairs from a parsed line, and convert
+    #   whatever actions are ready
+    #
+        for kk, vv in rx.items ():
+            action = ActionKey.match ( kk )
+            if action is not None:
+                self.early [ int ( action.group ( 1 ) ) ] = vv
+            else:
+                self.attrs [ kk ] = vv
+        self.convert ()
+
+    def size ( self ):
+    #
+    #   the number of actions, once it's known
+    #
+        if "size" not in self.attrs:
+            return None
+        return int ( self.attrs [ "size" ] )
+
+    def convert ( self ):
+        size = self.size ()
+        if size is not None:
+            for cmdnum in [ cmdnum for cmdnum in self.early if cmdnum >= size ]:
+                del self.early [ cmdnum ]
+        with PhaseTimer ( self.times ):
+            starts = []
+            while self.nextcmd in self.early:
+                action = self.early.pop ( self.nextcmd )
+                if isinstance ( action, bytes ):
+                    action = SpiritMembers ( str ( action, "utf-8" ) ) [ "action-{}".format ( self.nextcmd ) ]
+                starts.append ( ( self.nextcmd, len ( self.gencmd.out ) ) )
+                self.gencmd ( self.nextcmd, ParseCommand ( JSONize ( action ) ) )
+                self.nextcmd += 1
+            if starts:
+                offsets = [ 0 ]
+                offsets.extend ( itertools.accumulate ( map ( len, self.gencmd.out ) ) )
+                for cmdnum, start in starts:
+                    self.marks.append ( ( cmdnum, self.chars + offsets [ start ] ) )
+                self.chars += offsets [ -1 ]
+            self.gencmd.flush ()
+
+    def finish ( self, outdir, atomic = False, archive = None, record = None, identical = False ):
+    #
+    #   write the Lua file, returns its path
+    #
+    #   any actions still waiting come after a missing
+    #   one, they go in order after the gap
+    #
+    #   record, if any, is the RecipeRecord to fill in
+    #
+    #   with identical, the Lua is put together in memory, 
+    #   so it can be compared with the file that's there,
+    #   and written sets to whether the file was written 
+    #
+        self.convert ()
+        while self.early:
+            self.nextcmd = min ( self.early )
+            self.convert ()
+        size = self.size ()
+        if size is not None:
+            for cmdnum, offset in self.marks:
+                if cmdnum >= size:
+                    self.body.seek ( 0 )
+                    kept = self.body.read ( offset )
+                    self.body.seek ( 0 )
+                    self.body.truncate ()
+                    self.body.write ( kept )
+                    break
+        outpath = os.path.join ( outdir, LuaFileName ( self.attrs ) )
+        if record is not None:
+            record [ "status" ] = "converted"
+            record [ "output" ] = outpath
+        cachefile = None
+        if self.cache is not None:
+            key = self.sha.hexdigest ()
+            fetched = self.cache.fetch ( key, outpath, archive, identical, atomic )
+            if fetched is not None:
+                if archive is None:
+                    self.written = fetched
+                self.body.close ()
+                if record is not None:
+                    record [ "status" ] = "cached"
+                    self.describe ( self.cache.path ( key ), record )
+                return outpath
+            cachefile = self.cache.path ( key )
+        held = None
+        if archive is not None or identical:
+            held = LuaArchive ()
+        start = time.perf_counter ()
+        with LuaFile.create ( outpath, atomic, held ) as fout:
+            ListCmdsHeader ( self.attrs, fout )
+            self.body.seek ( 0 )
+            shutil.copyfileobj ( self.body, fout )
+        self.body.close ()
+        if archive is None:
+            self.written = True
+            if held is not None:
+                self.written = LuaFile.save ( outpath, held.entries [ -1 ] [ 1 ], atomic, identical )
+        if self.times is not None:
+            self.times [ "output" ] += time.perf_counter () - start
+        if cachefile is not None:
+            RecipeCache.store ( outpath, cachefile, held.entries [ -1 ] [ 1 ] if held else None )
+        if record is not None:
+            if held is not None:
+                record.update ( LuaInfo ( held.entries [ -1 ] [ 1 ] ) )
+            else:
+                self.describe ( outpath, record )
+        if archive is not None:
+            archive.extend ( held.entries )
+        return outpath
+
+    @staticmethod
+    def describe ( luafile, record ):
+    #
+    #   the Lua isn't kept in memory, so
+    #   read it back for the record
+    #
+        with open ( luafile ) as fin:
+            record.update ( LuaInfo ( fin.read () ) )
+
+    def discard ( self ):
+        self.body.close ()
+
+#
+#   ListJSONError - report a recipe that isn't valid JSON Spirit
+#
+#   The error goes in the output file, and the counts, and 
+#   with --results, replaces the record for the recipe.
+#   ScanCookbook calls it for a line it can't parse, and 
+#   RecipeQueue for a recipe that turned out to have a bad 
+#   action or ingredient when it was converted. With name, 
+#   the error comes after other recipes have been listed, 
+#   and starts by saying which recipe it's for.
+#
+def ListJSONError ( fo, erred, counts, queue, line, name = None ):
+    if name is not None:
+        fo.write ( "JSON error in recipe = \"{}\", line {}\n".format ( name, line ) )
+    fo.write ( "JSON decode error: {}\n".format ( erred ) )
+    fo.write ( "error position {}\n".format ( erred.pos ) )
+    errchar = erred.doc [ erred.pos + 1 ]
+    fo.write ( "error character = \"{}\"\n".format ( errchar ) )
+    dlen = len ( erred.doc ) 
+    dstart = max ( 0, erred.pos - 10 )
+    dend = min ( dlen, erred.pos + 10 )
+    fo.write ( "error context = \"{}\" [ {}:{} ]\n".format ( erred.doc [ dstart: dend ], dstart, dend ) )
+    counts [ "jsonerrors" ] += 1
+    if queue.recording ():
+        queue.done ( { "cookbook": queue.cookbook, "line": line, "status": "error",
+                       "error": erred.msg, "position": erred.pos,
+                       "context": erred.doc [ dstart: dend ] } )
+
+#
+#   ScanCookbook - process each recipe in one cookbook
+#
+#   arguments:
+#
+#   fp      - all.macro or single.macro file, opened in binary mode
+#   fo      - output file listing the recipes
+#   options - command line options
+#   outdir  - output directory for the Lua files
+#   queue   - RecipeQueue which converts the recipes
+#   index   - RecipeIndex for an incremental scan, or None
+#   wanted  - RecipeFilter for the recipes to convert, or None for all
+#
+#   returns:
+#
+#   dictionary of recipe counts
+#
+def ScanCookbook ( fp, fo, options, outdir, queue, index = None, wanted = None ):
+    counts = newCounts ()
+    queue.fo = fo
+    queue.counts = counts
+    queue.index = index
+    memohits = Ingredients.hits
+    memomisses = Ingredients.misses
+    linecnt = 0
+    names = LuaFileNames ()
+    stats = queue.stats
+    recording = queue.recording ()
+
+    if index is not None:
+        fstat = os.fstat ( fp.fileno () )
+        if index.untouched ( fstat ):
+            for key, entry in index.entries ():
+                counts [ "recipes" ] += 1
+                if "filtered" in entry:
+                    counts [ "filtered" ] += 1
+                    index.filter ( key, entry [ "filtered" ], entry [ "offset" ], entry [ "length" ] )
+                    if recording:
+                        queue.done ( FilteredRecord ( queue.cookbook,
+                                     CookbookEntry ( key, entry [ "filtered" ], entry [ "offset" ], entry [ "length" ] ) ) )
+                    continue
+                counts [ "unchanged" ] += 1
+                ListRecipe ( dict ( entry ), options, fo, counts )
+                index.keep ( key, entry, entry [ "offset" ], entry [ "length" ] )
+                if recording:
+                    queue.done ( UnchangedRecord ( queue.cookbook, key, entry, outdir ) )
+            index.finish ( fstat, 0 )
+            return counts
+
+#
+#   process the outer level, removing version and verify
+#
+#   the top level has a keyword-value pair for each recipe
+#
+    try:
+        singlefmt = False
+        stream = None
+        lines = CookbookLines ( fp )
+        if stats is not None:
+            lines = stats.lines ( lines )
+        for lineoffset, bline in lines:
+            linecnt = linecnt + 1
+            outpath = "line{0}.out".format ( linecnt )
+            if  not bline [ :7 ] == b"version" \
+            and not bline [ :6 ] == b"verify" \
+            and not bline [ :1 ] == b"{" \
+            and not bline [ :1 ] == b"}":
+                counts [ "recipes" ] += 1
+            #
+            #   a recipe the filters don't want isn't decoded at all,
+            #   single.macro is one recipe, which is checked at the end
+            #
+            #   it still gets its Lua file name, so the names
+            #   of the others don't depend on the filters
+            #
+                allocated = None
+                if wanted is not None and not singlefmt and not RawActionKey.match ( bline ):
+                    peekkey, peeked = PeekRecipe ( bline )
+                    entry = CookbookEntry ( peekkey, peeked, lineoffset, len ( bline ) )
+                    if not wanted ( entry ):
+                        names.allocate ( { "name": entry.name } )
+                        counts [ "filtered" ] += 1
+                        if index is not None and peekkey is not None:
+                            index.filter ( peekkey, peeked, lineoffset, len ( bline ) )
+                        if stats is not None:
+                            stats.drop ()
+                        if recording:
+                            queue.done ( FilteredRecord ( queue.cookbook, entry ) )
+                        continue
+            #
+            #   in an incremental scan, a line that hasn't
+            #   changed doesn't even get decoded, as long as
+            #   its Lua file still gets the same name
+            #
+                key = None
+                if index is not None and not singlefmt:
+                    digest = index.digest ( bline )
+                    keymatch = RecipeKey.match ( bline )
+                    if keymatch:
+                        key = keymatch.group ( 1 ).decode ( "utf-8" )
+                        entry = index.unchanged ( key, digest )
+                        if entry is not None:
+                            allocated = names.allocate ( entry )
+                            if entry [ "output" ] and allocated != entry [ "output" ]:
+                                entry = None
+                        if entry is not None:
+                            counts [ "unchanged" ] += 1
+                            ListRecipe ( dict ( entry ), options, fo, counts )
+                            index.keep ( key, entry, lineoffset, len ( bline ) )
+                            if stats is not None:
+                                stats.drop ()
+                            if recording:
+                                queue.done ( UnchangedRecord ( queue.cookbook, key, entry, outdir ) )
+                            continue
+            #
+            #   in single.macro format, an action that's ahead
+            #   of its turn isn't decoded until it's needed
+            #
+                if singlefmt and stream.feed ( bline ):
+                    continue
+                if stats is not None:
+                    start = time.perf_counter ()
+                line = str ( bline, "utf-8" )
+                if stats is not None:
+                    stats.add ( "decode", time.perf_counter () - start )
+                #fo.write ( "line length = {}\n".format ( len ( line ) ) )
+                #fo.write ( "line slice = {}\n".format ( line [ 0:100 ] ) )
+                raw = line
+                try:
+                #
+                #   the Foldit JSON Spirit escapes "," and "#", 
+                #   which is not standard, and nests each recipe,
+                #   action, and ingredient as an escaped string
+                #   
+                #   SpiritMembers copes with all that in one pass,
+                #   without needing braces around the line
+                #
+                    recipes = not singlefmt and not RawActionKey.match ( bline )
+                    if stats is None:
+                        rx = SpiritMembers ( line, recipes )
+                    else:
+                        parsed = collections.Counter ()
+                        with PhaseTimer ( parsed, "parse" ):
+                            rx = SpiritMembers ( line, recipes )
+                        stats.merge ( parsed, None )
+ 
+                #
+                #   detect single.macro format in typical brute-force style
+                #
+                    if not singlefmt:
+                        for kk, vv in rx.items ():
+                            if kk == "action-0":
+                                singlefmt = True
+                                fo.write ( "single.macro format\n")
+                                stream = SingleStream ( options.detail, outdir, queue.cache, stats is not None )
+                                stream.feed ( bline )
+                                break
+                #
+                #   in single.macro format, convert each action as soon as it can be
+                #
+                    if singlefmt:
+                        stream.add ( rx )
+                #
+                #   in normal mode, the entire recipe is contained in the line we just read
+                #
+                    else:
+                        for kk, vv in rx.items ():
+                        #
+                        #   next level down has the content of each recipe,
+                        #   already parsed by SpiritLoads
+                        #
+                            rxx = JSONize ( vv )
+                            output = ""
+                            listed = ListRecipe ( rxx, options, fo, counts )
+                            record = None
+                            if recording:
+                                record = RecipeRecord ( queue.cookbook, kk, rxx )
+                            if stats is not None:
+                                stats.recipe ( record )
+                            filename = allocated or names.allocate ( rxx )
+                            allocated = None
+                            if listed:
+                                output = filename
+                            if key is not None and len ( rx ) == 1:
+                                index.record ( key, lineoffset, len ( bline ), digest, rxx, output )
+                            if listed:
+                                shared = queue.convert ( rxx, options.detail, outdir, raw if len ( rx ) == 1 else None, record, output,
+                                                         linecnt, key if len ( rx ) == 1 else None )
+                                if shared is not None:
+                                    fo.write ( "duplicate of = \"{}\"\n".format ( shared ) )
+                                    counts [ "duplicates" ] += 1
+                            else:
+                                queue.done ( record )
+
+                except json.JSONDecodeError as erred:
+                    ListJSONError ( fo, erred, counts, queue, linecnt )
+                    if allocated is None and not singlefmt and not RawActionKey.match ( bline ):
+                        names.allocate ( { "name": CookbookEntry ( None, PeekRecipe ( bline ) [ 1 ], 0, 0 ).name } )
+                    pass
+    #
+    #   at the end, for single.macro format, dump the recipe
+    #
+        if singlefmt and wanted is not None \
+        and not wanted ( CookbookEntry ( None, stream.attrs, 0, 0 ) ):
+            counts [ "filtered" ] += 1
+            stream.discard ()
+            if recording:
+                queue.done ( FilteredRecord ( queue.cookbook, CookbookEntry ( None, stream.attrs, 0, 0 ) ) )
+        elif singlefmt:
+            listed = ListRecipe ( stream.attrs, options, fo, counts )
+            record = None
+            if recording:
+                record = RecipeRecord ( queue.cookbook, None, stream.attrs )
+            if stats is not None:
+                stats.recipe ( record )
+            start = time.perf_counter ()
+            if listed:
+                stream.finish ( outdir, options.atomic, queue.archive, record, queue.identical )
+                queue.wrote ( stream.written )
+            else:
+                stream.discard ()
+            if stats is not None:
+                stats.merge ( stream.times, record )
+            if record is not None and listed:
+                record [ "seconds" ] = time.perf_counter () - start
+            queue.done ( record )
+
+    except UnicodeDecodeError as erred:
+        fo.write ( erred )
+        fo.write ( "\n" )
+        if recording:
+            queue.done ( { "cookbook": queue.cookbook, "line": linecnt, "status": "error",
+                           "error": str ( erred ), "position": erred.start } )
+        pass
+#
+#   the recipes still being converted are finished before 
+#   the counts and the index are, since any of them may yet
+#   turn out to have a JSON error
+#
+    queue.drain ()
+#
+#   a single.macro file is one recipe, nothing to index
+#
+    if index is not None and not singlefmt:
+        index.finish ( fstat, counts [ "jsonerrors" ] )
+        counts [ "removed" ] += index.removed
+    counts [ "memohits" ] = Ingredients.hits - memohits
+    counts [ "memomisses" ] = Ingredients.misses - memomisses
+    return counts
+
+def UnchangedRecord ( cookbook, key, entry, outdir ):
+#
+#   RecipeRecord for a recipe skipped by an incremental scan,
+#   from what's in the index
+#
+    record = RecipeRecord ( cookbook, key, entry, "unchanged" )
+    if entry [ "output" ]:
+        record [ "output" ] = os.path.join ( outdir, entry [ "output" ] )
+    return record
+
+def FilteredRecord ( cookbook, entry ):
+#
+#   RecipeRecord for a recipe the filters didn't want,
+#   from what PeekRecipe found
+#
+    record = RecipeRecord ( cookbook, entry.key, { "name": entry.name, "type": entry.type,
+                            "script_version": entry.script_version }, "filtered" )
+    if entry.type == "gui" and isinstance ( entry.size, int ):
+        record [ "commands" ] = entry.size
+    return record
+
+def newCounts ():
+    return {
+        "recipes":      0,
+        "guirecipes":   0,
+        "guiskips":     0,
+        "luarecipes":   0,
+        "v1skips":      0,
+        "v2skips":      0,
+        "jsonerrors":   0,
+        "unchanged":    0,
+        "removed":      0,
+        "duplicates":   0,
+        "filtered":     0,
+        "memohits":     0,
+        "memomisses":   0,
+        }
+
+def ListCounts ( fo, counts ):
+    fo.write ( "recipes read = {}\n".format ( counts [ "recipes" ] ) )
+    fo.write ( "GUI recipes = {}\n".format ( counts [ "guirecipes" ] ) )
+    if counts [ "guiskips" ] > 0:
+        fo.write ( "GUI recipes skipped = {}\n".format ( counts [ "guiskips" ] ) )
+    fo.write ( "Lua recipes = {}\n".format ( counts [ "luarecipes" ] ) )
+    if counts [ "v1skips" ] > 0:
+        fo.write ( "Lua V1 recipes skipped = {}\n".format ( counts [ "v1skips" ] ) )
+    if counts [ "v2skips" ] > 0:
+        fo.write ( "Lua V2 recipes skipped = {}\n".format ( counts [ "v2skips" ] ) )
+    fo.write ( "JSON errors = {}\n".format ( counts [ "jsonerrors" ] ) )
+    if counts [ "unchanged" ] > 0:
+        fo.write ( "recipes unchanged = {}\n".format ( counts [ "unchanged" ] ) )
+    if counts [ "removed" ] > 0:
+        fo.write ( "Lua files removed = {}\n".format ( counts [ "removed" ] ) )
+    if counts [ "duplicates" ] > 0:
+        fo.write ( "duplicate recipes = {}\n".format ( counts [ "duplicates" ] ) )
+    if counts [ "filtered" ] > 0:
+        fo.write ( "recipes filtered out = {}\n".format ( counts [ "filtered" ] ) )
+    if counts [ "memohits" ] + counts [ "memomisses" ] > 0:
+        fo.write ( "ingredient memo hits = {}\n".format ( counts [ "memohits" ] ) )
+        fo.write ( "ingredient memo misses = {}\n".format ( counts [ "memomisses" ] ) )
+    return
+
+#
+#   FindCookbooks - expand the batch infile into a list of cookbooks
+#
+#   infile may be:
+#
+#   + a directory, which is searched (with its subdirectories)
+#     for files ending in ".macro"
+#   + a glob pattern, like "players/*/all.macro"
+#   + a cookbook, which is a file ending in ".macro", or one
+#     which starts with "version" or "{" like all.macro and
+#     single.macro do
+#   + a manifest file, listing one cookbook per line,
+#     with paths relative to the manifest, and "#" comments
+#
+#   returns:
+#
+#   list of ( cookbook path, output subdirectory name ) pairs
+#
+def IsCookbook ( path ):
+    with open ( path, "rb" ) as fp:
+        first = fp.readline ( 64 ).lstrip ()
+    return first [ :7 ] == b"version" or first [ :1 ] == b"{"
+
+def FindCookbooks ( infile ):
+    if os.path.isdir ( infile ):
+        books = []
+        for root, dirs, files in os.walk ( infile ):
+            dirs.sort ()
+            for fname in sorted ( files ):
+                if fname.endswith ( ".macro" ):
+                    books.append ( os.path.join ( root, fname ) )
+    elif glob.has_magic ( infile ):
+        books = sorted ( glob.glob ( infile, recursive = True ) )
+    elif infile.endswith ( ".macro" ) or IsCookbook ( infile ):
+        books = [ infile ]
+    else:
+        books = []
+        mdir = os.path.dirname ( infile )
+        with open ( infile ) as mf:
+            for mline in mf:
+                mline = mline.strip ()
+                if len ( mline ) > 0 and not mline.startswith ( "#" ):
+                    books.append ( os.path.join ( mdir, mline ) )
+#
+#   name each output subdirectory after the part of the cookbook's 
+#   path that's different from the others, so ".../alice/all.macro"
+#   and ".../bob/all.macro" end up in "alice_all" and "bob_all"
+#
+    if len ( books ) == 0:
+        return []
+    common = ""
+    if len ( books ) > 1:
+        common = os.path.commonpath ( [ os.path.abspath ( book ) for book in books ] )
+    used = set ()
+    pairs = []
+    for book in books:
+        if common:
+            rel = os.path.relpath ( os.path.abspath ( book ), common )
+        else:
+            rel = os.path.basename ( book )
+        sub = os.path.splitext ( rel ) [ 0 ]
+        sub = re.sub ( r'(?u)[^-\w.]', '', sub.replace ( os.sep, "_" ).replace ( ' ', '_' ) )
+        base = sub
+        seq = 1
+        while sub in used:
+            seq = seq + 1
+            sub = "{}_{}".format ( base, seq )
+        used.add ( sub )
+        pairs.append ( ( book, sub ) )
+    return pairs
+
+#
+#   ServeCookbook - convert one cookbook posted to the server
+#
+#   The cookbook is scanned from memory, with the Lua going
+#   into a zip archive, along with the summary that would
+#   have gone to outfile, as "summary.txt".
+#
+#   returns:
+#
+#   the zip archive, as bytes
+#
+def ServeCookbook ( data, options, queue, wanted = None ):
+    zipped = io.BytesIO ()
+    archive = LuaArchive ( "served.zip", ".", zipped )
+    queue.archive = archive
+    queue.cookbook = "-"
+    if queue.shared is not None:
+        queue.shared = {}
+    summary = io.StringIO ()
+    summary.write ( ReVersion )
+    summary.write ( "\n" )
+    try:
+        counts = ScanCookbook ( io.BytesIO ( data ), summary, options, ".", queue, None, wanted )
+        queue.drain ()
+    finally:
+        queue.pending.clear ()
+        queue.archive = None
+    summary.write ( "=========================================================================\n" )
+    summary.write ( ReVersion + " - complete\n" )
+    ListCounts ( summary, counts )
+#
+#   the server doesn't stop between cookbooks, so 
+#   the cache is trimmed after each one
+#
+    if queue.cache is not None:
+        evicted = queue.cache.evict ()
+        if evicted > 0:
+            summary.write ( "cache entries evicted = {}\n".format ( evicted ) )
+    archive.add ( "summary.txt", summary.getvalue () )
+    archive.close ()
+    return zipped.getvalue ()
+
+#
+#   ServeHandler - HTTP front end for ServeCookbook
+#
+#   POST the contents of an all.macro or single.macro file,
+#   and the reply is the zip archive from ServeCookbook:
+#
+#       curl --data-binary @all.macro -o lua.zip http://localhost:8080/
+#
+#   The same protocol is spoken on a Unix socket:
+#
+#       curl --unix-socket /tmp/macro.sock --data-binary @all.macro -o lua.zip http://x/
+#
+#   The server stays up between requests, so the --jobs 
+#   workers (with the CmdWriter tables already built in each
+#   one) and the --cache are reused, instead of starting a 
+#   new MacroScanner for every cookbook. Requests are handled 
+#   one at a time, each one using all of the workers.
+#
+class ServeHandler ( http.server.BaseHTTPRequestHandler ):
+    server_version = "MacroScanner/1.2"
+
+    def address_string ( self ):
+    #
+    #   Unix socket clients don't have an address
+    #
+        if isinstance ( self.client_address, tuple ):
+            return self.client_address [ 0 ]
+        return "unix"
+
+    def do_POST ( self ):
+        length = self.headers.get ( "Content-Length" )
+        if length is None:
+            self.send_error ( 411 )
+            return
+        data = self.rfile.read ( int ( length ) )
+        try:
+            body = ServeCookbook ( data, self.server.options, self.server.queue, self.server.wanted )
+        except Exception as erred:
+            self.send_error ( 500, "conversion failed: {!r}".format ( erred ) )
+            return
+        self.send_response ( 200 )
+        self.send_header ( "Content-Type", "application/zip" )
+        self.send_header ( "Content-Length", str ( len ( body ) ) )
+        self.end_headers ()
+        self.wfile.write ( body )
+
+def Serve ( address, options, queue, wanted = None ):
+#
+#   address is HOST:PORT, or just PORT, for HTTP over TCP,
+#   anything else is the path of a Unix socket
+#
+    host, colon, port = address.rpartition ( ":" )
+    if port.isdigit ():
+        server = http.server.HTTPServer ( ( host or "localhost", int ( port ) ), ServeHandler )
+        sockpath = None
+    else:
+        if not hasattr ( socketserver, "UnixStreamServer" ):
+            raise OSError ( "Unix sockets aren't supported here" )
+        sockpath = address
+        if os.path.exists ( sockpath ) and stat.S_ISSOCK ( os.stat ( sockpath ).st_mode ):
+            os.remove ( sockpath )
+        server = socketserver.UnixStreamServer ( sockpath, ServeHandler )
+    server.options = options
+    server.queue = queue
+    server.wanted = wanted
+    sys.stderr.write ( "{} serving on {}\n".format ( ReVersion, address ) )
+    try:
+        server.serve_forever ()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close ()
+        if sockpath is not None and os.path.exists ( sockpath ):
+            os.remove ( sockpath )
+
+def openCookbook ( path ):
+    if path == "-":
+        return sys.stdin.buffer
+    return open ( path, "rb" )
+
+def main ():
+    prog = 'python MacroScanner.py'
+    description = ('Scan Foldit cookbook all.macro file for '
+                   'GUI recipes and generate Lua equivalents.')
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument('infile', nargs='?',
+                        help='an all.macro file to be scanned',
+                        default="all.macro")
+    parser.add_argument('outfile', nargs='?',
+                        type=argparse.FileType('w', encoding="utf-8"),
+                        help='output file listing all recipes and their descriptions',
+                        default=sys.stdout)
+    parser.add_argument('--detail', action='store_true', default=False,
+                        help='include details of each GUI command in Lua output')
+    parser.add_argument('--LuaV1', action='store_true', default=False,
+                        help='include recipes written using V1 of the Foldit Lua interface')
+    parser.add_argument('--LuaV2', action='store_true', default=False,
+                        help='include recipes written using V2 of the Foldit Lua interface')
+    parser.add_argument('--noGUI', action='store_true', default=False,
+                        help='don\'t include GUI recipes')
+    parser.add_argument('--outdir', default=".",
+                        help='output directory')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes used to convert recipes')
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help='infile is a directory, glob pattern, or manifest of cookbooks, '
+                             'each converted into its own subdirectory of outdir')
+    parser.add_argument('--cache',
+                        help='directory for caching the Lua generated for each recipe')
+    parser.add_argument('--cache-size', type=float, default=256,
+                        help='maximum size of the cache in megabytes (default 256)')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='only convert recipes which have changed since the last scan '
+                             'into outdir, and remove the Lua for recipes which are gone')
+    parser.add_argument('--atomic', action='store_true', default=False,
+                        help='write each Lua file under a temporary name, then rename it, '
+                             'so no partial files are left behind')
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help='time each phase of reading and converting the recipes, '
+                             'and list the totals and the slowest recipes in outfile')
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help='also write the times for each recipe to FILE as JSON '
+                             '(implies --stats)')
+    parser.add_argument('--results', metavar='FILE',
+                        help='write a JSON Lines record for each recipe to FILE: name, type, '
+                             'status, output file, size, TODO count, time, and any errors')
+    parser.add_argument('--archive',
+                        help='put the Lua files in this zip or tar archive (.zip, .tar, '
+                             '.tar.gz, .tgz, .tar.bz2, .tar.xz) instead of outdir')
+    parser.add_argument('--dedup', action='store_true', default=False,
+                        help='convert recipes which do the same thing only once, and list '
+                             'the others as duplicates of the first one\'s Lua file')
+    parser.add_argument('--name', metavar='REGEX',
+                        help='only convert recipes with a name matching this regular expression')
+    parser.add_argument('--folder',
+                        help='only convert recipes in this folder')
+    parser.add_argument('--player', metavar='ID',
+                        help='only convert recipes with this player_id')
+    parser.add_argument('--type', choices=['gui', 'script'],
+                        help='only convert recipes of this type')
+    parser.add_argument('--script-version', choices=['1', '2'],
+                        help='only convert script recipes with this script_version')
+    parser.add_argument('--min-size', type=int, metavar='N',
+                        help='only convert recipes with at least N GUI commands')
+    parser.add_argument('--max-size', type=int, metavar='N',
+                        help='only convert recipes with at most N GUI commands')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help='run as a server on HOST:PORT, or on a Unix socket path, '
+                             'converting each cookbook POSTed to it into a zip of the Lua '
+                             'files and the summary')
+    parser.add_argument('--pipeline', action='store_true', default=False,
+                        help='read the cookbook, convert the recipes, and write the Lua files '
+                             'in concurrent stages, with bounded queues between them')
+    parser.add_argument('--skip-identical', action='store_true', default=False,
+                        help='don\'t rewrite Lua files which already hold the same Lua, '
+                             'so they keep their modification times')
+
+    options = parser.parse_args()
+    if options.archive and options.incremental:
+        parser.error ( "--archive can't be used with --incremental" )
+    if options.dedup and options.incremental:
+        parser.error ( "--dedup can't be used with --incremental" )
+    try:
+        wanted = RecipeFilter.fromOptions ( options )
+    except re.error as erred:
+        parser.error ( "bad --name pattern '{}': {}".format ( options.name, erred ) )
+    if not wanted.active:
+        wanted = None
+
+    if options.serve:
+        for conflict in ( "batch", "incremental", "archive", "results", "stats", "stats_json" ):
+            if getattr ( options, conflict ):
+                parser.error ( "--{} can't be used with --serve".format ( conflict.replace ( "_", "-" ) ) )
+        cache = None
+        if options.cache:
+            cache = RecipeCache ( options.cache, int ( options.cache_size * 1024 * 1024 ) )
+        queue = ( PipelineQueue if options.pipeline else RecipeQueue ) ( options.jobs, cache, dedup = options.dedup )
+        try:
+            Serve ( options.serve, options, queue, wanted )
+        except OSError as erred:
+            parser.error ( "can't serve on '{}': {}".format ( options.serve, erred ) )
+        finally:
+            queue.close ()
+        return
+
+    opened = {}
+    if options.batch:
+        try:
+            cookbooks = FindCookbooks ( options.infile )
+        except OSError as erred:
+            parser.error ( "can't open '{}': {}".format ( options.infile, erred ) )
+    else:
+        cookbooks = [ ( options.infile, "" ) ]
+        try:
+            opened [ options.infile ] = openCookbook ( options.infile )
+        except OSError as erred:
+            parser.error ( "can't open '{}': {}".format ( options.infile, erred ) )
+
+    outdir = options.outdir
+    archive = None
+    if options.archive:
+        try:
+            archive = LuaArchive ( options.archive, outdir )
+        except ( OSError, ValueError ) as erred:
+            parser.error ( "can't create '{}': {}".format ( options.archive, erred ) )
+    elif not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    cache = None
+    if options.cache:
+        cache = RecipeCache ( options.cache, int ( options.cache_size * 1024 * 1024 ) )
+    stats = None
+    if options.stats or options.stats_json:
+        stats = RecipeStats ()
+    results = None
+    if options.results:
+        try:
+            results = RecipeResults ( options.results )
+        except OSError as erred:
+            parser.error ( "can't open '{}': {}".format ( options.results, erred ) )
+    Queue = PipelineQueue if options.pipeline else RecipeQueue
+    queue = Queue ( options.jobs, cache, options.atomic, archive, stats, results, options.dedup,
+                    options.skip_identical )
+    totals = newCounts ()
+
+    with options.outfile as fo:
+        fo.write ( ReVersion )
+        fo.write ( "\n" )
+        for cookbook, sub in cookbooks:
+            bookdir = os.path.join ( outdir, sub ) if sub else outdir
+            if options.batch:
+                fo.write ( "=========================================================================\n" )
+                fo.write ( "cookbook = \"{}\", outdir = \"{}\"\n".format ( cookbook, bookdir ) )
+            try:
+                fp = opened.pop ( cookbook ) if cookbook in opened else openCookbook ( cookbook )
+            except OSError as erred:
+                fo.write ( "can't open cookbook: {}\n".format ( erred ) )
+                continue
+            if archive is None and not os.path.exists ( bookdir ):
+                os.makedirs ( bookdir )
+            index = None
+            if options.incremental and cookbook != "-":
+                index = RecipeIndex ( cookbook, bookdir, options )
+            queue.cookbook = cookbook
+            with fp:
+                counts = ScanCookbook ( fp, fo, options, bookdir, queue, index, wanted )
+            if options.batch:
+                fo.write ( "=========================================================================\n" )
+                fo.write ( "cookbook \"{}\" complete\n".format ( cookbook ) )
+                ListCounts ( fo, counts )
+            for key in totals:
+                totals [ key ] += counts [ key ]
+
+        queue.close ()
+        if archive is not None:
+            archive.close ()
+        if results is not None:
+            results.close ()
 
         fo.write ( "=========================================================================\n" )
         fo.write ( ReVersion + " - complete\n" )
-        fo.write ( "recipes read = {}\n".format ( recipes ) )
-        fo.write ( "GUI recipes = {}\n".format ( guirecipes ) )
-        if guiskips > 0:
-            fo.write ( "GUI recipes skipped = {}\n".format ( guiskips ) )
-        fo.write ( "Lua recipes = {}\n".format ( luarecipes ) )
-        if v1skips > 0:
-            fo.write ( "Lua V1 recipes skipped = {}\n".format ( v1skips ) )
-        if v2skips > 0:
-            fo.write ( "Lua V2 recipes skipped = {}\n".format ( v2skips ) )
-        fo.write ( "JSON errors = {}\n".format ( jsonerrors ) )
+        if options.batch:
+            fo.write ( "cookbooks read = {}\n".format ( len ( cookbooks ) ) )
+        ListCounts ( fo, totals )
+        if archive is not None:
+            fo.write ( "Lua files archived = {}\n".format ( archive.count ) )
+        elif options.skip_identical:
+            fo.write ( "Lua files written = {}\n".format ( queue.written ) )
+            fo.write ( "Lua files unchanged = {}\n".format ( queue.unchanged ) )
+        if cache is not None:
+            fo.write ( "cache hits = {}\n".format ( cache.hits ) )
+            fo.write ( "cache misses = {}\n".format ( cache.misses ) )
+            evicted = cache.evict ()
+            if evicted > 0:
+                fo.write ( "cache entries evicted = {}\n".format ( evicted ) )
+        if stats is not None:
+            stats.report ( fo )
+            if options.stats_json:
+                stats.save ( options.stats_json )
 
 if __name__ == "__main__":
    main ()
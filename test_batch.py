@@ -0,0 +1,40 @@
+#
+#   test_batch - regression tests for --batch
+#
+#   run with: python -m pytest -q
+#
+import os
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook, Scan
+
+def test_batch_cookbook ( tmp_path ):
+    cookbook = tmp_path / "recipes.txt"
+    WriteCookbook ( cookbook, [ Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] ) ] )
+    for book in ( "all.macro", "recipes.txt" ):
+        os.replace ( cookbook, tmp_path / book )
+        cookbook = tmp_path / book
+        outdir = tmp_path / ( "out_" + book )
+        summary = Scan ( cookbook, tmp_path / "summary.txt", outdir, "--batch" )
+        assert "cookbooks read = 1\n" in summary
+        assert os.listdir ( outdir ) == [ os.path.splitext ( book ) [ 0 ] ]
+
+def test_batch_missing ( tmp_path ):
+    manifest = tmp_path / "books.txt"
+    manifest.write_text ( "missing/all.macro\n" )
+    summary = Scan ( manifest, tmp_path / "summary.txt", tmp_path / "out", "--batch" )
+    assert "can't open cookbook" in summary
+    assert os.listdir ( tmp_path / "out" ) == []
+
+def test_batch_memo_counts ( tmp_path ):
+    MacroScanner.ResetMemos ()
+    assert MacroScanner.Ingredients.hits + MacroScanner.Ingredients.misses == 0
+    books = tmp_path / "books"
+    books.mkdir ()
+    for book in ( "a.macro", "b.macro" ):
+        WriteCookbook ( books / book, [ Recipe ( "Alpha", "plain", [ Comment ( "a" ), Comment ( "a" ) ] ) ] )
+    summary = Scan ( books, tmp_path / "summary.txt", tmp_path / "out", "--batch" )
+    assert summary.count ( "ingredient memo hits = 1\n" ) == 1
+    assert summary.count ( "ingredient memo hits = 2\n" ) == 1
+    assert summary.count ( "ingredient memo hits = 3\n" ) == 1
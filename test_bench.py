@@ -0,0 +1,36 @@
+#
+#   test_bench - regression tests for MacroBench
+#
+#   run with: python -m pytest -q
+#
+import os
+import types
+
+import MacroScanner
+import MacroBench
+
+def Maker ():
+    options = types.SimpleNamespace ( seed = 1, gui = 0.7, size = 15, script_lines = 20,
+                                      commands = list ( MacroScanner.CmdWriter.rxcmds ),
+                                      residues = MacroBench.ResiduesShapes, bands = MacroBench.BandsShapes )
+    return MacroBench.RecipeMaker ( options )
+
+def test_phases ( tmp_path ):
+    for book, text, count in ( ( "all.macro", MacroBench.GenCookbook ( Maker (), 20 ), 20 ),
+                               ( "single.macro", MacroBench.GenSingle ( Maker (), 15 ), 1 ) ):
+        cookbook = tmp_path / book
+        cookbook.write_text ( text, encoding = "utf-8" )
+        outdir = tmp_path / ( "out_" + book )
+        outdir.mkdir ()
+#
+#   each phase gets the result of the one before, 
+#   PhaseParse has to return the recipes it parsed
+#
+        seconds, peak, recipes = MacroBench.Measure ( lambda: MacroBench.PhaseParse ( str ( cookbook ) ), 2, True )
+        assert len ( recipes ) == count
+        assert all ( isinstance ( rxx, dict ) for rxx in recipes )
+        seconds, peak, entries = MacroBench.Measure ( lambda: MacroBench.PhaseCodegen ( recipes, str ( outdir ), False ), 1, False )
+        assert len ( entries ) == count
+        seconds, peak, written = MacroBench.Measure ( lambda: MacroBench.PhaseOutput ( entries ), 1, False )
+        assert written == count
+        assert len ( os.listdir ( outdir ) ) == len ( set ( path for path, text in entries ) )
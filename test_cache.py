@@ -0,0 +1,38 @@
+#
+#   test_cache - regression tests for --cache
+#
+#   run with: python -m pytest -q
+#
+import os
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook, WriteSingle, Scan
+
+def test_cache_hit_atomic ( tmp_path, monkeypatch ):
+    replaced = []
+    replace = os.replace
+    def Replace ( src, dst ):
+        replaced.append ( os.path.basename ( dst ) )
+        replace ( src, dst )
+    monkeypatch.setattr ( MacroScanner.os, "replace", Replace )
+    recipe = Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] )
+    cache = tmp_path / "cache"
+    for book in ( "all.macro", "single.macro" ):
+        cookbook = tmp_path / book
+        if book == "all.macro":
+            WriteCookbook ( cookbook, [ recipe ] )
+        else:
+            WriteSingle ( cookbook, recipe )
+        outdir = tmp_path / ( "out_" + book )
+        Scan ( cookbook, tmp_path / "summary.txt", outdir, "--cache", str ( cache ) )
+        converted = ( outdir / "Alpha.lua" ).read_text ()
+#
+#   the cache hit goes to a temporary file, then replaces the Lua file
+#
+        del replaced [ : ]
+        summary = Scan ( cookbook, tmp_path / "summary.txt", outdir, "--cache", str ( cache ), "--atomic" )
+        assert "cache hits = 1\n" in summary
+        assert replaced == [ "Alpha.lua" ]
+        assert ( outdir / "Alpha.lua" ).read_text () == converted
+        assert os.listdir ( outdir ) == [ "Alpha.lua" ]
@@ -0,0 +1,26 @@
+#
+#   test_dedup - regression tests for --dedup
+#
+#   run with: python -m pytest -q
+#
+import os
+
+from test_spirit import Recipe, WriteCookbook, Scan
+
+def Script ( name, **attrs ):
+    rxx = Recipe ( name, "plain", [] )
+    del rxx [ "size" ]
+    rxx [ "type" ] = "script"
+    rxx [ "ver" ] = "0.1"
+    rxx.update ( attrs )
+    return rxx
+
+def test_script_missing ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [
+        Script ( "Empty", script_version = "2" ),
+        Script ( "Blank", script_version = "2" ),
+        ] )
+    summary = Scan ( cookbook, tmp_path / "summary.txt", tmp_path / "out", "--dedup", "--LuaV2" )
+    assert 'duplicate of = "' in summary
+    assert os.listdir ( tmp_path / "out" ) == [ "Empty.lua" ]
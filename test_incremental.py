@@ -0,0 +1,33 @@
+#
+#   test_incremental - regression tests for --incremental
+#
+#   run with: python -m pytest -q
+#
+import os
+
+from test_spirit import Recipe, Comment, WriteCookbook, Scan
+
+def test_filtered_lua_kept ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    outdir = tmp_path / "out"
+    alpha = Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] )
+    beta = Recipe ( "Beta", "plain", [ Comment ( "b" ) ] )
+    WriteCookbook ( cookbook, [ alpha, beta ] )
+    Scan ( cookbook, tmp_path / "s1.txt", outdir, "--incremental" )
+    assert sorted ( os.listdir ( outdir ) ) == [ ".MacroScanner.idx", "Alpha.lua", "Beta.lua" ]
+#
+#   filtered out, but still in the cookbook, keeps its Lua,
+#   both on a full scan and when the cookbook is untouched
+#
+    for run in ( "s2.txt", "s3.txt" ):
+        summary = Scan ( cookbook, tmp_path / run, outdir, "--incremental", "--name", "^Alpha$" )
+        assert "recipes filtered out = 1\n" in summary
+        assert "removed" not in summary
+        assert os.path.exists ( outdir / "Beta.lua" )
+#
+#   gone from the cookbook, its Lua goes too
+#
+    WriteCookbook ( cookbook, [ alpha ] )
+    summary = Scan ( cookbook, tmp_path / "s4.txt", outdir, "--incremental", "--name", "^Beta$" )
+    assert "Lua files removed = 1\n" in summary
+    assert sorted ( os.listdir ( outdir ) ) == [ ".MacroScanner.idx", "Alpha.lua" ]
@@ -0,0 +1,76 @@
+#
+#   test_jobs - regression tests for --jobs and --pipeline
+#
+#   run with: python -m pytest -q
+#
+import io
+import os
+import json
+import argparse
+import zipfile
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook, Scan
+
+def BadAction ():
+#
+#   an action that looks like JSON Spirit, but isn't, 
+#   so it only fails when the recipe is converted
+#
+    return '{\n"name" : \n}\n'
+
+def test_jobs_json_error ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [
+        Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] ),
+        Recipe ( "Bad", "plain", [ BadAction () ] ),
+        Recipe ( "Gamma", "plain", [ Comment ( "c" ) ] ),
+        ] )
+    for jobs in ( "1", "2" ):
+        outdir = tmp_path / ( "out" + jobs )
+        summary = Scan ( cookbook, tmp_path / "summary.txt", outdir, "--jobs", jobs )
+        assert "JSON decode error: Expecting value" in summary
+        assert "JSON errors = 1\n" in summary
+        assert "MacroScanner 1.2 - complete\n" in summary
+        assert sorted ( os.listdir ( outdir ) ) == [ "Alpha.lua", "Gamma.lua" ]
+
+def test_serve_json_error ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [ Recipe ( "Bad", "plain", [ BadAction () ] ) ] )
+    options = argparse.Namespace ( detail = False, noGUI = False, LuaV1 = False, LuaV2 = False, atomic = False )
+    queue = MacroScanner.RecipeQueue ( 2 )
+    try:
+        zipped = MacroScanner.ServeCookbook ( cookbook.read_bytes (), options, queue )
+    finally:
+        queue.close ()
+    with zipfile.ZipFile ( io.BytesIO ( zipped ) ) as zf:
+        assert zf.namelist () == [ "summary.txt" ]
+        assert "JSON errors = 1\n" in zf.read ( "summary.txt" ).decode ( "utf-8" )
+
+def test_pipeline_json_error ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    results = tmp_path / "results.jsonl"
+    for bad in ( 1, 2 ):
+        recipes = [ Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] ),
+                    Recipe ( "Beta", "plain", [ Comment ( "b" ) ] ),
+                    Recipe ( "Gamma", "plain", [ Comment ( "c" ) ] ) ]
+        recipes [ bad ] = Recipe ( "Bad", "plain", [ BadAction () ] )
+        WriteCookbook ( cookbook, recipes )
+        outdir = tmp_path / "out{}".format ( bad )
+#
+#   the bad recipe's error takes the place of its record, with its own
+#   line, on the first run and the next, which tries it again, and its 
+#   error names it, even when it's the last recipe
+#
+        for run in range ( 2 ):
+            summary = Scan ( cookbook, tmp_path / "summary.txt", outdir, "--pipeline", "--incremental",
+                             "--results", str ( results ) )
+            assert "JSON error in recipe = \"Bad\", line {}\n".format ( bad + 3 ) in summary
+            assert "JSON errors = 1\n" in summary
+            assert "MacroScanner 1.2 - complete\n" in summary
+            records = [ json.loads ( line ) for line in results.read_text ().splitlines () ]
+            assert len ( records ) == 3
+            errors = [ record for record in records if record [ "status" ] == "error" ]
+            assert [ record [ "line" ] for record in errors ] == [ bad + 3 ]
+            assert "Bad" not in [ record.get ( "name" ) for record in records ]
@@ -0,0 +1,82 @@
+#
+#   test_jsonize - JSONize gives the same results as the original
+#
+#   run with: python -m pytest -q
+#
+import json
+import types
+
+import MacroScanner
+import MacroBench
+
+def OldJSONize ( spirit ):
+#
+#   JSONize as it was in MacroScanner 1.1
+#
+    rlines = spirit.splitlines ()
+    scount = len ( rlines )
+    rout = ""
+    lout = 0
+    for rll in rlines:
+        lout = lout + 1
+        if  not rll.find ( "{" ) == 0 \
+        and not rll.find ( "}" ) == 0:
+            if lout < scount - 1:
+                rout = rout + rll + ",\n" # add a comma
+            else:
+                rout = rout + rll         # no comma on last one
+    rout = "{\n" + rout + "\n}\n"         # we know it can do that
+    rxx = json.loads ( rout )
+    return rxx
+
+def Outcome ( jsonize, spirit ):
+    try:
+        return jsonize ( spirit )
+    except ValueError as erred:
+        return type ( erred )
+
+def Documents ():
+#
+#   recipes, actions, and ingredients from a MacroBench cookbook,
+#   as JSON Spirit text, one level at a time
+#
+    options = types.SimpleNamespace ( seed = 1, gui = 0.7, size = 15, script_lines = 20,
+                                      commands = list ( MacroScanner.CmdWriter.rxcmds ),
+                                      residues = MacroBench.ResiduesShapes, bands = MacroBench.BandsShapes )
+    maker = MacroBench.RecipeMaker ( options )
+    docs = []
+    todo = [ maker.recipe ( num ) for num in range ( 200 ) ]
+    while todo:
+        obj = todo.pop ()
+        docs.append ( MacroBench.SpiritText ( obj ) )
+        todo.extend ( val for val in obj.values () if isinstance ( val, dict ) )
+    return docs
+
+Oddities = [
+    "",
+    "{\n}\n",
+    "{\n}",
+    "\n",
+    "{\n\n}\n",
+    '{\n"a" : "1"\n}\n',
+    '{\n"a" : "1"\n\n"b" : "2"\n}\n',
+    '{\n"a" : "1"\n"b" : "2"\n}\n\n',
+    '"a" : "1"\n"b" : "2"\n',
+    '{\r\n"a" : "1"\r\n"b" : "x\\ny"\r\n}\r\n',
+    '{\r"a" : "1"\r"b" : "2"\r}\r',
+    '{\n"a" : "1"\x1e"b" : "2"\u2028}\n',
+    '{\n"a" : "1"\n"b" : \n"2"\n}\n',
+    '{\n"a" : "1",\n"b" : "2"\n}\n',
+    '{\n"a" : \n}\n',
+    ]
+
+def test_documents ():
+    docs = Documents ()
+    assert len ( docs ) > 1000
+    for doc in docs:
+        for variant in ( doc, doc.replace ( "\n", "\r\n" ), doc.replace ( "\n", "\n\n" ), doc.rstrip ( "\n" ) ):
+            assert Outcome ( MacroScanner.JSONize, variant ) == Outcome ( OldJSONize, variant ), variant
+
+def test_oddities ():
+    for doc in Oddities:
+        assert Outcome ( MacroScanner.JSONize, doc ) == Outcome ( OldJSONize, doc ), doc
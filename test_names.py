@@ -0,0 +1,33 @@
+#
+#   test_names - regression tests for the Lua file names
+#
+#   run with: python -m pytest -q
+#
+import os
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook, Scan
+from test_dedup import Script
+
+def test_names_agree ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [
+        Script ( "Alpha", script_version = "2", script = "print ( 1 )" ),
+        Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] ),
+        Recipe ( "alpha", "plain", [ Comment ( "b" ) ] ),
+        ] )
+#
+#   the GUI recipes get the same names whether or not the
+#   script is converted, or filtered out, and Cookbook agrees
+#
+    for args in ( (), ( "--LuaV2", ), ( "--type", "gui" ) ):
+        outdir = tmp_path / "out{}".format ( len ( args ) )
+        Scan ( cookbook, tmp_path / "summary.txt", outdir, *args )
+        expect = [ "Alpha_2.lua", "alpha_3.lua" ]
+        if args == ( "--LuaV2", ):
+            expect = [ "Alpha.lua" ] + expect
+        assert sorted ( os.listdir ( outdir ) ) == expect
+    with MacroScanner.Cookbook.open ( str ( cookbook ) ) as book:
+        assert [ entry.filename for entry in book ] == [ "Alpha.lua", "Alpha_2.lua", "alpha_3.lua" ]
+        assert os.path.basename ( book.convert ( book.entries [ 1 ], str ( tmp_path ) ) ) == "Alpha_2.lua"
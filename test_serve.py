@@ -0,0 +1,26 @@
+#
+#   test_serve - regression tests for --serve
+#
+#   run with: python -m pytest -q
+#
+import io
+import argparse
+import zipfile
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook
+
+def test_cache_evicted ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [ Recipe ( "Alpha", "plain", [ Comment ( "a" ) ] ) ] )
+    options = argparse.Namespace ( detail = False, noGUI = False, LuaV1 = False, LuaV2 = False, atomic = False )
+    cache = MacroScanner.RecipeCache ( str ( tmp_path / "cache" ), 0 )
+    queue = MacroScanner.RecipeQueue ( 1, cache )
+    try:
+        for run in range ( 2 ):
+            zipped = MacroScanner.ServeCookbook ( cookbook.read_bytes (), options, queue )
+            with zipfile.ZipFile ( io.BytesIO ( zipped ) ) as zf:
+                assert "cache entries evicted = 1\n" in zf.read ( "summary.txt" ).decode ( "utf-8" )
+    finally:
+        queue.close ()
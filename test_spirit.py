@@ -0,0 +1,128 @@
+#
+#   test_spirit - regression tests for the JSON Spirit parser
+#
+#   run with: python -m pytest -q
+#
+import io
+import sys
+import json
+import contextlib
+
+import MacroScanner
+import MacroBench
+
+def Recipe ( name, desc, actions ):
+#
+#   a GUI recipe with the given actions, as a dictionary
+#   ready for MacroBench.SpiritText
+#
+    rxx = {
+        "name":         name,
+        "desc":         desc,
+        "folder_name":  "test",
+        "hidden":       "0",
+        "mid":          "1",
+        "mrid":         "2",
+        "parent":       "0",
+        "parent_mrid":  "0",
+        "player_id":    "1",
+        "share_scope":  "1",
+        "uses":         "0",
+        "type":         "gui",
+        "size":         str ( len ( actions ) ),
+        }
+    for cmdnum, act in enumerate ( actions ):
+        rxx [ "action-{}".format ( cmdnum ) ] = act
+    return rxx
+
+def Comment ( text ):
+    return { "name": "comment", "comment": { "is_defined": "1", "name": "comment", "value": text } }
+
+def CookbookLine ( num, rxx ):
+    return "{} : {}\n".format ( json.dumps ( "{:016d}".format ( num ) ), json.dumps ( MacroBench.SpiritText ( rxx ), ensure_ascii = False ) )
+
+def WriteCookbook ( path, recipes ):
+    with open ( path, "w", encoding = "utf-8" ) as fo:
+        fo.write ( "version: 1\n{\n" )
+        for num, rxx in enumerate ( recipes ):
+            fo.write ( CookbookLine ( num + 1, rxx ) )
+        fo.write ( "}\nverify: 0\n" )
+
+def Scan ( cookbook, summary, outdir, *args ):
+    argv = sys.argv
+    sys.argv = [ "MacroScanner.py", str ( cookbook ), str ( summary ), "--outdir", str ( outdir ) ] + list ( args )
+    try:
+        with contextlib.redirect_stdout ( io.StringIO () ):
+            MacroScanner.main ()
+    finally:
+        sys.argv = argv
+    with open ( summary, encoding = "utf-8" ) as fi:
+        return fi.read ()
+
+def test_json_desc_stays_text ():
+    rxx = Recipe ( "Desc", '{"mode" : "fast"}', [] )
+    parsed = MacroScanner.SpiritMembers ( CookbookLine ( 1, rxx ), True )
+    assert parsed [ "0000000000000001" ] [ "desc" ] == '{"mode" : "fast"}'
+
+def test_json_comment_stays_text ():
+    rxx = Recipe ( "Note", "plain", [ Comment ( '{"todo" : "tune"}' ) ] )
+    parsed = MacroScanner.SpiritMembers ( CookbookLine ( 1, rxx ), True )
+    comment = parsed [ "0000000000000001" ] [ "action-0" ] [ "comment" ]
+    assert comment.val == '{"todo" : "tune"}'
+
+def test_single_attribute_stays_text ():
+    parsed = MacroScanner.SpiritMembers ( '"desc" : "{\\"mode\\" : \\"fast\\"}"' )
+    assert parsed [ "desc" ] == '{"mode" : "fast"}'
+
+def test_json_text_converted ( tmp_path ):
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [
+        Recipe ( "Desc", '{"mode" : "fast"}', [] ),
+        Recipe ( "Note", "plain", [ Comment ( '{"todo" : "tune"}' ) ] ),
+        ] )
+    summary = Scan ( cookbook, tmp_path / "summary.txt", tmp_path / "out" )
+    assert 'description = "{"mode" : "fast"}"' in summary
+    with open ( tmp_path / "out" / "Desc.lua", encoding = "utf-8" ) as fi:
+        assert 'desc = {"mode" : "fast"}' in fi.read ()
+    with open ( tmp_path / "out" / "Note.lua", encoding = "utf-8" ) as fi:
+        assert '--  {"todo" : "tune"}\n' in fi.read ()
+
+def test_trivial_text_stays_text ( tmp_path ):
+    wiggle = { "name": "wiggle", "num_of_iterations": { "is_defined": "1", "name": "num_of_iterations", "value": "2" } }
+    text = MacroBench.SpiritText ( wiggle )
+    assert isinstance ( MacroScanner.spiritNested ( text, "action-0" ), MacroScanner.GuiCommand )
+    assert not isinstance ( MacroScanner.spiritNested ( text, "desc" ), MacroScanner.GuiCommand )
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [
+        Recipe ( "Wiggle", "plain", [ wiggle ] ),
+        Recipe ( "Echo", text, [ wiggle ] ),
+        ] )
+    Scan ( cookbook, tmp_path / "summary.txt", tmp_path / "out" )
+    with open ( tmp_path / "out" / "Echo.lua", encoding = "utf-8" ) as fi:
+        assert "desc = {\n" in fi.read ()
+
+def WriteSingle ( path, rxx ):
+#
+#   a recipe in single.macro format, one attribute
+#   per line, sorted by name
+#
+    with open ( path, "w", encoding = "utf-8" ) as fo:
+        fo.write ( "{\n" )
+        for key in sorted ( rxx ):
+            value = rxx [ key ]
+            if isinstance ( value, dict ):
+                value = MacroBench.SpiritText ( value )
+            fo.write ( "{} : {}\n".format ( json.dumps ( key ), json.dumps ( value, ensure_ascii = False ) ) )
+        fo.write ( "}\n" )
+
+def test_single_stops_at_size ( tmp_path ):
+    rxx = Recipe ( "Short", "plain", [ Comment ( "c{} \u00e9".format ( cmdnum ) ) for cmdnum in range ( 12 ) ] )
+    rxx [ "size" ] = "3"
+    cookbook = tmp_path / "single.macro"
+    WriteSingle ( cookbook, rxx )
+    Scan ( cookbook, tmp_path / "summary.txt", tmp_path / "out" )
+    with open ( tmp_path / "out" / "Short.lua", encoding = "utf-8" ) as fi:
+        streamed = fi.read ()
+    with MacroScanner.Cookbook.open ( str ( cookbook ) ) as book:
+        assert streamed == book.lua ( book.entries [ 0 ] )
+    assert "c2" in streamed and "c3" not in streamed
@@ -0,0 +1,30 @@
+#
+#   test_stats - regression tests for --stats
+#
+#   run with: python -m pytest -q
+#
+import json
+import time
+
+import MacroScanner
+
+from test_spirit import Recipe, Comment, WriteCookbook, Scan
+
+def test_memo_miss_timed_as_ingredients ( tmp_path, monkeypatch ):
+    getComment = MacroScanner.rxargs [ "comment" ]
+    def SlowComment ( arg, obj ):
+        time.sleep ( 0.05 )
+        return getComment ( arg, obj )
+    monkeypatch.setitem ( MacroScanner.rxargs, "comment", SlowComment )
+    MacroScanner.ResetMemos ()
+    cookbook = tmp_path / "all.macro"
+    WriteCookbook ( cookbook, [ Recipe ( "Alpha", "plain", [ Comment ( "a" ), Comment ( "a" ) ] ) ] )
+    Scan ( cookbook, tmp_path / "summary.txt", tmp_path / "out", "--stats-json", str ( tmp_path / "stats.json" ) )
+    with open ( tmp_path / "stats.json", encoding = "utf-8" ) as fi:
+        totals = json.load ( fi ) [ "totals" ]
+#
+#   the comment is decoded once, by the memo, while the line is parsed
+#
+    assert MacroScanner.Ingredients.misses == 1
+    assert totals [ "ingredients" ] >= 0.05
+    assert totals [ "parse" ] < 0.05